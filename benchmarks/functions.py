@@ -0,0 +1,280 @@
+'''
+Benchmark of every function in functions.json.
+
+Calc-regime functions are calculated with representative inputs, solve-regime functions are solved once for every variable, which can be marked by x in the program.
+For every case, the warm latency, the latency with uncertainties (+- 1 % on every input) and the cost of the unit conversion of the result are measured with the result cache turned off, and the latency of the repeated calculation, which is found in the result cache, separately.
+For solve-regime functions, also the cold latency (symbolic solution by sympy and its compilation) is measured, each in a new process with a timeout. Unknowns, for which sympy takes too long or finds no (real) solution, are measured by the numeric solution (`Engine.solve_numeric`), the method is reported with the results.
+
+    python benchmarks/functions.py --save baseline.json
+    python benchmarks/functions.py --compare baseline.json --threshold 1.5
+'''
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,ROOT)
+
+import numpy as np
+import pint
+
+from engine import Engine, CalculationError
+from result_cache import ResultCache
+from solution_cache import solve_equation, compile_solution
+
+# Representative inputs. For solve-regime functions, the variable under "derive" is calculated from the others first, so that all the values fit together.
+SAMPLES = {
+    "peak-intensity": {"inputs": {"Energy": "1 mJ", "Beam diameter": "2 mm", "Pulse duration": "100 fs"}},
+    "snell-law": {"inputs": {"n1": "1", "n2": "1.5", "theta1": "30 deg"}},
+    "b-integral": {"inputs": {"Wavelength": "800 nm", "n2": "2.19e-20 m^2/W", "Peak intensity": "100 GW/cm^2", "Length": "5 mm"}},
+    "self-focusing": {"inputs": {"Wavelength": "800 nm", "n": "1.45", "n2": "2.19e-20 m^2/W"}},
+    "peak-fluence": {"inputs": {"Energy": "1 mJ", "Beam diameter": "2 mm"}},
+    "refractive-index-fused-silica": {"inputs": {"Wavelength": "800 nm"}},
+    "spot-size": {"inputs": {"Wavelength": "800 nm", "Beam quality": "1.2", "Focal length": "100 mm", "Dia at lens": "5 mm"}},
+    "brewster-angle": {"inputs": {"n1": "1", "n2": "1.5"}},
+    "wavelength-matching": {"inputs": {"b": "800 nm", "c": "1300 nm"}, "derive": "a"},
+    "beam-divergence": {"inputs": {"b": "1.2", "c": "800 nm", "d": "5 mm"}, "derive": "a"},
+    "power-energy-duration": {"inputs": {"b": "1 mJ", "c": "100 fs"}, "derive": "a"},
+    "power-energy-frequency": {"inputs": {"b": "1 mJ", "c": "1 kHz"}, "derive": "a"},
+    "duration-bandwidth": {"inputs": {"a": "800 nm", "b": "10 nm", "c": "0.441271"}, "derive": "d"},
+    "wavelength-frequency": {"inputs": {"a": "800 nm"}, "derive": "b"},
+    "GDD": {"inputs": {"b": "800 nm", "c": "50 cm", "d": "1200 1/mm", "e": "30 deg"}, "derive": "a"},
+    "TOD": {"inputs": {"b": "800 nm", "c": "50 cm", "d": "1200 1/mm", "e": "30 deg"}, "derive": "a"},
+    "diffraction-angle": {"inputs": {"a": "-1", "b": "800 nm", "c": "1200 1/mm", "d": "30 deg"}, "derive": "e"},
+}
+
+
+def time_call(function,min_time=0.2,rounds=5):
+    '''
+    Returns the median time of one call of the function. Every round calls the function so many times, that it takes at least `min_time` / `rounds`.
+    '''
+    start = time.perf_counter()
+    function()
+    single = max(time.perf_counter() - start,1e-7)
+    number = max(1,int(min_time / rounds / single))
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return statistics.median(times)
+
+
+def cold_solve(definition,unknown,queue):
+    '''
+    Runs in a new process: solves and compiles the equation and sends back the time and the solution
+    '''
+    import sympy # Import is not part of the measurement
+    start = time.perf_counter()
+    solution = solve_equation(definition,unknown)
+    solved = time.perf_counter()
+    for sol in solution:
+        compile_solution(definition,unknown,sol)
+    end = time.perf_counter()
+    queue.put((solved - start,end - solved,solution))
+
+
+def measure_cold(definition,unknown,timeout):
+    '''
+    Returns the time of the symbolic solution and of the compilation, and the solution itself, or None, if it took longer than `timeout`
+    '''
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=cold_solve,args=(definition,unknown,queue),daemon=True)
+    process.start()
+    try:
+        result = queue.get(timeout=timeout)
+    except Exception:
+        result = None
+    process.terminate()
+    process.join()
+    return result
+
+
+def with_uncertainty(value):
+    '''
+    Adds +- 1 % uncertainty to "value unit"
+    '''
+    parts = value.split(None,1)
+    magnitude = float(parts[0])
+    unit = parts[1] if len(parts) > 1 else ""
+    return f"{magnitude} +- {abs(magnitude) * 0.01} {unit}"
+
+
+def optional_time(function):
+    '''
+    Times the function, or returns None, if it raises CalculationError (e.g. uncertainties of nonlinear functions)
+    '''
+    try:
+        function()
+    except CalculationError:
+        return None
+    return time_call(function)
+
+
+def cached_time(engine,function):
+    '''
+    Times the function with the result cache turned on, so every call after the first one is found in the cache
+    '''
+    engine.result_cache = ResultCache(engine.settings)
+    try:
+        return optional_time(function)
+    finally:
+        engine.result_cache = ResultCache(engine.settings,maxsize=0)
+
+
+def benchmark_calc(engine,fun,inputs):
+    definition = engine.settings[fun]
+    result = engine.calculate(fun,inputs)
+    other_unit = definition["outputs"]["units"][-1] if definition["outputs"]["units"] else ""
+    return {
+        "regime": "calc",
+        "warm": time_call(lambda: engine.calculate(fun,inputs)),
+        "uncertainty": optional_time(lambda: engine.calculate(fun,{name: with_uncertainty(value) for name, value in inputs.items()})),
+        "conversion": time_call(lambda: result.to(other_unit)),
+        "cached": cached_time(engine,lambda: engine.calculate(fun,inputs)),
+    }
+
+
+def benchmark_solve(engine,fun,knowns,unknown,cold,method="symbolic"):
+    '''
+    `method` is "symbolic" or "numeric" for the unknowns, which sympy cannot solve
+    '''
+    definition = engine.settings[fun]
+    result = engine.solve(fun,knowns,unknown,method=method)
+    other_unit = definition["variables"][unknown]["units"][-1] if definition["variables"][unknown]["units"] else ""
+    return {
+        "regime": "solve",
+        "method": method,
+        "cold_solve": cold[0],
+        "cold_compile": cold[1],
+        "warm": time_call(lambda: engine.solve(fun,knowns,unknown,method=method)),
+        "uncertainty": optional_time(lambda: engine.solve(fun,{name: with_uncertainty(value) for name, value in knowns.items()},unknown,method=method)),
+        "conversion": time_call(lambda: result.to(other_unit)),
+        "cached": cached_time(engine,lambda: engine.solve(fun,knowns,unknown,method=method)),
+    }
+
+
+def run(engine,timeout,selected=None):
+    results = dict()
+    for fun in engine.functions:
+        if selected and fun not in selected:
+            continue
+        if fun not in SAMPLES:
+            print(f"{fun}: no representative inputs, skipped",file=sys.stderr)
+            continue
+        definition = engine.settings[fun]
+        sample = SAMPLES[fun]
+        if definition["regime"] == "calc":
+            results[fun] = benchmark_calc(engine,fun,sample["inputs"])
+            print_row(fun,results[fun])
+            continue
+
+        # Cold solutions first, the solved equations are then used from the cache
+        unknowns = [key for key in engine.parameters(fun) if "value" not in definition["variables"][key]]
+        cold = dict()
+        for unknown in unknowns:
+            cold[unknown] = measure_cold(definition,unknown,timeout)
+            if cold[unknown] is not None:
+                engine.solution_cache.put(fun,unknown,cold[unknown][2])
+        derive = sample["derive"]
+        knowns = dict(sample["inputs"])
+        if cold[derive] is None:
+            print(f"{fun}: cannot derive {derive}, skipped",file=sys.stderr)
+            continue
+        derived = engine.solve(fun,knowns,derive)
+        knowns[derive] = f"{float(derived.magnitude)!r} {definition['variables'][derive]['units'][0] if definition['variables'][derive]['units'] else ''}"
+        for unknown in unknowns:
+            name = f"{fun}:{definition['variables'][unknown]['name']}"
+            others = {key: value for key, value in knowns.items() if key != unknown}
+            # Numeric solution is used, when sympy takes too long or finds no solution or no real one
+            methods = ["symbolic","numeric"] if cold[unknown] is not None and len(cold[unknown][2]) > 0 else ["numeric"]
+            for method in methods:
+                try:
+                    results[name] = benchmark_solve(engine,fun,others,unknown,cold[unknown] or (None,None),method)
+                    break
+                except CalculationError as error:
+                    results[name] = {"regime": "solve", "method": method, "cold_solve": (cold[unknown] or (None,))[0], "status": str(error)}
+            if cold[unknown] is None:
+                results[name]["cold_status"] = "timeout"
+            print_row(name,results[name])
+    return results
+
+
+def milliseconds(value):
+    return "-" if value is None else f"{1e3 * value:.3f}"
+
+
+def print_row(name,result):
+    if result.get("status"):
+        print(f"{name:45} {milliseconds(result.get('cold_solve')):>12} {result['status']}")
+        return
+    cold = result.get("cold_solve")
+    if cold is not None:
+        cold = cold + result["cold_compile"]
+    print(f"{name:45} {milliseconds(cold):>12} {milliseconds(result['warm']):>10} {milliseconds(result['uncertainty']):>12} {milliseconds(result['conversion']):>11} {milliseconds(result.get('cached')):>12} {result.get('method','')}{' (sympy timeout)' if result.get('cold_status') else ''}")
+
+
+def compare(results,baseline,threshold):
+    '''
+    Prints the ratio of the new and baseline times and returns the number of regressions (ratio above `threshold`)
+    '''
+    regressions = 0
+    print(f"\n{'comparison with baseline':45} {'metric':>12} {'ratio':>8}")
+    for name, result in results.items():
+        for metric in ("cold_solve","warm","uncertainty","conversion","cached"):
+            new = result.get(metric)
+            old = baseline.get(name,{}).get(metric)
+            if new is None or old is None or old == 0:
+                continue
+            ratio = new / old
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{name:45} {metric:>12} {ratio:8.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("functions",nargs="*",help="keys of the functions to benchmark, all by default")
+    parser.add_argument("--timeout",type=float,default=60,help="maximal time of one cold symbolic solution in seconds")
+    parser.add_argument("--save",help="save the results as JSON")
+    parser.add_argument("--compare",help="compare with results saved by --save")
+    parser.add_argument("--threshold",type=float,default=1.5,help="ratio of new and baseline time, which is reported as regression")
+    args = parser.parse_args()
+
+    engine = Engine(results_size=0) # Calculations are measured, not the stored results, see `cached_time`
+    print(f"{'function':45} {'cold [ms]':>12} {'warm [ms]':>10} {'+- [ms]':>12} {'units [ms]':>11} {'cached [ms]':>12} method")
+    results = run(engine,args.timeout,args.functions)
+    if args.save:
+        import sympy
+        with open(args.save,"w") as file:
+            json.dump({
+                "meta": {
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__,
+                    "pint": pint.__version__,
+                    "sympy": sympy.__version__,
+                },
+                "results": results,
+            },file,indent=4)
+    if args.compare:
+        with open(args.compare,"r") as file:
+            baseline = json.load(file)["results"]
+        if compare(results,baseline,args.threshold) > 0:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+'''
+Measures the startup time of the calculator. Every measurement runs in a new python process, so that nothing is imported or built beforehand.
+
+    python benchmarks/startup.py [--repeat 5]
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Setup is run before the timer starts, the measured code after it
+MEASUREMENTS = {
+    "import numpy": ("", "import numpy"),
+    "import pint": ("import numpy", "import pint"),
+    "import sympy": ("import numpy", "import sympy"),
+    "unit registry (no cache)": ("import pint", "pint.UnitRegistry()"),
+    "unit registry (shared, disk cache)": ("import engine", "engine.get_registry()"),
+    "import engine": ("", "import engine"),
+    "engine ready": ("", "import engine; engine.Engine()"),
+    "first calculation": ("import engine; e = engine.Engine()", "e.calculate('peak-intensity', {'Energy': '1 mJ', 'Beam diameter': '2 mm', 'Pulse duration': '100 fs'})"),
+    "first solve (imports sympy)": ("import engine; e = engine.Engine()", "e.solve('beam-divergence', {'M2': 1.2, 'Wavelength': '800 nm', 'Diameter': '5 mm'}, 'Divergence')"),
+}
+
+TEMPLATE = '''
+import sys, time
+sys.path.insert(0, {root!r})
+{setup}
+start = time.perf_counter()
+{code}
+print(time.perf_counter() - start)
+'''
+
+
+def measure(setup,code):
+    script = TEMPLATE.format(root=ROOT,setup=setup,code=code)
+    output = subprocess.run([sys.executable,"-c",script],cwd=ROOT,capture_output=True,text=True,check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat",type=int,default=5,help="number of new processes for every measurement")
+    args = parser.parse_args()
+    measure("import engine","engine.get_registry()") # Fills the disk cache of the unit registry
+    print(f"{'measurement':40} {'median [ms]':>12} {'min [ms]':>10}")
+    for name, (setup, code) in MEASUREMENTS.items():
+        times = [measure(setup,code) for _ in range(args.repeat)]
+        print(f"{name:40} {1e3*statistics.median(times):12.1f} {1e3*min(times):10.1f}")
+
+
+if __name__ == "__main__":
+    main()
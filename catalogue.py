@@ -0,0 +1,261 @@
+import collections
+import json
+import os
+
+import numpy as np
+import pint
+
+from units import TEST_VALUE, UnitTable, base_code
+from materials import MaterialDatabase, Materials, parse_constants
+
+
+class NumericSympy():
+    '''
+    Stands in for sympy, when the equations of the solve regime are checked with pint quantities: sympy.Eq gives both sides and the other functions are taken from numpy
+    '''
+    names = {"asin":"arcsin","acos":"arccos","atan":"arctan"}
+
+    @staticmethod
+    def Eq(lhs,rhs):
+        return lhs, rhs
+
+    def __getattr__(self,name):
+        return getattr(np,self.names.get(name,name))
+
+
+class FunctionEntry():
+    '''
+    One validated function from functions.json with its expression compiled into a code object and its parameters ordered by position.
+    `dimensions` are the dimensionalities of the parameters by their names (keys in the solve regime) and `base_code` is the optional plain-number version of the expression, see `units.base_code`.
+    '''
+    def __init__(self,key,definition):
+        self.key = key
+        self.definition = definition
+        self.name = definition["name"]
+        self.regime = definition["regime"]
+        self.code = compile(definition["function"],f"<{key}>","eval")
+        parameters = definition["inputs" if self.regime == "calc" else "variables"]
+        self.parameters = sorted(parameters.keys(),key=lambda name: parameters[name]["position"])
+        self.variable_keys = dict() # Names and keys of the variables of the solve regime, keys take precedence
+        if self.regime == "solve":
+            self.variable_keys = {parameters[key]["name"]: key for key in self.parameters}
+            self.variable_keys.update({key: key for key in self.parameters})
+        self.dimensions = dict()
+        self.output_dimensionality = None
+        self.base_code = None
+
+
+def check_units(ureg,units,what):
+    '''
+    Checks, that all the units are known and convertible to each other. Returns the first unit as a quantity.
+    '''
+    quantities = []
+    for unit in units or [""]:
+        try:
+            quantities.append(ureg(unit))
+        except (pint.UndefinedUnitError, AttributeError, SyntaxError, TypeError, ValueError):
+            raise ValueError(f"unknown unit {unit} of {what}")
+    for quantity, unit in zip(quantities[1:],(units or [""])[1:]):
+        if quantity.dimensionality != quantities[0].dimensionality:
+            raise ValueError(f"unit {unit} of {what} is not convertible to {(units or [''])[0]}")
+    return quantities[0]
+
+
+def check_positions(parameters,what):
+    positions = sorted(parameter.get("position",-1) for parameter in parameters.values())
+    if positions != list(range(len(parameters))):
+        raise ValueError(f"positions of the {what} have to be 0 to {len(parameters) - 1}, each once")
+
+
+def validate(ureg,key,definition,constants,table,materials=None):
+    '''
+    Checks the definition of one function and returns its compiled FunctionEntry. Raises ValueError with the description of the first problem.
+    The expression is evaluated once with all the inputs equal to one in their first units, which finds out, whether it can be evaluated and whether its result has the dimension of the output.
+    All the allowed units are added to the `table` of conversions (see `units.UnitTable`). `materials` are the constants and material tables available in the calc regime, see `materials.Materials`.
+    '''
+    for field in ("name","regime","function"):
+        if not isinstance(definition.get(field),str):
+            raise ValueError(f"missing {field}")
+    if definition["regime"] not in ("calc","solve"):
+        raise ValueError(f"unknown regime {definition['regime']}")
+    for name in definition.get("constants") or []:
+        if name not in constants:
+            raise ValueError(f"unknown constants {name}")
+    try:
+        entry = FunctionEntry(key,definition)
+    except SyntaxError as error:
+        raise ValueError(f"cannot parse the function: {error.msg}")
+    except (KeyError, TypeError, AttributeError) as error:
+        raise ValueError(f"incomplete definition of the inputs or variables ({error})")
+
+    if entry.regime == "calc":
+        if "units" not in definition.get("outputs",{}) or "name" not in definition["outputs"]:
+            raise ValueError("missing name or units of the outputs")
+        check_positions(definition["inputs"],"inputs")
+        I = [None] * len(definition["inputs"])
+        for name, parameter in definition["inputs"].items():
+            I[parameter["position"]] = check_units(ureg,parameter.get("units"),name)
+        output = check_units(ureg,definition["outputs"]["units"],"the outputs")
+        entry.output_dimensionality = output.dimensionality
+        for unit in definition["outputs"]["units"]:
+            table.get(unit)
+        namespace = {"np":np,"ureg":ureg,"I":I,"materials":materials}
+    else:
+        check_positions(definition["variables"],"variables")
+        I = [None] * len(definition["variables"])
+        for name, parameter in definition["variables"].items():
+            if "name" not in parameter:
+                raise ValueError(f"missing name of variable {name}")
+            I[parameter["position"]] = check_units(ureg,parameter.get("units"),parameter["name"])
+            if "value" in parameter:
+                try:
+                    I[parameter["position"]] = float(parameter["value"]) * I[parameter["position"]]
+                except (TypeError, ValueError):
+                    raise ValueError(f"value of {parameter['name']} is not a number")
+        namespace = {"np":np,"sympy":NumericSympy(),"I":I}
+
+    try:
+        with np.errstate(all="ignore"):
+            result = eval(entry.code,namespace)
+        if entry.regime == "calc":
+            if not hasattr(result,"to"): # Plain number
+                result = result * ureg("")
+            result.to(output.units)
+        else:
+            lhs, rhs = result
+            lhs - rhs # Both sides must have the same dimension
+    except pint.DimensionalityError:
+        if entry.regime == "calc":
+            raise ValueError(f"units of the inputs don't give the units of the output {(definition['outputs']['units'] or [''])[0]}")
+        raise ValueError("units of both sides of the equation are different")
+    except (NameError, AttributeError, TypeError, IndexError) as error:
+        raise ValueError(f"cannot evaluate the function: {error}")
+    except (ZeroDivisionError, ValueError, OverflowError):
+        pass # Only these values of inputs are not allowed
+
+    parameters = definition["inputs" if entry.regime == "calc" else "variables"]
+    for name in entry.parameters:
+        entry.dimensions[name] = ureg((parameters[name].get("units") or [""])[0]).dimensionality
+        for unit in parameters[name].get("units") or []:
+            table.get(unit)
+    if entry.regime == "calc":
+        entry.base_code = base_code(ureg,key,definition["function"],table,[TEST_VALUE * quantity for quantity in I],materials)
+    return entry
+
+
+def file_state(path):
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return (status.st_mtime_ns,status.st_size)
+
+
+def update(target,source):
+    '''
+    Makes the dictionary equal to `source` in place without removing the keys, which stay
+    '''
+    target.update(source)
+    for key in [key for key in target.keys() if key not in source]:
+        del target[key]
+
+
+class Catalogue():
+    '''
+    Functions from functions.json and constants from constants.json, which are validated and compiled once, when they are loaded.
+    `settings` and `constants` are the loaded dictionaries, they contain only the valid functions. Invalid functions are left out and their problems are in `errors`.
+    `constant_values` are the parsed constants and `materials` gives them and the tables from `materials_file` to the expressions, see `materials.Materials`.
+    When the files change on the disk, `reload` loads them again and validates and compiles only the changed functions. The dictionaries are updated in place, so they can be shared, and a valid function is never missing from them in the meantime, so they can be read by other threads during the reload.
+    '''
+    def __init__(self,ureg,functions_file,constants_file,materials_file=None):
+        self.ureg = ureg
+        self.units = UnitTable(ureg) # Parsed units of all the functions
+        self.functions_file = functions_file
+        self.constants_file = constants_file
+        self.settings = collections.OrderedDict() # Reordered by move_to_end, so the functions don't disappear for a while
+        self.constants = dict()
+        self.constant_values = dict()
+        self.materials = Materials(MaterialDatabase(ureg,materials_file),self.constant_values,ureg)
+        self.entries = dict()
+        self.by_name = dict()
+        self.errors = dict()
+        self.definitions = dict() # Definitions as they are in the file, also the invalid ones, to find the changed ones
+        self.states = (None,None)
+        self.reload()
+
+    def __getitem__(self,key):
+        return self.entries[key]
+
+    def __contains__(self,key):
+        return key in self.entries
+
+    def keys(self):
+        return list(self.settings.keys())
+
+    def names(self):
+        return [self.settings[key]["name"] for key in self.settings.keys()]
+
+    def key(self,fun):
+        '''
+        Returns the key of the function given by its key or name, or None, if there is no such valid function
+        '''
+        if fun in self.entries:
+            return fun
+        key = self.by_name.get(fun)
+        return key if key in self.entries else None
+
+    def reload(self):
+        '''
+        Loads the files again, if they changed since the last time. Returns the set of keys of the functions, which were added, changed or removed.
+        '''
+        states = (file_state(self.functions_file),file_state(self.constants_file))
+        materials_changed = self.materials.database.reload()
+        if states == self.states and not materials_changed:
+            return set()
+        with open(self.functions_file,"r") as file:
+            definitions = json.load(file)
+        with open(self.constants_file,"r") as file:
+            constants = json.load(file)
+        constants_changed = constants != self.constants
+        if constants_changed:
+            update(self.constants,constants)
+            update(self.constant_values,parse_constants(self.ureg,constants))
+
+        changed = set(self.definitions.keys()) - set(definitions.keys())
+        for key in changed:
+            self.remove(key)
+        for key, definition in definitions.items():
+            if not constants_changed and not materials_changed and key in self.definitions and self.definitions[key] == definition:
+                continue
+            was_valid = key in self.entries
+            # Results of the functions using the constants or tables are not valid, when these change
+            if self.definitions.get(key) != definition or "materials" in str(definition.get("function")):
+                changed.add(key)
+            self.definitions[key] = definition
+            try:
+                entry = validate(self.ureg,key,definition,self.constants,self.units,self.materials)
+            except ValueError as error:
+                self.remove(key)
+                self.definitions[key] = definition
+                self.errors[key] = str(error)
+            else: # The old version is replaced, only when the new one is ready
+                self.entries[key] = entry
+                self.settings[key] = definition
+                self.errors.pop(key,None)
+            if was_valid != (key in self.entries):
+                changed.add(key)
+
+        # Order of the functions is the one in the file
+        for key in definitions.keys():
+            if key in self.settings:
+                self.settings.move_to_end(key)
+        self.by_name = {entry.name: key for key, entry in self.entries.items()}
+        self.states = states
+        return changed
+
+    def remove(self,key):
+        # Function is removed from the settings first, so it is never in them without its entry
+        self.settings.pop(key,None)
+        self.entries.pop(key,None)
+        self.errors.pop(key,None)
+        self.definitions.pop(key,None)
@@ -0,0 +1,302 @@
+'''
+Command line interface of the laser calculator, e.g.
+
+    laser-calculator list
+    laser-calculator materials
+    laser-calculator calc peak-intensity --Energy "1 mJ" --Beam-diameter "2 mm" --Pulse-duration "100 fs" --output "GW/cm^2"
+    laser-calculator calc peak-intensity --Energy "1 mJ" --Beam-diameter "1:5:5" --Pulse-duration "100 fs" --export sweep.csv
+    laser-calculator solve beam-divergence --unknown Divergence --M2 1.2 --Wavelength "800 nm" --Diameter "5 mm"
+    laser-calculator grid spot-size --Wavelength "400:1200:100 nm" --Beam-quality "1:2:10" --Focal-length "50:500:100 mm" --Dia-at-lens "1:10:100 mm" --out grid.npy
+    laser-calculator calc refractive-index-fused-silica --Wavelength "400:1200:5 nm"
+    laser-calculator serve --port 8765
+    laser-calculator --trace trace.jsonl --stats solve duration-bandwidth --unknown "Pulse duration" --Wavelength "800 nm" --Bandwidth "10 nm"
+'''
+import argparse
+import json
+import multiprocessing
+import sys
+
+from engine import Engine, CalculationError, result_dict
+from instrumentation import Instrumentation
+import sweep
+
+
+def normalize(name):
+    '''
+    Names of the inputs are compared without case, and dashes or underscores can be used instead of spaces
+    '''
+    return name.lower().replace("-"," ").replace("_"," ").strip()
+
+
+def parse_pairs(arguments):
+    '''
+    Converts the remaining arguments [--name, value, ...] into a dictionary
+    '''
+    pairs = dict()
+    name = None
+    for argument in arguments:
+        if name is None:
+            if not argument.startswith("--"):
+                raise CalculationError(f"Expected --name value, got {argument}")
+            name = argument[2:]
+            if "=" in name:
+                name, value = name.split("=",1)
+                pairs[name] = value
+                name = None
+        else:
+            pairs[name] = argument
+            name = None
+    if name is not None:
+        raise CalculationError(f"Missing value of {name}")
+    return pairs
+
+
+def match_names(pairs,names):
+    '''
+    Renames the parsed pairs to the names used in the function definition. `names` is a list of the names or a dictionary of the names and the keys, to which they are renamed.
+    '''
+    if not isinstance(names,dict):
+        names = {name: name for name in names}
+    lookup = {normalize(name): key for name, key in names.items()}
+    matched = dict()
+    for name, value in pairs.items():
+        if normalize(name) not in lookup:
+            raise CalculationError(f"Unknown input {name}, possible inputs are: {', '.join(dict.fromkeys(names))}")
+        matched[lookup[normalize(name)]] = value
+    return matched
+
+
+def list_functions(engine,args):
+    for fun in sorted(engine.functions):
+        definition = engine.settings[fun]
+        if definition["regime"] == "calc":
+            names = [f"{name} [{', '.join(definition['inputs'][name]['units'])}]" for name in engine.parameters(fun)]
+        else:
+            names = [f"{definition['variables'][key]['name']} [{', '.join(definition['variables'][key]['units'])}]" for key in engine.parameters(fun)]
+        print(f"{fun} ({definition['regime']}): {definition['name']}")
+        print("    " + "; ".join(names))
+    for fun, error in engine.errors.items():
+        print(f"{fun} is not valid: {error}",file=sys.stderr)
+    return 0
+
+
+def list_materials(engine,args):
+    for material in engine.materials.database.materials():
+        columns = [f"{column} ({lo * 1e6:g} to {hi * 1e6:g} um)" for column, (lo, hi) in material["columns"].items()]
+        print(f"{material['name']}: {', '.join(columns)}")
+        if material["reference"]:
+            print("    " + material["reference"])
+    for group, values in engine.catalogue.constant_values.items():
+        for name, constant in values.items():
+            if constant.quantity is not None:
+                print(f"constant {group} / {name}: {constant.text}")
+    return 0
+
+
+def split_units(values):
+    '''
+    Units are split from the values, so that the values can be ranges, e.g. "1:5:100 mm"
+    '''
+    numbers = dict()
+    units = dict()
+    for name, value in values.items():
+        parts = value.strip().split(None,1)
+        numbers[name] = parts[0]
+        if len(parts) > 1:
+            units[name] = parts[1]
+    return numbers, units
+
+
+def calculate(engine,args,extra):
+    fun = engine.function_key(args.function)
+    if engine.settings[fun]["regime"] != "calc":
+        raise CalculationError(f"{fun} has to be solved, not calculated")
+    values = match_names(parse_pairs(extra),engine.parameters(fun))
+    output_name = engine.settings[fun]["outputs"]["name"]
+    if any(sweep.is_sweep(value) for value in values.values()) or args.export:
+        values, units = split_units(values)
+        inputs, result = engine.calculate_batch(fun,values,units,args.output)
+        if args.export:
+            sweep.export(args.export,inputs,output_name,result)
+        else:
+            sweep.export(sys.stdout,inputs,output_name,result)
+        return 0
+    result = engine.calculate(fun,values,args.output,args.uncertainty,args.samples)
+    print_result(output_name,result,args.json)
+    return 0
+
+
+def solve(engine,args,extra):
+    fun = engine.function_key(args.function)
+    if engine.settings[fun]["regime"] != "solve":
+        raise CalculationError(f"{fun} has to be calculated, not solved")
+    variables = engine.settings[fun]["variables"]
+    # Variables can be given by keys or by names, names take precedence
+    names = {key: key for key in engine.parameters(fun)}
+    names.update({variables[key]["name"]: key for key in engine.parameters(fun)})
+    knowns = match_names(parse_pairs(extra),names)
+    unknown = list(match_names({args.unknown: None},names).keys())[0]
+    bracket = None
+    if args.bracket:
+        bracket = tuple(value.strip() for value in args.bracket.split(":"))
+        if len(bracket) != 2:
+            raise CalculationError("Bracket has to be given as from:to")
+    results = engine.solve_all(fun,knowns,unknown,args.output,timeout=args.timeout,method=args.method,bracket=bracket,uncertainty=args.uncertainty,samples=args.samples)
+    if len(results) == 0:
+        raise CalculationError("No solution found.")
+    for result in results:
+        print_result(variables[unknown]["name"],result,args.json)
+    return 0
+
+
+def calculate_grid(engine,args,extra):
+    fun = engine.function_key(args.function)
+    if engine.settings[fun]["regime"] == "calc":
+        values = match_names(parse_pairs(extra),engine.parameters(fun))
+    else:
+        variables = engine.settings[fun]["variables"]
+        names = {key: key for key in engine.parameters(fun)}
+        names.update({variables[key]["name"]: key for key in engine.parameters(fun)})
+        values = match_names(parse_pairs(extra),names)
+    values, units = split_units(values)
+
+    def progress(done,total):
+        print(f"\r{done} of {total} points",end="",file=sys.stderr,flush=True)
+
+    result, invalid = engine.calculate_grid(fun,values,units,args.output,args.out,args.unknown,args.workers,args.chunk,progress)
+    print(file=sys.stderr)
+    print(f"Grid {' x '.join(str(n) for n in result.shape)} saved to {args.out}" + (f", {invalid} points are not valid" if invalid else ""))
+    return 0
+
+
+def run_pipeline(engine,args,extra):
+    import pipeline
+    try:
+        definition = pipeline.load(args.pipeline)
+    except (OSError, ValueError) as error:
+        raise CalculationError(f"Cannot load the pipeline: {error}")
+    chain = pipeline.Pipeline(engine,definition)
+    values = match_names(parse_pairs(extra),list(chain.inputs.keys()))
+    if any(sweep.is_sweep(value) for value in values.values()) or args.export:
+        inputs, results = chain.run_batch(values)
+        # Results of the nodes are saved as more columns, the last node is the output
+        columns = dict(inputs,**{name: results[name] for name in chain.order[:-1]})
+        sweep.export(args.export or sys.stdout,columns,chain.order[-1],results[chain.order[-1]])
+        return 0
+    chain.set(**values)
+    results = chain.run()
+    for name in chain.order:
+        print_result(f"{name} ({chain.output_name(name)})",results[name],args.json)
+    return 0
+
+
+def print_result(name,result,as_json=False):
+    if as_json:
+        print(json.dumps(result_dict(name,result)))
+    elif hasattr(result,"interval"):
+        print("{} = {:.6gP} (95 % in {:.6gP} to {:.6gP})".format(name,result,*result.interval()))
+    else:
+        print("{} = {:.6gP}".format(name,result))
+
+
+def print_statistics(summary):
+    '''
+    Prints the statistics of the calculations to stderr, so they don't mix with the results
+    '''
+    for fun, statistics in summary.items():
+        stages = ", ".join(f"{stage} {seconds * 1000:.3g} ms" for stage, seconds in statistics["stages"].items())
+        print(f"{fun}: {statistics['count']} calculations, p50 {statistics['p50'] * 1000:.3g} ms, p95 {statistics['p95'] * 1000:.3g} ms ({stages})",file=sys.stderr)
+
+
+def add_uncertainty_arguments(parser):
+    parser.add_argument("--uncertainty",choices=("linear","montecarlo"),help="propagation of uncertainties given by +-, first order (default) or Monte Carlo")
+    parser.add_argument("--samples",type=int,help="number of random samples of the Monte Carlo method")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="laser-calculator",description="Calculator for laser and optics equations. Inputs are given as --name \"value unit\", e.g. --Energy \"1 mJ\" or --Energy \"1 +- 0.1 mJ\".")
+    parser.add_argument("--functions",help="path to functions.json")
+    parser.add_argument("--constants",help="path to constants.json")
+    parser.add_argument("--materials",help="path to materials.json")
+    parser.add_argument("--verify-units",action="store_true",help="compare the results calculated with plain numbers with the ones calculated by pint")
+    parser.add_argument("--trace",help="append the time spent in the stages of every calculation to this file (JSON lines)")
+    parser.add_argument("--profile",help="save the cProfile dump of every calculation to this folder")
+    parser.add_argument("--results",help="file, where the results are stored between the runs, so repeated calculations only convert the stored result")
+    parser.add_argument("--stats",action="store_true",help="print the count and p50/p95 latency of the calculations of every function")
+    subparsers = parser.add_subparsers(dest="command",required=True)
+    subparsers.add_parser("list",help="list the available functions and their inputs")
+    subparsers.add_parser("materials",help="list the materials and constants, which the functions can use")
+    parser_calc = subparsers.add_parser("calc",allow_abbrev=False,help="calculate a function in the calc regime, inputs can be ranges start:stop:n or lists a;b;c")
+    parser_calc.add_argument("function",help="key or name of the function")
+    parser_calc.add_argument("--output",help="unit of the result")
+    parser_calc.add_argument("--export",help="save the inputs and results to a .csv or .npy file")
+    parser_calc.add_argument("--json",action="store_true",help="print the result as JSON")
+    add_uncertainty_arguments(parser_calc)
+    parser_solve = subparsers.add_parser("solve",allow_abbrev=False,help="solve an equation in the solve regime")
+    parser_solve.add_argument("function",help="key or name of the function")
+    parser_solve.add_argument("--unknown",required=True,help="name of the variable to solve for")
+    parser_solve.add_argument("--output",help="unit of the result")
+    parser_solve.add_argument("--timeout",type=float,help="maximal time of the symbolic solution in seconds, then the numeric one is used")
+    parser_solve.add_argument("--method",choices=("auto","symbolic","numeric"),default="auto",help="symbolic solution by sympy, numeric root finding, or numeric, when sympy fails (default)")
+    parser_solve.add_argument("--bracket",help="range from:to in the output unit, where the solutions are searched, e.g. 400:1200")
+    parser_solve.add_argument("--json",action="store_true",help="print the result as JSON")
+    add_uncertainty_arguments(parser_solve)
+    parser_grid = subparsers.add_parser("grid",allow_abbrev=False,help="evaluate a function for all the combinations of the inputs given as ranges start:stop:n or lists a;b;c, in parallel")
+    parser_grid.add_argument("function",help="key or name of the function")
+    parser_grid.add_argument("--unknown",help="variable to solve for, for functions in the solve regime, without a real symbolic solution it is solved numerically (slower)")
+    parser_grid.add_argument("--output",help="unit of the result")
+    parser_grid.add_argument("--out",default="grid.npy",help="file with the results, the axes are saved to the .json file of the same name")
+    parser_grid.add_argument("--workers",type=int,help="number of processes, all the cores by default")
+    parser_grid.add_argument("--chunk",type=int,default=1000000,help="number of points evaluated at once by one process")
+    parser_pipeline = subparsers.add_parser("pipeline",allow_abbrev=False,help="calculate a pipeline of functions defined in a JSON file, see pipeline.py, its inputs can be changed by --name value")
+    parser_pipeline.add_argument("pipeline",help="path to the JSON file with the pipeline")
+    parser_pipeline.add_argument("--export",help="calculate the inputs given as ranges or lists at once and save the results to a .csv or .npy file")
+    parser_pipeline.add_argument("--json",action="store_true",help="print the results as JSON")
+    parser_serve = subparsers.add_parser("serve",help="run the local HTTP/JSON service, see service.py")
+    parser_serve.add_argument("--host",default="127.0.0.1",help="address to listen on, local only by default")
+    parser_serve.add_argument("--port",type=int,default=8765)
+    parser_serve.add_argument("--socket",help="listen on this Unix socket instead of the port")
+    parser_serve.add_argument("--workers",type=int,default=4,help="number of requests handled at once")
+    parser_serve.add_argument("--solutions",default="solutions.pickle",help="file, where the symbolic solutions are kept between the runs")
+    parser_serve.add_argument("--no-warm-up",action="store_true",help="don't solve all the equations in a background process after start")
+    parser_serve.add_argument("--verbose",action="store_true",help="log every request")
+    args, extra = parser.parse_known_args(argv)
+
+    instrumentation = Instrumentation(enabled=bool(args.trace or args.profile or args.stats),trace_file=args.trace)
+    if args.profile:
+        instrumentation.profile_folder = args.profile
+        instrumentation.profile_next(float("inf"))
+    engine = None
+    try:
+        if args.command == "serve":
+            import service
+            engine = Engine(functions_file=args.functions,constants_file=args.constants,materials_file=args.materials,solutions_file=args.solutions,warm_up=not args.no_warm_up,verify_units=args.verify_units,instrumentation=instrumentation,
+                            results_file=args.results)
+            return service.serve(engine,args.host,args.port,args.socket,args.workers,verbose=args.verbose)
+        engine = Engine(functions_file=args.functions,constants_file=args.constants,materials_file=args.materials,verify_units=args.verify_units,instrumentation=instrumentation,results_file=args.results)
+        if args.command == "list":
+            return list_functions(engine,args)
+        elif args.command == "materials":
+            return list_materials(engine,args)
+        elif args.command == "calc":
+            return calculate(engine,args,extra)
+        elif args.command == "solve":
+            return solve(engine,args,extra)
+        elif args.command == "grid":
+            return calculate_grid(engine,args,extra)
+        elif args.command == "pipeline":
+            return run_pipeline(engine,args,extra)
+    except CalculationError as error:
+        print(error,file=sys.stderr)
+        return 1
+    finally:
+        if args.stats:
+            print_statistics(instrumentation.summary())
+        instrumentation.close()
+        if engine is not None and args.command != "serve": # Service saves them itself
+            engine.result_cache.save()
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,868 @@
+import functools
+import os
+import re
+import sys
+import threading
+import warnings
+
+import numpy as np
+import pint
+
+from catalogue import Catalogue
+from solution_cache import SolutionCache, file_hash
+from workers import SolveWorker
+from numeric import NumericSolver
+from uncertainty import Estimate, LinearPropagation, NumericPropagation, SAMPLES, monte_carlo, symbolic_expression
+from units import TOLERANCE
+from instrumentation import Instrumentation
+from result_cache import ResultCache
+import sweep
+import grid
+
+if getattr(sys,"frozen",False): # Frozen by cx_Freeze, the data files are next to the executable
+    DIRECTORY = os.path.dirname(sys.executable)
+else:
+    DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+RESULTS_SIZE = 1000 # Number of the results of calculations kept in the memory, see `Engine.result_key`
+NUMERIC_RANGE = (1e-15,1e15) # Default range of the numeric solutions in the unit of the unknown, it is sampled logarithmically, so that any reasonable value is found
+REGISTRY_CACHE = ":auto:" # Folder for the parsed unit definitions (":auto:" is the user cache folder), None to parse them every time
+
+NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+VALUE_WITH_UNIT = re.compile(rf"^\s*({NUMBER})\s*(?:\+-\s*({NUMBER}))?\s*(.*?)\s*$")
+
+
+class CalculationError(Exception):
+    '''
+    Raised, when the calculation cannot be done. The message is meant to be shown to the user.
+    '''
+    pass
+
+
+def is_real(result):
+    '''
+    Finds out, whether the result is a finite real number (solutions for other values of inputs can be NaN or complex)
+    '''
+    magnitude = result.value.magnitude if hasattr(result,"error") else result.magnitude
+    try:
+        magnitude = magnitude.nominal_value if hasattr(magnitude,"nominal_value") else magnitude
+        return bool(np.isfinite(magnitude) and np.imag(magnitude) == 0)
+    except TypeError:
+        return False
+
+
+def in_bracket(result,bracket):
+    lo, hi = sorted(quantity.to(result.units).magnitude for quantity in bracket)
+    magnitude = result.value.magnitude if hasattr(result,"error") else result.magnitude
+    magnitude = magnitude.nominal_value if hasattr(magnitude,"nominal_value") else magnitude
+    return lo <= magnitude <= hi
+
+
+def parse_unknown(text):
+    '''
+    Finds out, whether the value marks the unknown variable: "x" or "x[lo:hi]" with the bracket for the numeric solution. Returns (False, None), (True, None) or (True, (lo, hi)).
+    '''
+    text = text.strip().replace(",",".")
+    if text == "x":
+        return True, None
+    match = re.match(rf"^x\s*\[\s*({NUMBER})\s*:\s*({NUMBER})\s*\]$",text)
+    if match is None:
+        return False, None
+    return True, (float(match.group(1)),float(match.group(2)))
+
+
+def result_dict(name,result):
+    '''
+    Converts the result (quantity or Estimate with uncertainty) into a dictionary, which can be saved as JSON
+    '''
+    if hasattr(result,"error"):
+        return {"name":name,"value":float(result.value.magnitude),"uncertainty":float(result.error.magnitude),
+                "percentiles":{str(p): float(x.magnitude) for p, x in result.percentiles.items()},"method":result.method,"unit":str(result.units)}
+    return {"name":name,"value":float(result.magnitude),"unit":str(result.units)}
+
+
+def split_value(text):
+    '''
+    Splits text like "1.5 mJ" or "1.5 +- 0.1 mJ" into the value ("1.5" or "1.5 +- 0.1") and the unit ("mJ"). Decimal comma is allowed.
+    '''
+    match = VALUE_WITH_UNIT.match(str(text).replace(",","."))
+    if match is None:
+        raise CalculationError("Cannot convert to numbers!")
+    magnitude, error, unit = match.groups()
+    if error is not None:
+        return f"{magnitude} +- {error}", unit
+    return magnitude, unit
+
+
+def measured(kind):
+    '''
+    Decorator of the methods of the engine, which measures them as calculations of the function given by the first argument, see `instrumentation.Instrumentation`
+    '''
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self,fun,*args,**kwargs):
+            if not self.instrumentation.enabled:
+                return method(self,fun,*args,**kwargs)
+            with self.instrumentation.calculation(self.catalogue.key(fun) or fun,kind):
+                return method(self,fun,*args,**kwargs)
+        return wrapper
+    return decorator
+
+
+registry = None
+registry_lock = threading.Lock()
+
+
+def get_registry(cache_folder=REGISTRY_CACHE):
+    '''
+    Returns the unit registry shared by all the engines in the process. It is built only once, and the parsed definitions are cached on the disk, if pint can do it (version 0.18 and newer).
+    '''
+    global registry
+    with registry_lock:
+        if registry is None:
+            try:
+                registry = pint.UnitRegistry(cache_folder=cache_folder) if cache_folder else pint.UnitRegistry()
+            except (TypeError, OSError): # Older pint or the cache folder is not writable
+                registry = pint.UnitRegistry()
+            pint.set_application_registry(registry)
+        return registry
+
+
+class Engine():
+    '''
+    Calculation part of the laser calculator, which can be used without the GUI.
+    It loads the functions and constants, and calculates or solves them with pint quantities.
+    '''
+    def __init__(self,functions_file=None,constants_file=None,solutions_file=None,ureg=None,warm_up=False,solve_timeout=10,uncertainty="linear",samples=SAMPLES,verify_units=False,instrumentation=None,results_file=None,results_size=RESULTS_SIZE,materials_file=None):
+        '''
+        The files default to the ones next to this module. `solutions_file` is the optional file, where the symbolic solutions are stored between the runs, `warm_up` solves all the equations in the background in a separate process. Without `ureg`, the shared unit registry is used.
+        `solve_timeout` is the maximal time of the symbolic solution in seconds, after which the numeric solution is used, None for no limit.
+        `uncertainty` is the default method of the propagation of uncertainties, "linear" or "montecarlo" with `samples` random samples, see `propagate`.
+        Results are calculated with plain numbers in base SI units, when it is possible, `verify_units` compares every such result with the calculation by pint, see `evaluate`.
+        `instrumentation` measures the stages of the calculations, by default it is disabled, see `instrumentation.Instrumentation`.
+        The last `results_size` results are kept, so that the same calculation is not repeated (0 turns it off), `results_file` is the optional file, where they are stored between the runs, see `result_key`.
+        `materials_file` defines the tables of the materials, which the functions can use together with the constants, see `materials.Materials`.
+        '''
+        self.functions_file = functions_file or os.path.join(DIRECTORY,"functions.json")
+        self.constants_file = constants_file or os.path.join(DIRECTORY,"constants.json")
+        self.materials_file = materials_file or os.path.join(DIRECTORY,"materials.json")
+        self.ureg = ureg if ureg is not None else get_registry()
+        self.catalogue = Catalogue(self.ureg,self.functions_file,self.constants_file,self.materials_file) # Invalid functions are left out, see `errors`
+        self.settings = self.catalogue.settings
+        self.constants = self.catalogue.constants
+        self.materials = self.catalogue.materials
+        self.errors = self.catalogue.errors
+        self.units = self.catalogue.units
+        self.verify_units = verify_units
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        self.solution_cache = SolutionCache(self.settings,path=solutions_file,functions_file=self.functions_file)
+        if warm_up:
+            self.solution_cache.warm_up(solve_timeout)
+        self.result_cache = ResultCache(self.settings,path=results_file,maxsize=results_size)
+        self.solve_worker = SolveWorker() # For solutions with timeout, the process is started only when needed
+        self.solve_lock = threading.Lock() # Worker process solves one equation at a time, also when the engine is used from more threads
+        self.reload_lock = threading.Lock() # Files are loaded by one thread at a time, the others keep calculating meanwhile
+        self.solve_timeout = solve_timeout
+        self.symbolic_failed = set() # Functions and unknowns, which sympy couldn't solve in time, so they are solved numerically
+        self.numeric_solvers = dict()
+        self.uncertainty = uncertainty
+        self.samples = samples
+        self.propagators = dict() # Partial derivatives of the functions for the linear propagation of uncertainties
+        self.functions = self.catalogue.keys()
+        self.functions_names = self.catalogue.names()
+
+    def reload(self):
+        '''
+        Loads functions.json, constants.json and materials.json again, if they changed on the disk, and forgets the solutions of the changed functions. Returns the set of keys of the changed functions.
+        '''
+        with self.reload_lock:
+            try:
+                changed = self.catalogue.reload()
+            except (OSError, ValueError) as error: # The file can be just being written
+                raise CalculationError(f"Cannot load the functions: {error}")
+            if len(changed) == 0:
+                return changed
+            self.forget(changed)
+        return changed
+
+    def forget(self,changed):
+        '''
+        Forgets everything cached for the changed functions. The dictionaries are replaced, not changed, so the calculations running in other threads are not affected.
+        '''
+        try:
+            functions_hash = file_hash(self.functions_file)
+        except OSError:
+            functions_hash = None
+        for fun in changed:
+            self.solution_cache.invalidate(fun,functions_hash)
+            self.result_cache.invalidate(fun)
+            self.numeric_solvers = {key: solver for key, solver in self.numeric_solvers.items() if key[0] != fun}
+            self.symbolic_failed = {key for key in self.symbolic_failed if key[0] != fun}
+            self.propagators = {key: propagator for key, propagator in self.propagators.items() if key[0] != fun}
+        # Lists are changed in place, because the GUI keeps them
+        self.functions[:] = self.catalogue.keys()
+        self.functions_names[:] = self.catalogue.names()
+
+    def function_key(self,fun):
+        '''
+        Returns the key of the function, which can be given either by the key (e.g. "peak-intensity") or by the shown name
+        '''
+        key = self.catalogue.key(fun)
+        if key is None:
+            if fun in self.errors:
+                raise CalculationError(f"Function {fun} is not valid: {self.errors[fun]}")
+            raise CalculationError(f"Unknown function {fun}")
+        return key
+
+    def parameters(self,fun):
+        '''
+        Returns the list of input names (calc regime) or variable keys (solve regime) of the function ordered by position
+        '''
+        return self.catalogue[self.function_key(fun)].parameters
+
+    def variable_key(self,fun,name):
+        '''
+        Returns the key of a variable of solve-regime function, which can be given by its key (e.g. "b") or by its name (e.g. "Wavelength"). Keys take precedence.
+        '''
+        try:
+            return self.catalogue[fun].variable_keys[name]
+        except KeyError:
+            raise CalculationError(f"Unknown variable {name}")
+
+    def unit(self,text):
+        '''
+        Returns the unit parsed only once (see `units.UnitTable`), or the quantity parsed by pint for units like degC
+        '''
+        conversion = self.units.get(text)
+        return conversion.unit if conversion is not None else self.ureg(text)
+
+    def quantity(self,value,unit):
+        '''
+        Creates a quantity from the value, which is a number or a string with optional uncertainty after +-, and from the unit
+        '''
+        if isinstance(value,(self.ureg.Quantity,self.ureg.Measurement)):
+            return value
+        try:
+            value = str(value).replace(",",".").split("+-")
+            magnitude = float(value[0].strip())
+            if len(value) > 1: # If there is uncertainty
+                return (magnitude * self.unit(unit)).plus_minus(float(value[1].strip()))
+            conversion = self.units.get(unit)
+            if conversion is not None:
+                return self.ureg.Quantity(magnitude,conversion.unit)
+            return magnitude * self.ureg(unit)
+        except ValueError:
+            raise CalculationError("Cannot convert to numbers!")
+        except pint.UndefinedUnitError:
+            raise CalculationError(f"Unknown unit {unit}")
+
+    def input_quantity(self,value,units):
+        '''
+        Converts one input to a quantity. It can be a quantity already, a tuple (value, unit), a string with the unit (e.g. "1 mJ") or a number or string without the unit, when the first allowed unit from `units` is used.
+        '''
+        default = units[0] if len(units) > 0 else ""
+        if isinstance(value,(self.ureg.Quantity,self.ureg.Measurement)):
+            return value
+        if isinstance(value,tuple):
+            return self.quantity(value[0],value[1])
+        if isinstance(value,str):
+            value, unit = split_value(value)
+            return self.quantity(value,unit or default)
+        return self.quantity(value,default)
+
+    def convert(self,result,output_unit):
+        '''
+        Converts the result to the desired unit and translates the possible errors
+        '''
+        try:
+            return result.to(self.unit(output_unit))
+        except pint.DimensionalityError:
+            raise CalculationError(f"Cannot convert the result to {output_unit}")
+        except AttributeError: # Result is a plain number
+            return result * self.unit(output_unit)
+
+    def parse_input(self,value,units):
+        '''
+        Splits one input (see `input_quantity`) into its magnitude, uncertainty (None, if it has none) and unit without creating the quantity. Returns None, if it is not a single number.
+        '''
+        error = None
+        if isinstance(value,self.ureg.Quantity):
+            magnitude, unit = value.magnitude, value.units
+            if hasattr(magnitude,"nominal_value"): # Measurement
+                magnitude, error = magnitude.nominal_value, magnitude.std_dev
+        elif isinstance(value,tuple):
+            magnitude, unit = value
+        elif isinstance(value,str):
+            magnitude, unit = split_value(value)
+            unit = unit or (units[0] if len(units) > 0 else "")
+        else:
+            magnitude, unit = value, (units[0] if len(units) > 0 else "")
+        if isinstance(magnitude,str):
+            parts = magnitude.replace(",",".").split("+-")
+            try:
+                magnitude = float(parts[0])
+                error = float(parts[1]) if len(parts) > 1 else None
+            except ValueError:
+                return None
+        elif not isinstance(magnitude,(int,float,np.number)):
+            return None
+        return float(magnitude), error, unit
+
+    def base_magnitude(self,value,units):
+        '''
+        Returns the magnitude of one input (see `input_quantity`) in base SI units and the conversion of its unit, without creating the quantity. Returns (None, None), when pint has to be used: for uncertainties and units, which are not converted just by a factor (e.g. degC).
+        '''
+        parsed = self.parse_input(value,units)
+        if parsed is None or parsed[1] is not None:
+            return None, None
+        conversion = self.units.get(parsed[2])
+        if conversion is None:
+            return None, None
+        return parsed[0] * conversion.factor, conversion
+
+    def result_key(self,fun,values,units,options,uncertainty_options):
+        '''
+        Returns the key of the result in the result cache: the function, the inputs `values` (by names, `units` are their allowed units) as magnitudes and uncertainties in base SI units rounded to 12 digits with their base units, and `options`, which change the result (e.g. the unknown). `uncertainty_options` (method and samples) are added only for the inputs with uncertainties.
+        Returns None, when the result cannot be cached: the cache is off or some input is not converted just by a factor (e.g. degC).
+        '''
+        if not self.result_cache.enabled:
+            return None
+        inputs = []
+        for name in sorted(values.keys()):
+            parsed = self.parse_input(values[name],units[name])
+            if parsed is None:
+                return None
+            magnitude, error, unit = parsed
+            conversion = self.units.get(unit)
+            if conversion is None:
+                return None
+            inputs.append((name,float(f"{magnitude * conversion.factor:.12g}"),None if error is None else float(f"{error * conversion.factor:.12g}"),conversion.base))
+        if any(error is not None for name, magnitude, error, base in inputs):
+            options = (options,uncertainty_options)
+        return (fun,tuple(inputs),options)
+
+    def cached_results(self,key,output_unit):
+        '''
+        Returns the list of results stored under the key (see `result_key`) converted to `output_unit`, or None
+        '''
+        if key is None:
+            return None
+        conversion = self.units.get(output_unit)
+        if conversion is None:
+            return None
+        stored = self.result_cache.get(key,conversion.base)
+        if stored is None:
+            return None
+        quantity = lambda magnitude: self.ureg.Quantity(magnitude / conversion.factor,conversion.unit)
+        results = []
+        for result in stored:
+            if len(result) == 1:
+                results.append(quantity(result[0]))
+            else:
+                value, error, percentiles, method, samples = result
+                results.append(Estimate(quantity(value),quantity(error),{p: quantity(x) for p, x in percentiles},method,samples))
+        return results
+
+    def store_results(self,key,results):
+        '''
+        Stores the list of results (quantities or Estimates in the same unit) under the key as plain numbers in base SI units
+        '''
+        if key is None or len(results) == 0:
+            return
+        conversion = self.units.get(results[0].units)
+        if conversion is None:
+            return
+        stored = []
+        for result in results:
+            if hasattr(result,"error"):
+                stored.append((float(result.value.magnitude * conversion.factor),float(result.error.magnitude * conversion.factor),
+                               tuple((p, float(x.magnitude * conversion.factor)) for p, x in result.percentiles.items()),result.method,result.samples))
+            elif isinstance(result.magnitude,(int,float,np.number)):
+                stored.append((float(np.real(result.magnitude) * conversion.factor),))
+            else:
+                return
+        self.result_cache.put(key,conversion.base,stored)
+
+    def evaluate_base(self,fun,function,names,values,output_unit,dimensionality):
+        '''
+        Evaluates `function` with plain numbers: magnitudes of `values` (inputs by names, see `input_quantity`) in base SI units given in the order of `names`. Its result in base SI units is converted to `output_unit`, which has to have the `dimensionality`.
+        Returns None, if pint has to be used, see `base_magnitude`, also for units of a wrong dimension, for which pint gives the error.
+        '''
+        entry = self.catalogue[fun]
+        parameters = entry.definition["inputs" if entry.regime == "calc" else "variables"]
+        magnitudes = []
+        with self.instrumentation.stage("parse"):
+            for name in names:
+                magnitude, conversion = self.base_magnitude(values[name],parameters[name].get("units") or [])
+                if conversion is None or conversion.dimensionality != entry.dimensions[name]:
+                    return None
+                magnitudes.append(magnitude)
+            conversion = self.units.get(output_unit)
+            if conversion is None or conversion.dimensionality != dimensionality:
+                return None
+        with self.instrumentation.stage("evaluate"):
+            result = function(*magnitudes)
+        with self.instrumentation.stage("convert"):
+            return self.ureg.Quantity(result / conversion.factor,conversion.unit)
+
+    def evaluate_quantities(self,function,arguments,output_unit):
+        '''
+        Evaluates `function` with pint quantities and converts its result to `output_unit`
+        '''
+        with self.instrumentation.stage("evaluate"):
+            result = function(*arguments)
+        with self.instrumentation.stage("convert"):
+            return self.convert(result,output_unit)
+
+    def evaluate(self,fun,fast,slow):
+        '''
+        Returns the result of `fast` (calculation with plain numbers, which returns None, when it cannot be used) or of `slow` (calculation with pint quantities).
+        With `verify_units`, both are calculated and the result of pint is returned, the difference is reported by a warning.
+        '''
+        result = fast()
+        if result is None:
+            return slow()
+        if not self.verify_units:
+            return result
+        expected = slow()
+        if not np.allclose(result.magnitude,expected.to(result.units).magnitude,rtol=TOLERANCE,atol=0,equal_nan=True):
+            warnings.warn(f"{fun}: result with plain numbers {result} differs from pint {expected}",RuntimeWarning)
+        return expected
+
+    def propagate(self,key,function,expression,values,output_unit,uncertainty=None,samples=None):
+        '''
+        Propagates the uncertainties of `values` (quantities or measurements) through `function`, which takes them as positional arguments, and returns Estimate in `output_unit`.
+        `uncertainty` is the method, "linear" (first order) or "montecarlo" with `samples` random samples, the defaults are given to the engine. In the linear method, pint propagates the uncertainties through the simple functions itself. Otherwise `expression` is called to get the sympy expression of the function and its symbols (inputs in base SI units), and its partial derivatives are cached under `key`. When sympy cannot derive it, the derivatives are found numerically.
+        '''
+        uncertainty = uncertainty or self.uncertainty
+        means = [value.value if isinstance(value,self.ureg.Measurement) else value for value in values]
+        errors = [value.error if isinstance(value,self.ureg.Measurement) else 0 * value for value in values]
+        if uncertainty == "montecarlo":
+            try:
+                return Estimate.from_samples(self.convert(monte_carlo(function,means,errors,samples or self.samples),output_unit))
+            except ValueError:
+                raise CalculationError("No valid result, the inputs are outside of the domain of the function.")
+        if uncertainty != "linear":
+            raise CalculationError(f"Unknown method of uncertainties {uncertainty}")
+        try:
+            result = self.convert(function(*values),output_unit)
+            if hasattr(result,"error"):
+                return Estimate.normal(result.value,result.error)
+            if hasattr(result.magnitude,"nominal_value"): # Quantity with the magnitude from the uncertainties package
+                return Estimate.normal(result.magnitude.nominal_value * result.units,result.magnitude.std_dev * result.units)
+            return Estimate.normal(result,0 * result)
+        except (TypeError, AttributeError): # pint cannot propagate the uncertainties e.g. through arcsin
+            pass
+        propagator = self.propagators.get(key) # The dictionary can be replaced by `reload` in the meantime
+        if propagator is None:
+            try:
+                propagator = LinearPropagation(*expression())
+            except Exception: # sympy cannot derive e.g. the interpolated material tables
+                propagator = NumericPropagation(function,[mean.to_base_units().units for mean in means])
+            self.propagators[key] = propagator
+        nominal = self.convert(function(*means),output_unit) # Also gives the units of the result
+        value, error = propagator([mean.to_base_units().magnitude for mean in means],[error.to_base_units().magnitude for error in errors])
+        if not is_real(value * nominal.units) or not np.isfinite(error) or np.imag(error) != 0:
+            raise CalculationError("No real result for these inputs.")
+        scale = (1 * nominal.units).to_base_units().magnitude
+        return Estimate.normal(float(np.real(value)) / scale * nominal.units,float(np.real(error)) / scale * nominal.units)
+
+    @measured("calculate")
+    def calculate(self,fun,inputs,output_unit=None,uncertainty=None,samples=None):
+        '''
+        Calculates the calc-regime function `fun`. `inputs` is a dictionary with the names of the inputs as keys, see `input_quantity` for the possible values. Without `output_unit`, the first allowed unit is used.
+        If some inputs have uncertainties, Estimate is returned, see `propagate` for `uncertainty` and `samples`.
+        '''
+        fun = self.function_key(fun)
+        definition = self.settings[fun]
+        if definition["regime"] != "calc":
+            raise CalculationError(f"{fun} has to be solved, not calculated")
+        for name in definition["inputs"].keys():
+            if name not in inputs:
+                raise CalculationError(f"Missing value of {name}")
+        if output_unit is None:
+            output_unit = (definition["outputs"]["units"] or [""])[0]
+        entry = self.catalogue[fun]
+        with self.instrumentation.stage("cache"):
+            key = self.result_key(fun,{name: inputs[name] for name in entry.parameters},{name: definition["inputs"][name]["units"] for name in entry.parameters},
+                                  None,(uncertainty or self.uncertainty,samples or self.samples))
+            cached = self.cached_results(key,output_unit)
+        if cached is not None:
+            return cached[0]
+        try:
+            fast = lambda: None
+            if entry.base_code is not None: # Inputs are not converted to quantities at all
+                fast = lambda: self.evaluate_base(fun,lambda *I: eval(entry.base_code,{"np":np,"I":list(I),"materials":self.materials.plain}),entry.parameters,inputs,output_unit,entry.output_dimensionality)
+            result = self.evaluate(fun,fast,lambda: self.calculate_quantities(fun,inputs,output_unit,uncertainty,samples))
+        except ZeroDivisionError:
+            raise CalculationError("Cannot divide by zero!")
+        except pint.DimensionalityError:
+            raise CalculationError("Units of the inputs don't fit together!")
+        except TypeError:
+            raise CalculationError("Cannot calculate the function with these inputs.")
+        self.store_results(key,[result])
+        return result
+
+    def calculate_quantities(self,fun,inputs,output_unit,uncertainty=None,samples=None):
+        '''
+        Calculates the calc-regime function with pint quantities, see `calculate`
+        '''
+        definition = self.settings[fun]
+        I = [None] * len(definition["inputs"]) # These will be the quantities with uncertainties and units
+        with self.instrumentation.stage("parse"):
+            for name in definition["inputs"].keys():
+                I[definition["inputs"][name]["position"]] = self.input_quantity(inputs[name],definition["inputs"][name]["units"])
+        code = self.catalogue[fun].code
+        function = lambda *I: eval(code,{"np":np,"ureg":self.ureg,"I":list(I),"materials":self.materials})
+        if any(isinstance(value,self.ureg.Measurement) for value in I):
+            with self.instrumentation.stage("uncertainty"):
+                return self.propagate((fun,None),function,lambda: symbolic_expression(code,len(I),self.ureg),I,output_unit,uncertainty,samples)
+        return self.evaluate_quantities(function,I,output_unit)
+
+    @measured("batch")
+    def calculate_batch(self,fun,values,units=None,output_unit=None):
+        '''
+        Calculates the calc-regime function `fun` once for arrays of inputs. `values` are numbers, arrays or strings (ranges start:stop:n or lists a;b;c) and `units` are their units, first allowed units are used for the missing ones.
+        Returns the dictionary of inputs and the resulting array, see `sweep.calculate_batch`.
+        '''
+        fun = self.function_key(fun)
+        definition = self.settings[fun]
+        if definition["regime"] != "calc":
+            raise CalculationError(f"{fun} has to be solved, not calculated")
+        units = dict(units or {})
+        for name in definition["inputs"].keys():
+            if name not in values:
+                raise CalculationError(f"Missing value of {name}")
+            units.setdefault(name,(definition["inputs"][name]["units"] or [""])[0])
+        if output_unit is None:
+            output_unit = (definition["outputs"]["units"] or [""])[0]
+        try:
+            with self.instrumentation.stage("evaluate"):
+                return sweep.calculate_batch(self.ureg,definition,values,units,output_unit,self.catalogue[fun].code,self.unit,self.materials)
+        except ValueError as error:
+            raise CalculationError(f"Cannot convert to numbers! {error}")
+        except ZeroDivisionError:
+            raise CalculationError("Cannot divide by zero!")
+        except pint.DimensionalityError:
+            raise CalculationError(f"Cannot convert the result to {output_unit}")
+
+    @measured("grid")
+    def calculate_grid(self,fun,values,units=None,output_unit=None,path="grid.npy",unknown=None,workers=None,chunk_size=grid.CHUNK_SIZE,progress=None):
+        '''
+        Evaluates the function for all the combinations of the swept inputs in parallel and saves the results to the .npy file at `path`, see `grid.evaluate_grid`.
+        `values` and `units` are like in `calculate_batch`, but every swept input adds a dimension of the grid (ordered by position). For solve-regime functions, `unknown` is the variable to solve for and the inputs are the other variables given by names or keys.
+        The axes are described in the .json file next to the results. Returns the memory-mapped results and the number of points, which are not finite numbers.
+        '''
+        fun = self.function_key(fun)
+        definition = self.settings[fun]
+        units = dict(units or {})
+        if definition["regime"] == "calc":
+            names = self.parameters(fun)
+            parameters = definition["inputs"]
+        else:
+            if unknown is None:
+                raise CalculationError("Missing unknown")
+            unknown = self.variable_key(fun,unknown)
+            values = {self.variable_key(fun,name): value for name, value in values.items()}
+            units = {self.variable_key(fun,name): unit for name, unit in units.items()}
+            parameters = definition["variables"]
+            names = [key for key in self.parameters(fun) if key != unknown]
+            for key in names:
+                if "value" in parameters[key]:
+                    values.setdefault(key,parameters[key]["value"])
+        axes = []
+        for name in names:
+            if name not in values:
+                raise CalculationError(f"Missing value of {parameters[name].get('name',name)}")
+            try:
+                value = sweep.parse_values(values[name]) if isinstance(values[name],str) else np.asarray(values[name],dtype=float)
+            except ValueError as error:
+                raise CalculationError(f"Cannot convert to numbers! {error}")
+            axes.append((value,units.get(name) or (parameters[name]["units"] or [""])[0]))
+        if len(grid.grid_shape(axes)) == 0:
+            raise CalculationError("No input is swept.")
+        if output_unit is None:
+            output_unit = ((definition["outputs"] if definition["regime"] == "calc" else parameters[unknown])["units"] or [""])[0]
+
+        # The first point is calculated here, which finds the errors of inputs and chooses the solution of the equation
+        first = {name: (float(np.ravel(value)[0]),unit) for name, (value, unit) in zip(names,axes)}
+        task = {"regime":definition["regime"],"definition":definition,"axes":axes,"output_unit":output_unit,"path":path,"shape":grid.grid_shape(axes),
+                "constants":self.constants,"materials_file":self.materials_file}
+        if definition["regime"] == "calc":
+            self.calculate(fun,first,output_unit)
+            output_name = definition["outputs"]["name"]
+        else:
+            quantities = {name: self.input_quantity(value,[]) for name, value in first.items()}
+            try:
+                index = self.choose_solution(fun,unknown,quantities,output_unit)
+                task.update(unknown=unknown,solution=self.solution_cache.get(fun,unknown)[index])
+            except CalculationError: # No real symbolic solution or it takes too long, every point is solved numerically
+                roots = self.solve_numeric(fun,quantities,unknown,output_unit)
+                root = min(roots,key=lambda root: (root.magnitude < 0,abs(root.magnitude)))
+                task.update(unknown=unknown,names=names,root=(float(root.magnitude),output_unit),
+                            brackets=[(lo.magnitude,hi.magnitude,str(lo.units)) for lo, hi in self.default_brackets(fun,unknown,output_unit)])
+            output_name = parameters[unknown]["name"]
+            names = [parameters[name]["name"] for name in names]
+        try:
+            with self.instrumentation.stage("evaluate"):
+                invalid = grid.evaluate_grid(task,workers,chunk_size,progress)
+            grid.save_axes(path,fun,names,axes,output_name,output_unit)
+        except OSError as error:
+            raise CalculationError(f"Cannot save the grid: {error}")
+        return np.load(path,mmap_mode="r"), invalid
+
+    def choose_solution(self,fun,unknown,values,output_unit):
+        '''
+        Returns the index of the symbolic solution, which is used for whole arrays of inputs. It has to give real result for the `values` (quantities by keys), from more real solutions (e.g. +- square root), the positive one is preferred.
+        '''
+        self.solution(fun,unknown,self.solve_timeout)
+        candidates = []
+        for index, (function, arguments) in enumerate(self.solution_cache.evaluators_for(fun,unknown)):
+            try:
+                with np.errstate(all="ignore"):
+                    result = self.convert(function(*[values[name] for name in arguments]),output_unit)
+            except (ZeroDivisionError, TypeError):
+                continue
+            except pint.DimensionalityError:
+                raise CalculationError("Units of the inputs don't fit together!")
+            if is_real(result):
+                candidates.append((result.magnitude < 0,index))
+        if len(candidates) == 0:
+            raise CalculationError("No symbolic solution found, the equation cannot be solved for arrays.")
+        return min(candidates)[1]
+
+    @measured("batch")
+    def solve_batch(self,fun,values,unknown,units=None,output_unit=None):
+        '''
+        Solves the solve-regime function once for arrays of inputs with the symbolic solution chosen by `choose_solution`. `values` and `units` are like in `calculate_batch`, variables are given by names or keys.
+        Returns the dictionary of inputs and the resulting array.
+        '''
+        fun = self.function_key(fun)
+        variables = self.settings[fun]["variables"]
+        unknown = self.variable_key(fun,unknown)
+        values = {self.variable_key(fun,name): value for name, value in values.items()}
+        units = {self.variable_key(fun,name): unit for name, unit in (units or {}).items()}
+        arrays = dict()
+        for key in self.parameters(fun):
+            if key == unknown:
+                continue
+            if key not in values and "value" not in variables[key]:
+                raise CalculationError(f"Missing value of {variables[key]['name']}")
+            value = values.get(key,variables[key].get("value"))
+            try:
+                value = sweep.parse_values(value) if isinstance(value,str) else np.asarray(value,dtype=float)
+            except ValueError as error:
+                raise CalculationError(f"Cannot convert to numbers! {error}")
+            arrays[key] = value
+        try:
+            shaped = np.broadcast_arrays(*arrays.values())
+        except ValueError:
+            raise CalculationError("All swept inputs must have the same number of values")
+        try:
+            inputs = {key: array * self.unit(units.get(key) or (variables[key]["units"] or [""])[0]) for key, array in zip(arrays.keys(),shaped)}
+        except pint.UndefinedUnitError as error:
+            raise CalculationError(f"Unknown unit {error}")
+        if output_unit is None:
+            output_unit = (variables[unknown]["units"] or [""])[0]
+        index = self.choose_solution(fun,unknown,{key: quantity.reshape(-1)[0] for key, quantity in inputs.items()},output_unit)
+        function, arguments = self.solution_cache.evaluators_for(fun,unknown)[index]
+        try:
+            with np.errstate(all="ignore"):
+                result = self.convert(function(*[inputs[key] for key in arguments]),output_unit)
+        except ZeroDivisionError:
+            raise CalculationError("Cannot divide by zero!")
+        except pint.DimensionalityError:
+            raise CalculationError("Units of the inputs don't fit together!")
+        if np.ndim(result.magnitude) < np.ndim(shaped[0]): # Solution, which doesn't depend on the swept inputs
+            result = np.broadcast_to(result.magnitude,shaped[0].shape) * result.units
+        return {variables[key]["name"]: quantity for key, quantity in inputs.items()}, result
+
+    def solution(self,fun,unknown,timeout=None):
+        '''
+        Returns the list of symbolic solutions of the function for the variable with the key `unknown`. If it is not cached and `timeout` is given, it is solved in a separate process, which is stopped after `timeout` seconds.
+        '''
+        if timeout is None or (fun,unknown) in self.solution_cache:
+            return self.solution_cache.get(fun,unknown)
+        with self.solve_lock:
+            if (fun,unknown) in self.solution_cache: # Solved by another thread in the meantime
+                return self.solution_cache.get(fun,unknown)
+            try:
+                solution = self.solve_worker.solve(self.settings[fun],unknown,timeout)
+            except TimeoutError as error:
+                raise CalculationError(str(error))
+            except RuntimeError as error:
+                raise CalculationError(f"Cannot solve the equation: {error}")
+            self.solution_cache.put(fun,unknown,solution)
+        return solution
+
+    def default_brackets(self,fun,unknown,unit):
+        '''
+        Intervals, where the roots are searched numerically, if the user doesn't give any: angles between -90 and 90 degrees, numbers without units between -1000 and 1000, and other quantities in NUMERIC_RANGE of the unit and the same negative range (e.g. GDD)
+        '''
+        units = self.settings[fun]["variables"][unknown]["units"]
+        if "deg" in units or "rad" in units:
+            return [((-90 * self.ureg.deg).to(unit), (90 * self.ureg.deg).to(unit))]
+        if len(units) == 0:
+            return [(-1e3 * self.ureg(""), 1e3 * self.ureg(""))]
+        lo, hi = NUMERIC_RANGE
+        return [(-hi * self.ureg(unit), -lo * self.ureg(unit)), (lo * self.ureg(unit), hi * self.ureg(unit))]
+
+    def solve_numeric(self,fun,values,unknown,output_unit,bracket=None,uncertainty=None,samples=None):
+        '''
+        Finds all the roots of the equation in the bracket (or in the default ones, see `default_brackets`) numerically, `values` are the quantities of the known variables by keys.
+        Raises CalculationError, if there is no root. If some of them have uncertainties, the roots are found for their mean values and the uncertainties are propagated through every root, see `propagate_root`.
+        '''
+        solver = self.numeric_solvers.get((fun,unknown)) # The dictionary can be replaced by `reload` in the meantime
+        if solver is None:
+            solver = self.numeric_solvers[(fun,unknown)] = NumericSolver(self.ureg,self.settings[fun],unknown)
+        if bracket is None:
+            brackets = self.default_brackets(fun,unknown,output_unit)
+        else:
+            brackets = [tuple(self.input_quantity(value,[output_unit]) for value in bracket)]
+        means = {name: value.value if isinstance(value,self.ureg.Measurement) else value for name, value in values.items()}
+        try:
+            with self.instrumentation.stage("numeric"):
+                roots = [root for bracket in brackets for root in solver.roots(means,bracket)]
+        except pint.DimensionalityError:
+            raise CalculationError("Units of the inputs don't fit together!")
+        if len(roots) == 0:
+            ranges = " or ".join(f"{lo.magnitude:g} to {hi.to(lo.units).magnitude:g}" for lo, hi in brackets)
+            raise CalculationError(f"No solution found between {ranges} {brackets[0][0].units:~P}, give another range by x[lo:hi]")
+        if not any(isinstance(value,self.ureg.Measurement) for value in values.values()):
+            return [self.convert(root,output_unit) for root in roots]
+        results = []
+        with self.instrumentation.stage("uncertainty"):
+            for root in roots:
+                try:
+                    results.append(self.propagate_root(solver,values,root,output_unit,uncertainty,samples))
+                except CalculationError:
+                    continue # Root, which disappears for the values around the mean
+        return results
+
+    def propagate_root(self,solver,values,root,output_unit,uncertainty=None,samples=None):
+        '''
+        Propagates the uncertainties of the `values` through the numeric `root` of the equation and returns Estimate in `output_unit`.
+        The linear method uses the derivatives of the root by the known variables (see `NumericSolver.sensitivities`), Monte Carlo follows the root to every sample by Newton's method (see `NumericSolver.follow`).
+        '''
+        uncertainty = uncertainty or self.uncertainty
+        means = {name: value.value if isinstance(value,self.ureg.Measurement) else value for name, value in values.items()}
+        errors = {name: value.error.to_base_units().magnitude for name, value in values.items() if isinstance(value,self.ureg.Measurement)}
+        base = root.to_base_units()
+        if uncertainty == "montecarlo":
+            rng = np.random.default_rng()
+            sampled = dict(means)
+            for name, error in errors.items():
+                mean = means[name].to_base_units()
+                sampled[name] = rng.normal(mean.magnitude,error,samples or self.samples) * mean.units
+            try:
+                return Estimate.from_samples(self.convert(solver.follow(sampled,root) * base.units,output_unit))
+            except ValueError:
+                raise CalculationError("No valid result, the inputs are outside of the domain of the function.")
+        if uncertainty != "linear":
+            raise CalculationError(f"Unknown method of uncertainties {uncertainty}")
+        sensitivities = solver.sensitivities(means,root)
+        error = np.sqrt(sum((sensitivities[name] * error) ** 2 for name, error in errors.items()))
+        if not np.isfinite(error):
+            raise CalculationError("Cannot derive the solution.")
+        return Estimate.normal(self.convert(root,output_unit),self.convert(error * base.units,output_unit))
+
+    def solution_expression(self,fun,unknown,index,arguments):
+        '''
+        Returns the symbolic solution of the function for the unknown and the symbols of its arguments
+        '''
+        import sympy
+        return self.solution_cache.get(fun,unknown)[index], [sympy.symbols(name) for name in arguments]
+
+    @measured("solve")
+    def solve_all(self,fun,knowns,unknown,output_unit=None,timeout=None,method="auto",bracket=None,uncertainty=None,samples=None):
+        '''
+        Solves the solve-regime function `fun` for the variable `unknown` and returns the list of all the real solutions. `knowns` is a dictionary of the other variables (see `input_quantity` for the possible values), variables with assigned value (like speed of light) can be left out. Variables can be given by names or keys.
+        `method` is "symbolic" (sympy), "numeric" (roots in the `bracket`, tuple of two values in the output unit) or "auto", which uses the numeric method when sympy takes longer than `timeout` seconds (default `solve_timeout` of the engine), finds no solution or gives no real one.
+        If some variables have uncertainties, the solutions are Estimates, see `propagate` for `uncertainty` and `samples`.
+        '''
+        fun = self.function_key(fun)
+        definition = self.settings[fun]
+        if definition["regime"] != "solve":
+            raise CalculationError(f"{fun} has to be calculated, not solved")
+        unknown = self.variable_key(fun,unknown)
+        knowns = {self.variable_key(fun,name): value for name, value in knowns.items()}
+        knowns.pop(unknown,None)
+        if output_unit is None:
+            output_unit = (definition["variables"][unknown]["units"] or [""])[0]
+        options = (unknown,method,None if bracket is None else (tuple(bracket),output_unit)) # Bracket is in the output unit
+        with self.instrumentation.stage("cache"):
+            key = self.result_key(fun,knowns,{key: definition["variables"][key]["units"] for key in knowns.keys()},options,(uncertainty or self.uncertainty,samples or self.samples))
+            cached = self.cached_results(key,output_unit)
+        if cached is not None:
+            return cached
+        results = self.find_solutions(fun,knowns,unknown,output_unit,timeout,method,bracket,uncertainty,samples)
+        self.store_results(key,results)
+        return results
+
+    def find_solutions(self,fun,knowns,unknown,output_unit,timeout,method,bracket,uncertainty,samples):
+        '''
+        Solves the function without the result cache, see `solve_all`, `knowns` are given by the keys of the variables
+        '''
+        definition = self.settings[fun]
+        values = dict()
+        with self.instrumentation.stage("parse"):
+            for key, value in knowns.items():
+                values[key] = self.input_quantity(value,definition["variables"][key]["units"])
+            for key in definition["variables"].keys():
+                if key == unknown or key in values:
+                    continue
+                if "value" in definition["variables"][key]:
+                    values[key] = self.input_quantity(definition["variables"][key]["value"],definition["variables"][key]["units"])
+                else:
+                    raise CalculationError(f"Missing value of {definition['variables'][key]['name']}")
+        if timeout is None:
+            timeout = self.solve_timeout
+        if method == "numeric":
+            return self.solve_numeric(fun,values,unknown,output_unit,bracket,uncertainty,samples)
+
+        # Get the compiled solutions for the unknown, their arguments are the other variables (a,b,...)
+        if (fun,unknown) in self.symbolic_failed and method == "auto":
+            return self.solve_numeric(fun,values,unknown,output_unit,bracket,uncertainty,samples)
+        try:
+            with self.instrumentation.stage("solve"):
+                self.solution(fun,unknown,timeout)
+        except CalculationError:
+            if method != "auto":
+                raise
+            self.symbolic_failed.add((fun,unknown))
+            return self.solve_numeric(fun,values,unknown,output_unit,bracket,uncertainty,samples)
+        results = []
+        dimensionality = self.catalogue[fun].dimensions[unknown]
+        uncertain = any(isinstance(value,self.ureg.Measurement) for value in values.values())
+        means = {name: value.value if isinstance(value,self.ureg.Measurement) else value for name, value in values.items()}
+        for index, (function, arguments) in enumerate(self.solution_cache.evaluators_for(fun,unknown)):
+            try:
+                with np.errstate(all="ignore"):
+                    # Solutions, which are not real for the mean values, are left out before the uncertainties are propagated through them
+                    result = self.evaluate(fun,lambda: self.evaluate_base(fun,function,arguments,means,output_unit,dimensionality),
+                                           lambda: self.evaluate_quantities(function,[means[name] for name in arguments],output_unit))
+                    if not is_real(result) or (bracket is not None and not in_bracket(result,[self.input_quantity(value,[output_unit]) for value in bracket])):
+                        continue
+                    if uncertain:
+                        with self.instrumentation.stage("uncertainty"):
+                            result = self.propagate((fun,unknown,index),function,lambda: self.solution_expression(fun,unknown,index,arguments),[values[name] for name in arguments],output_unit,uncertainty,samples)
+            except ZeroDivisionError:
+                raise CalculationError("Cannot divide by zero!")
+            except pint.DimensionalityError:
+                raise CalculationError("Units of the inputs don't fit together!")
+            except TypeError:
+                raise CalculationError("Cannot calculate the solution with these inputs.")
+            if is_real(result):
+                results.append(result)
+        if len(results) == 0 and method == "auto":
+            return self.solve_numeric(fun,values,unknown,output_unit,bracket,uncertainty,samples)
+        return results
+
+    def solve(self,fun,knowns,unknown,output_unit=None,timeout=None,method="auto",bracket=None,uncertainty=None,samples=None):
+        '''
+        Solves the solve-regime function and returns the first real solution, see `solve_all` for the parameters
+        '''
+        results = self.solve_all(fun,knowns,unknown,output_unit,timeout,method,bracket,uncertainty,samples)
+        if len(results) == 0:
+            raise CalculationError("No solution found.")
+        return results[0]
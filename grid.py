@@ -0,0 +1,141 @@
+'''
+Evaluation of a function on the Cartesian product of its inputs (a grid), which can be too large for one array in the memory.
+The grid is split into chunks of flat indices, which are evaluated in a pool of processes. Every process writes its chunks directly into the memory-mapped .npy file, so the results are never sent back and the memory use is given by the chunk size.
+Equations without a usable symbolic solution are solved numerically: the root of the first point is followed by Newton's method for the whole chunk at once and only the points, where it doesn't converge, are searched one by one, which is much slower.
+'''
+import concurrent.futures
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+CHUNK_SIZE = 1000000 # Number of grid points evaluated at once by one process
+
+TASK = None # Grid being evaluated in the worker process, see `start_worker`
+
+
+def grid_shape(axes):
+    '''
+    Shape of the grid given by the list of (values, unit) of the inputs, single numbers don't add a dimension
+    '''
+    return tuple(np.size(values) for values, unit in axes if np.ndim(values) > 0)
+
+
+def start_worker(task):
+    '''
+    Prepares the worker process: gets the unit registry, opens the material tables and compiles the function.
+    `task` is a dictionary with "regime", "definition", "unknown" and "solution" (solve regime), "axes" (list of (values, unit) ordered by position), "output_unit", "path", "shape", "constants" and "materials_file".
+    Instead of "solution", the numeric solution is given by "names" (keys of the axes), "root" (value, unit) of the first point and "brackets" (list of (lo, hi, unit)).
+    '''
+    global TASK
+    from engine import get_registry
+    from materials import MaterialDatabase, Materials, parse_constants
+    TASK = dict(task)
+    TASK["ureg"] = get_registry()
+    if task["regime"] == "calc":
+        code = compile(task["definition"]["function"],"<grid>","eval")
+        materials = Materials(MaterialDatabase(TASK["ureg"],task.get("materials_file")),parse_constants(TASK["ureg"],task.get("constants",{})),TASK["ureg"])
+        TASK["function"] = lambda *I: eval(code,{"np":np,"ureg":TASK["ureg"],"I":list(I),"materials":materials})
+    elif "solution" in task:
+        from solution_cache import compile_solution
+        function, arguments = compile_solution(task["definition"],task["unknown"],task["solution"])
+        TASK["function"] = function
+    else:
+        from numeric import NumericSolver
+        TASK["solver"] = NumericSolver(TASK["ureg"],task["definition"],task["unknown"])
+        TASK["function"] = lambda *arguments: solve_points(dict(zip(task["names"],arguments)))
+
+
+def solve_points(knowns):
+    '''
+    Numeric solution for the arrays of the `knowns` (quantities by keys), see the description of the module. From more roots of one point, the smallest positive one is preferred.
+    '''
+    ureg = TASK["ureg"]
+    solver = TASK["solver"]
+    root = TASK["root"][0] * ureg(TASK["root"][1])
+    units = root.to_base_units().units
+    result = solver.follow(knowns,root)
+    inside = np.zeros(result.shape,dtype=bool) # Newton's method can also end in a root outside of the searched range (e.g. angle over 90 degrees)
+    for lo, hi, unit in TASK["brackets"]:
+        lo, hi = sorted((lo * ureg(unit),hi * ureg(unit)),key=lambda x: x.to_base_units().magnitude)
+        inside |= (result >= lo.to_base_units().magnitude) & (result <= hi.to_base_units().magnitude)
+    result[~inside] = np.nan
+    for i in np.nonzero(np.isnan(result))[0]:
+        point = {key: value[i] if np.ndim(value.magnitude) > 0 else value for key, value in knowns.items()}
+        found = [x for lo, hi, unit in TASK["brackets"] for x in solver.roots(point,(lo * ureg(unit),hi * ureg(unit)))]
+        if len(found) > 0:
+            result[i] = min(found,key=lambda x: (x.magnitude < 0,abs(x.magnitude))).to_base_units().magnitude
+    return result * units
+
+
+def evaluate_chunk(start,stop):
+    '''
+    Evaluates the grid points with flat indices from `start` to `stop` and writes them into the output file. Returns the number of points, which are not finite numbers.
+    '''
+    ureg = TASK["ureg"]
+    index = np.unravel_index(np.arange(start,stop),TASK["shape"]) if len(TASK["shape"]) > 0 else ()
+    arguments = []
+    dimension = 0
+    for values, unit in TASK["axes"]:
+        if np.ndim(values) > 0:
+            arguments.append(values[index[dimension]] * ureg(unit))
+            dimension += 1
+        else:
+            arguments.append(float(values) * ureg(unit))
+    with np.errstate(all="ignore"):
+        result = TASK["function"](*arguments)
+        result = result.to(TASK["output_unit"]).magnitude if hasattr(result,"to") else result
+        result = np.broadcast_to(np.real_if_close(np.asarray(result)),(stop - start,))
+        result = np.where(np.imag(result) == 0,np.real(result),np.nan)
+    output = np.load(TASK["path"],mmap_mode="r+")
+    output.reshape(-1)[start:stop] = result
+    output.flush()
+    del output
+    return int(np.count_nonzero(~np.isfinite(result)))
+
+
+def evaluate_grid(task,workers=None,chunk_size=CHUNK_SIZE,progress=None):
+    '''
+    Evaluates the whole grid described by `task` (see `start_worker`) into the .npy file at task["path"] and returns the number of points, which are not finite numbers.
+    `workers` is the number of processes (all the cores by default), with one worker, the grid is evaluated in this process. `progress` is called with the number of finished points and the number of all the points.
+    '''
+    shape = task["shape"]
+    total = int(np.prod(shape))
+    output = np.lib.format.open_memmap(task["path"],mode="w+",dtype=float,shape=shape)
+    del output
+    chunks = [(start,min(start + chunk_size,total)) for start in range(0,total,chunk_size)]
+    workers = min(workers or os.cpu_count() or 1,len(chunks))
+    invalid = 0
+    done = 0
+    if workers <= 1:
+        start_worker(task)
+        for start, stop in chunks:
+            invalid += evaluate_chunk(start,stop)
+            done += stop - start
+            if progress is not None:
+                progress(done,total)
+        return invalid
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers,mp_context=context,initializer=start_worker,initargs=(task,)) as pool:
+        futures = {pool.submit(evaluate_chunk,start,stop): stop - start for start, stop in chunks}
+        for future in concurrent.futures.as_completed(futures):
+            invalid += future.result()
+            done += futures[future]
+            if progress is not None:
+                progress(done,total)
+    return invalid
+
+
+def save_axes(path,function,names,axes,output_name,output_unit):
+    '''
+    Saves the description of the grid next to the results (grid.npy -> grid.json): the swept inputs in the order of the dimensions with their units and values, and the fixed inputs
+    '''
+    description = {"function":function,"output":{"name":output_name,"unit":output_unit},"axes":[],"fixed":{}}
+    for name, (values, unit) in zip(names,axes):
+        if np.ndim(values) > 0:
+            description["axes"].append({"name":name,"unit":unit,"values":np.asarray(values).tolist()})
+        else:
+            description["fixed"][name] = {"value":float(values),"unit":unit}
+    with open(os.path.splitext(path)[0] + ".json","w") as file:
+        json.dump(description,file,indent=4)
@@ -0,0 +1,147 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+
+class HistoryStore():
+    '''
+    History of the calculations saved in a SQLite database. Every record is written, when it is added, so nothing is lost, if the program crashes.
+    Records are not kept in the memory, they are read from the database page by page, when they are needed.
+    '''
+    def __init__(self,path="history.sqlite3",max_records=None,keep_days=None,legacy_file="history.json"):
+        '''
+        `max_records` is the maximal number of the stored records and `keep_days` the maximal age of the records, older ones are deleted. None means no limit.
+        If there is the history from older versions in `legacy_file`, it is imported and the file is renamed.
+        '''
+        self.path = path
+        self.max_records = max_records
+        self.keep_days = keep_days
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path,check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS history (id INTEGER PRIMARY KEY AUTOINCREMENT, time TEXT NOT NULL, function TEXT NOT NULL, inputs TEXT NOT NULL, outputs TEXT NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS history_function ON history (function, id)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS history_time ON history (time)")
+        self.full_text = self.create_search_index()
+        self.connection.commit()
+        if legacy_file is not None and os.path.exists(legacy_file):
+            self.import_legacy(legacy_file)
+        self.apply_retention()
+
+    def create_search_index(self):
+        '''
+        Creates full-text index of inputs and outputs, which is kept up to date by triggers. Returns False, if SQLite doesn't support it, and search will scan the table.
+        '''
+        exists = self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_search'").fetchone() is not None
+        if exists:
+            return True
+        try:
+            self.connection.execute("CREATE VIRTUAL TABLE history_search USING fts5(inputs, outputs, content='history', content_rowid='id')")
+        except sqlite3.OperationalError:
+            return False
+        self.connection.execute("""CREATE TRIGGER history_search_insert AFTER INSERT ON history BEGIN
+            INSERT INTO history_search (rowid, inputs, outputs) VALUES (new.id, new.inputs, new.outputs); END""")
+        self.connection.execute("""CREATE TRIGGER history_search_delete AFTER DELETE ON history BEGIN
+            INSERT INTO history_search (history_search, rowid, inputs, outputs) VALUES ('delete', old.id, old.inputs, old.outputs); END""")
+        self.connection.execute("INSERT INTO history_search (history_search) VALUES ('rebuild')") # Records saved before the index existed
+        return True
+
+    def import_legacy(self,legacy_file):
+        '''
+        Imports the history.json file, where the keys are times and values are lists of function, inputs and outputs
+        '''
+        try:
+            with open(legacy_file,"r") as file:
+                legacy = json.load(file)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            self.connection.executemany("INSERT INTO history (time, function, inputs, outputs) VALUES (?, ?, ?, ?)",
+                                        [(key,*[str(x) for x in legacy[key]]) for key in sorted(legacy.keys()) if len(legacy[key]) == 3])
+            self.connection.commit()
+        os.replace(legacy_file,legacy_file + ".imported")
+
+    def apply_retention(self):
+        '''
+        Deletes the records over the limit of number and age
+        '''
+        with self.lock:
+            if self.max_records is not None:
+                self.connection.execute("DELETE FROM history WHERE id <= (SELECT MAX(id) FROM history) - ?",(self.max_records,))
+            if self.keep_days is not None:
+                limit = datetime.datetime.now() - datetime.timedelta(days=self.keep_days)
+                self.connection.execute("DELETE FROM history WHERE time < ?",(limit.isoformat(sep=" ",timespec="seconds"),))
+            self.connection.commit()
+
+    def add(self,function,inputs,outputs):
+        '''
+        Saves a new record and returns it as a dictionary with unique id, time, function, inputs and outputs
+        '''
+        now = datetime.datetime.now().isoformat(sep=" ",timespec="seconds")
+        with self.lock:
+            cursor = self.connection.execute("INSERT INTO history (time, function, inputs, outputs) VALUES (?, ?, ?, ?)",(now,function,inputs,outputs))
+            if self.max_records is not None:
+                self.connection.execute("DELETE FROM history WHERE id <= ?",(cursor.lastrowid - self.max_records,))
+            self.connection.commit()
+        return {"id":cursor.lastrowid,"time":now,"function":function,"inputs":inputs,"outputs":outputs}
+
+    def records(self,limit=None,before_id=None,function=None,since=None,until=None,text=None):
+        '''
+        Returns the records from the newest one. Only records older than `before_id` are returned, so the next page starts after the id of the last record of the previous page.
+        Records can be filtered by the function name, by date and time (strings like "2024-01-31" or "2024-01-31 12:00:00", both ends included) and by text in the inputs or outputs.
+        '''
+        conditions = []
+        parameters = []
+        if before_id is not None:
+            conditions.append("id < ?")
+            parameters.append(before_id)
+        if function:
+            conditions.append("function = ?")
+            parameters.append(function)
+        if since:
+            conditions.append("time >= ?")
+            parameters.append(since)
+        if until:
+            conditions.append("time <= ?")
+            parameters.append(until if len(until) > 10 else until + " 23:59:59")
+        if text and text.strip():
+            if self.full_text:
+                # Every word is searched as a prefix, quotes make the special characters harmless
+                query = " ".join('"{}"*'.format(word.replace('"','""')) for word in text.split())
+                conditions.append("id IN (SELECT rowid FROM history_search WHERE history_search MATCH ?)")
+                parameters.append(query)
+            else:
+                conditions.append("(inputs LIKE ? OR outputs LIKE ?)")
+                parameters += [f"%{text.strip()}%"] * 2
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        parameters.append(-1 if limit is None else limit)
+        with self.lock:
+            cursor = self.connection.execute(f"SELECT id, time, function, inputs, outputs FROM history {where} ORDER BY id DESC LIMIT ?",parameters)
+            rows = cursor.fetchall()
+        return [dict(zip(("id","time","function","inputs","outputs"),row)) for row in rows]
+
+    def functions(self):
+        '''
+        Returns the sorted list of the function names in the history
+        '''
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT DISTINCT function FROM history ORDER BY function")]
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def clear(self):
+        '''
+        Deletes all the records
+        '''
+        with self.lock:
+            self.connection.execute("DELETE FROM history")
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
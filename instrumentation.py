@@ -0,0 +1,206 @@
+'''
+Instrumentation of the calculations: time spent in the stages of every calculation (parsing of the inputs, symbolic solution, evaluation, unit conversion, history...), statistics of every function, trace file with one JSON line per calculation and cProfile dumps on demand.
+It is disabled by default, then `calculation` and `stage` return a shared empty context manager, so it costs almost nothing.
+
+    with instrumentation.calculation("peak-intensity","calculate"):
+        with instrumentation.stage("parse"):
+            ...
+
+Calculations started inside another one in the same thread (e.g. the engine called from the GUI) are a part of the outer one.
+'''
+import collections
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+WINDOW = 1000 # Number of the last calculations of every function used for the percentiles
+NOTHING = contextlib.nullcontext()
+
+
+class Stage():
+    '''
+    Adds the time spent inside the `with` block to the stage of the calculation record
+    '''
+    def __init__(self,record,name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self,*exception):
+        stages = self.record["stages"]
+        stages[self.name] = stages.get(self.name,0) + time.perf_counter() - self.start
+        return False
+
+
+class Statistics():
+    '''
+    Aggregated calculations of one function: their count, errors, latencies of the last WINDOW calculations and the total time of the stages
+    '''
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latencies = collections.deque(maxlen=WINDOW)
+        self.stages = dict()
+
+    def add(self,record):
+        self.count += 1
+        if "error" in record:
+            self.errors += 1
+        self.latencies.append(record["seconds"])
+        for stage, seconds in record["stages"].items():
+            self.stages[stage] = self.stages.get(stage,0) + seconds
+
+    def summary(self):
+        p50, p95 = np.percentile(self.latencies,[50,95])
+        return {"count":self.count,"errors":self.errors,"p50":float(p50),"p95":float(p95),
+                "stages":{stage: seconds / self.count for stage, seconds in self.stages.items()}} # Mean time of the stages
+
+
+class Instrumentation():
+    '''
+    Measures the calculations, when it is `enabled`. Every finished calculation is a record (dictionary with "function", "kind", "time", "seconds", "stages" and optional "error" and "profile"), which is added to the statistics, kept as `last` and written to the `trace_file`, if it is given.
+    `profile_next` runs the next calculations under cProfile, the dumps are saved to the `profile_folder`.
+    '''
+    def __init__(self,enabled=False,trace_file=None,profile_folder="profiles"):
+        self.enabled = enabled
+        self.trace_file = trace_file
+        self.profile_folder = profile_folder
+        self.trace = None # Open trace file
+        self.lock = threading.Lock()
+        self.local = threading.local() # Record of the calculation running in the thread
+        self.statistics = dict()
+        self.last = None
+        self.profile_requests = 0
+
+    def enable(self,trace_file=None):
+        '''
+        Starts the measurement, optionally also writing into the `trace_file` (JSON lines)
+        '''
+        with self.lock:
+            if trace_file is not None and trace_file != self.trace_file:
+                self.close_trace()
+                self.trace_file = trace_file
+            self.enabled = True
+
+    def disable(self):
+        with self.lock:
+            self.enabled = False
+            self.close_trace()
+
+    def profile_next(self,count=1):
+        '''
+        Runs the next `count` calculations under cProfile
+        '''
+        with self.lock:
+            self.profile_requests += count
+
+    def calculation(self,fun,kind):
+        '''
+        Context manager measuring one calculation of the function, `kind` is e.g. "calculate" or "solve"
+        '''
+        if not self.enabled or getattr(self.local,"record",None) is not None:
+            return NOTHING
+        return self.measure(fun,kind)
+
+    def stage(self,name):
+        '''
+        Context manager measuring one stage of the running calculation
+        '''
+        if not self.enabled:
+            return NOTHING
+        record = getattr(self.local,"record",None)
+        if record is None:
+            return NOTHING
+        return Stage(record,name)
+
+    def add(self,name,seconds):
+        '''
+        Adds the time of the stage, which was measured elsewhere (e.g. the symbolic solution in the worker process), to the running calculation
+        '''
+        record = getattr(self.local,"record",None)
+        if self.enabled and record is not None:
+            record["stages"][name] = record["stages"].get(name,0) + seconds
+
+    @contextlib.contextmanager
+    def measure(self,fun,kind):
+        record = {"function":fun,"kind":kind,"time":datetime.datetime.now().isoformat(timespec="milliseconds"),"stages":dict()}
+        profiler = None
+        with self.lock:
+            if self.profile_requests > 0:
+                self.profile_requests -= 1
+                profiler = cProfile.Profile()
+        self.local.record = record
+        start = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        except BaseException as error:
+            record["error"] = f"{type(error).__name__}: {error}"
+            raise
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record["seconds"] = time.perf_counter() - start
+            self.local.record = None
+            if profiler is not None:
+                record["profile"] = self.dump(profiler,fun)
+            self.finish(record)
+
+    def dump(self,profiler,fun):
+        '''
+        Saves the profile, which can be read by pstats or snakeviz, and returns its path
+        '''
+        path = os.path.join(self.profile_folder,"{}-{}.prof".format(fun,datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")))
+        try:
+            os.makedirs(self.profile_folder,exist_ok=True)
+            profiler.dump_stats(path)
+        except OSError:
+            return None
+        return path
+
+    def finish(self,record):
+        with self.lock:
+            if record["function"] not in self.statistics:
+                self.statistics[record["function"]] = Statistics()
+            self.statistics[record["function"]].add(record)
+            self.last = record
+            if self.trace_file is None or not self.enabled:
+                return
+            try:
+                if self.trace is None:
+                    self.trace = open(self.trace_file,"a",encoding="utf-8")
+                self.trace.write(json.dumps(record) + "\n")
+                self.trace.flush()
+            except OSError:
+                self.trace_file = None # Tracing is stopped, the calculations go on
+
+    def summary(self):
+        '''
+        Returns the statistics by function: count, errors, p50 and p95 latency and mean time of the stages in seconds
+        '''
+        with self.lock:
+            return {fun: statistics.summary() for fun, statistics in self.statistics.items()}
+
+    def reset(self):
+        with self.lock:
+            self.statistics.clear()
+            self.last = None
+
+    def close_trace(self):
+        if self.trace is not None:
+            self.trace.close()
+            self.trace = None
+
+    def close(self):
+        with self.lock:
+            self.close_trace()
@@ -1,15 +1,39 @@
-import pint
-import numpy as np
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox
-import json
-import sympy
+from tkinter import filedialog
+from tkinter import simpledialog
 import copy
-import datetime
+import multiprocessing
 import os
 import subprocess
+import sys
 import urllib.request
+from engine import Engine, CalculationError, parse_unknown
+from history import HistoryStore
+from instrumentation import Instrumentation
+import sweep
+
+SOLUTIONS_FILE = "solutions.pickle" # Symbolic solutions are stored here between the runs, None to keep them only in memory
+WARM_UP = True # Solve all the equations in a background process after start
+SOLVE_TIMEOUT = 10 # Maximal time of the symbolic solution in seconds, then the equation is solved numerically, None for no limit (can be changed in the Options menu)
+HISTORY_FILE = "history.sqlite3" # Every calculation is saved here immediately
+RESULTS_FILE = "results.pickle" # Results are stored here between the runs, so repeated calculations are not calculated again, None to keep them only in memory
+RESULTS_SIZE = 1000 # Number of the stored results, 0 to calculate everything again
+HISTORY_MAX_RECORDS = 100000 # Older records are deleted, None for no limit
+HISTORY_KEEP_DAYS = None # Records older than this are deleted on start, None for no limit
+HISTORY_PAGE = 200 # Number of records loaded into the history window at once, next ones are loaded when scrolled to the end
+UNCERTAINTY = "linear" # Propagation of uncertainties, "linear" (first order) or "montecarlo" (can be changed in the Options menu)
+MONTE_CARLO_SAMPLES = 100000 # Number of random samples of the Monte Carlo method, more samples are more precise, but slower
+VERIFY_UNITS = False # Compare every result calculated with plain numbers in base SI units with the full calculation by pint, differences are printed as warnings
+INSTRUMENTATION = False # Measure the time spent in the stages of every calculation (can be changed in the debug panel in the Options menu)
+TRACE_FILE = "trace.jsonl" # Measured calculations are appended here as JSON lines, None to keep them only in the debug panel
+PROFILES_FOLDER = "profiles" # cProfile dumps of the calculations profiled from the debug panel
+DEBUG_REFRESH = 1000 # Period in ms of refreshing the debug panel
+LIVE_UPDATE = True # Calculate the result already while the inputs are typed, without pressing the button (can be changed in the Options menu)
+LIVE_DELAY = 300 # Time in ms after the last keystroke, when the live result is calculated
+LIVE_MAX_POINTS = 100000 # Larger sweeps are calculated only by the button, so that the typing is not blocked
+RELOAD_INTERVAL = 2000 # Period in ms of checking, whether functions.json, constants.json or materials.json was edited, None to load them only on start
 
 
 class Calculator(ttk.Frame):    
@@ -28,26 +52,28 @@ class Calculator(ttk.Frame):
         self.master.protocol("WM_DELETE_WINDOW", self.on_closing)      
         self.dir = os.path.dirname(__file__)
         # Loading everything
-        with open('functions.json', 'r') as file:
-            self.settings = json.load(file)
-        with open("constants.json","r") as file:
-            self.constants = json.load(file)
-        try:
-            with open('history.json', 'r') as file:
-                self.history = json.load(file)
-        except FileNotFoundError:
-            self.history = dict()
+        self.engine = Engine(functions_file="functions.json",constants_file="constants.json",materials_file="materials.json",solutions_file=SOLUTIONS_FILE,warm_up=WARM_UP,solve_timeout=SOLVE_TIMEOUT,uncertainty=UNCERTAINTY,samples=MONTE_CARLO_SAMPLES,verify_units=VERIFY_UNITS,results_file=RESULTS_FILE,results_size=RESULTS_SIZE,
+                             instrumentation=Instrumentation(enabled=INSTRUMENTATION,trace_file=TRACE_FILE,profile_folder=PROFILES_FOLDER))
+        self.settings = self.engine.settings
+        self.constants = self.engine.constants
+        self.ureg = self.engine.ureg
+        self.solution_cache = self.engine.solution_cache
+        self.solve_worker = self.engine.solve_worker
+        self.solving = None # Function and unknown, which are being solved in the worker process
+        self.solving_history = True # Whether the result of the solution in the worker process is added to the history, not for the live results
+        self.live_after = None # Scheduled live calculation
+        self.live_inputs = None # Function and normalized inputs of the last live calculation
+        self.history = HistoryStore(HISTORY_FILE,max_records=HISTORY_MAX_RECORDS,keep_days=HISTORY_KEEP_DAYS)
         self.p_history = tk.PhotoImage(master=self,file=r"icons/log.png")
         self.p_clear = tk.PhotoImage(master=self,file=r"icons/delete.png")
         self.p_calc = tk.PhotoImage(master=self,file=r"icons/calc.png")
         self.p_help = tk.PhotoImage(master=self,file=r"icons/help.png").subsample(3)
         self.p_GH = tk.PhotoImage(master=self,file=r"icons/GitHub.png").subsample(2)
         self.p_update = tk.PhotoImage(master=self,file=r"icons/update.png").subsample(3)
-        self.ureg = pint.UnitRegistry()
 
         # Creating function selection
-        self.functions = list(self.settings.keys())
-        self.functions_names = [self.settings[x]["name"] for x in self.functions]
+        self.functions = self.engine.functions
+        self.functions_names = self.engine.functions_names
         functions_names_sorted = copy.deepcopy(self.functions_names)
         functions_names_sorted.sort()
         frame_choose_function = ttk.Frame(self)
@@ -60,7 +86,7 @@ class Calculator(ttk.Frame):
         self.function_dropdown.bind('<<ComboboxSelected>>', self.on_function_selected)
         frame_choose_function.columnconfigure(0,weight=1)
         frame_choose_function.grid(row=0,column=0,sticky="nsew")
-        instructions = "Choose a function to calculate or an equation to solve.\nIn calculation, all inputs must be filled.\nWhen solving, the variable for which you solve should be marked by x.\nUnceratinty can be added for linear functions by +-."
+        instructions = "Choose a function to calculate or an equation to solve.\nIn calculation, all inputs must be filled.\nWhen solving, the variable for which you solve should be marked by x, or by x[from:to] to find all solutions in the range.\nUnceratinty can be added by +-.\nIn calculation, inputs can be swept by writing a range start:stop:n or a list a;b;c."
         self.frame_main = ttk.Frame(self)
         ttk.Label(self.frame_main,text=instructions,wraplength=280,justify="left").grid(row=0,column=0,sticky="ew",columnspan=3)
         self.frame_main.grid(column=0,row=1)
@@ -73,6 +99,20 @@ class Calculator(ttk.Frame):
         self.menu_options.add_command(label="Show history",command=self.show_history,image=self.p_history,compound=tk.LEFT,accelerator="Ctrl+H")
         self.menu_options.add_separator()
         self.menu_options.add_command(label="Clear history",command=self.clear_history,image=self.p_clear,compound=tk.LEFT)
+        self.menu_options.add_separator()
+        self.menu_options.add_command(label="Export sweep",command=self.export_sweep,state="disabled")
+        self.menu_options.add_command(label="Solve timeout",command=self.set_solve_timeout)
+        self.menu_options.add_separator()
+        self.uncertainty_method = tk.StringVar(value=self.engine.uncertainty)
+        self.menu_options.add_radiobutton(label="Linear uncertainties",variable=self.uncertainty_method,value="linear",command=self.set_uncertainty)
+        self.menu_options.add_radiobutton(label="Monte Carlo uncertainties",variable=self.uncertainty_method,value="montecarlo",command=self.set_uncertainty)
+        self.menu_options.add_command(label="Monte Carlo samples",command=self.set_samples)
+        self.menu_options.add_separator()
+        self.live = tk.BooleanVar(value=LIVE_UPDATE)
+        self.menu_options.add_checkbutton(label="Update as you type",variable=self.live,command=self.set_live)
+        self.menu_options.add_separator()
+        self.menu_options.add_command(label="Debug panel",command=self.show_debug)
+        self.last_sweep = None
 
         self.edit_options = tk.Menu(self.menubar)
         self.menubar.add_cascade(menu=self.edit_options,label="Edit")
@@ -87,17 +127,49 @@ class Calculator(ttk.Frame):
         self.menu_help.add_command(label="Check for updates",command=self.check_updates,image=self.p_update,compound=tk.LEFT)
 
         self.history_window_open = False
+        self.debug_window_open = False
+        self.debug_refresh = None # Scheduled refresh of the debug window
         self.bind_all("<Control-KeyPress-h>",self.show_history)
         self.bind_all("<F1>",self.show_readme)
 
+        self.show_invalid_functions(self.engine.errors.keys())
+        if RELOAD_INTERVAL:
+            self.after(RELOAD_INTERVAL,self.reload_functions)
+
+
 
+    def show_invalid_functions(self,keys):
+        '''
+        Warns about the functions from functions.json, which are not valid and so they are not offered
+        '''
+        errors = [f"{key}: {self.engine.errors[key]}" for key in keys if key in self.engine.errors]
+        if errors:
+            messagebox.showwarning(message="These functions are not valid and cannot be used:\n\n" + "\n".join(errors),title="Invalid functions")
+
+    def reload_functions(self):
+        '''
+        Is called periodically, and when functions.json or constants.json was edited, loads the changed functions, so that the program doesn't have to be restarted
+        '''
+        try:
+            changed = self.engine.reload()
+        except CalculationError:
+            changed = set() # File is probably just being saved, it is loaded next time
+        if changed:
+            self.function_dropdown["values"] = sorted(self.functions_names)
+            self.show_invalid_functions(changed)
+            if self.engine.catalogue.key(self.function_selected.get()) in changed:
+                self.on_function_selected()
+        self.after(RELOAD_INTERVAL,self.reload_functions)
 
     def on_closing(self):
         '''
-        On closing of the program, history is saved
+        On closing of the program, solutions are saved (history is saved continuously)
         '''
-        with open('history.json', 'w') as file:
-            json.dump(self.history,file,sort_keys=True, indent=4)
+        self.solve_worker.stop()
+        self.solution_cache.save()
+        self.engine.result_cache.save()
+        self.history.close()
+        self.engine.instrumentation.close()
         self.master.destroy()
 
     def show_history(self,event=None):
@@ -114,6 +186,29 @@ class Calculator(ttk.Frame):
         self.history_window.iconbitmap(bitmap="Icon.ico")
         self.history_window.title("History")
         self.history_window.protocol("WM_DELETE_WINDOW", self.close_history)        
+
+        # Filters, which are evaluated by the history database
+        frame_filter = ttk.Frame(self.history_window)
+        self.history_function = tk.StringVar()
+        self.history_since = tk.StringVar()
+        self.history_until = tk.StringVar()
+        self.history_text = tk.StringVar()
+        ttk.Label(frame_filter,text="Function:").grid(row=0,column=0,sticky="w")
+        function_CB = ttk.Combobox(frame_filter,textvariable=self.history_function,width=30)
+        function_CB["values"] = [""] + self.history.functions()
+        function_CB.state(["readonly"])
+        function_CB.bind('<<ComboboxSelected>>', self.filter_history)
+        function_CB.grid(row=0,column=1,sticky="w")
+        ttk.Label(frame_filter,text="From (YYYY-MM-DD):").grid(row=0,column=2,sticky="w")
+        ttk.Entry(frame_filter,textvariable=self.history_since,width=12).grid(row=0,column=3,sticky="w")
+        ttk.Label(frame_filter,text="To:").grid(row=0,column=4,sticky="w")
+        ttk.Entry(frame_filter,textvariable=self.history_until,width=12).grid(row=0,column=5,sticky="w")
+        ttk.Label(frame_filter,text="Search:").grid(row=0,column=6,sticky="w")
+        ttk.Entry(frame_filter,textvariable=self.history_text,width=30).grid(row=0,column=7,sticky="ew")
+        ttk.Button(frame_filter,text="Filter",command=self.filter_history).grid(row=0,column=8,sticky="e")
+        frame_filter.columnconfigure(7,weight=1)
+        frame_filter.grid(column=1,row=0,columnspan=2,sticky="ew")
+        self.history_window.bind("<Return>",self.filter_history)
         
         # Configure the Treeview widget, where the history is shown
         self.history_tree = ttk.Treeview(self.history_window,columns=("function","inputs","outputs"))
@@ -126,16 +221,50 @@ class Calculator(ttk.Frame):
         self.history_tree.column("inputs",stretch=True,width=350)
         self.history_tree.column("outputs",stretch=True,width=350)        
         self.history_tree.grid(column=1,row=1,sticky="nsew")
-        scrlbar = ttk.Scrollbar(self.history_window,command=self.history_tree.yview)
-        self.history_tree.config(yscrollcommand = scrlbar.set)
-        scrlbar.grid(column=2,row=1,sticky="nsew")
+        self.history_scrlbar = ttk.Scrollbar(self.history_window,command=self.history_tree.yview)
+        self.history_tree.config(yscrollcommand = self.on_history_scroll)
+        self.history_scrlbar.grid(column=2,row=1,sticky="nsew")
         self.history_window.columnconfigure(1,weight=1)
         self.history_window.rowconfigure(1,weight=1)
         self.history_window_open = True
 
-        # Insert the values
-        for key in self.history.keys():
-            self.history_tree.insert("",0,text=key,values=self.history[key])
+        # Insert the first page of values
+        self.filter_history()
+
+    def filter_history(self,event=None):
+        '''
+        Empties the history window and loads the first page of records fulfilling the filters
+        '''
+        self.history_tree.delete(*self.history_tree.get_children())
+        self.history_filters = {"function":self.history_function.get(),
+                                "since":self.history_since.get().strip(),
+                                "until":self.history_until.get().strip(),
+                                "text":self.history_text.get()}
+        self.history_last_id = None
+        self.history_complete = False
+        self.load_history_page()
+
+    def load_history_page(self):
+        '''
+        Appends next page of records to the history window
+        '''
+        if self.history_complete:
+            return
+        records = self.history.records(limit=HISTORY_PAGE,before_id=self.history_last_id,**self.history_filters)
+        for record in records:
+            self.history_tree.insert("","end",text=record["time"],values=(record["function"],record["inputs"],record["outputs"]))
+        if len(records) < HISTORY_PAGE:
+            self.history_complete = True
+        if len(records) > 0:
+            self.history_last_id = records[-1]["id"]
+
+    def on_history_scroll(self,first,last):
+        '''
+        Moves the scrollbar and loads next page of records, when the end of the list is close
+        '''
+        self.history_scrlbar.set(first,last)
+        if float(last) > 0.9 and not self.history_complete:
+            self.after_idle(self.load_history_page)
     
     def close_history(self):
         '''
@@ -146,12 +275,12 @@ class Calculator(ttk.Frame):
 
     def add_history(self,what=()):
         '''
-        Add new historical record, with key being date and time and value being tuple of function, inputs and outputs
+        Add new historical record, which is a tuple of function, inputs and outputs. It gets unique id and date and time in the history store.
         '''
-        now = datetime.datetime.now().isoformat(sep=" ",timespec="seconds")
-        self.history[str(now)] = what 
-        if self.history_window_open:
-            self.history_tree.insert("",0,text=now,values=what)
+        with self.engine.instrumentation.stage("history"):
+            record = self.history.add(*what)
+        if self.history_window_open and not any(self.history_filters.values()):
+            self.history_tree.insert("",0,text=record["time"],values=what)
 
     def clear_history(self):
         '''
@@ -160,7 +289,7 @@ class Calculator(ttk.Frame):
         answer = messagebox.askyesno(title='Confirmation',
                                      message='Are you sure that you want to delete history?')
         if answer:
-            self.history = dict()
+            self.history.clear()
             if self.history_window_open:
                 for children in self.history_tree.get_children():
                     self.history_tree.delete(children)
@@ -203,6 +332,8 @@ class Calculator(ttk.Frame):
         Called, when a function is selected, and will built the GUI of the program with the help of two other function, depending on the calculation regime. It will also create the view for the constants.
         '''
         # Get rid of previous GUI elements
+        if self.solving is not None:
+            self.cancel_solve()
         try:
             self.frame_main.grid_forget()            
             self.frame_main.destroy()
@@ -215,7 +346,9 @@ class Calculator(ttk.Frame):
             pass
 
         # Show the description and formula
-        fun = self.functions[self.functions_names.index(self.function_selected.get())]
+        fun = self.engine.catalogue.key(self.function_selected.get())
+        if fun is None: # Function is no more valid
+            return
         self.frame_main = ttk.Frame(self)
         ttk.Label(self.frame_main,text=self.settings[fun]["description"],wraplength=280,justify="left").grid(row=0,column=0,sticky="ew",columnspan=3)
         try:
@@ -292,13 +425,19 @@ class Calculator(ttk.Frame):
                 self.var_CB[ind].state(["readonly"])
             self.var_CB[ind].grid(row=2+ind,column=2,sticky="e")
         
-        ttk.Button(self.frame_main,text="Solve",command=self.calculate_btn,image=self.p_calc,compound=tk.LEFT).grid(row=101,column=0,columnspan=3,sticky="ew")
+        self.solve_button = ttk.Button(self.frame_main,text="Solve",command=self.calculate_btn,image=self.p_calc,compound=tk.LEFT)
+        self.solve_button.grid(row=101,column=0,columnspan=3,sticky="ew")
         self.result = tk.StringVar(value="Result")
         self.result_number = tk.StringVar()
         ttk.Label(self.frame_main,textvariable=self.result,font=("Arial", 18),wraplength=280).grid(row=102,column=0,columnspan=3,sticky="ew")
         ttk.Entry(self.frame_main,textvariable=self.result_number).grid(row=103,column=0,columnspan=3,sticky="ew")
+        # Progress is shown only while the equation is being solved
+        self.solve_progress = ttk.Progressbar(self.frame_main,mode="indeterminate")
+        self.solve_cancel = ttk.Button(self.frame_main,text="Cancel",command=self.cancel_solve)
         self.frame_main.columnconfigure(1,weight=1)
         self.frame_main.grid(column=0,row=1)
+        self.trace_inputs(self.var_values + self.var_units)
+        self.solve_worker.start() # Starting the process and importing sympy takes a while, so it is done in advance
 
 
     def build_calc(self,fun):
@@ -345,36 +484,111 @@ class Calculator(ttk.Frame):
         ttk.Entry(self.frame_main,textvariable=self.result_number).grid(row=103,column=0,columnspan=3,sticky="ew")
         self.frame_main.columnconfigure(1,weight=1)
         self.frame_main.grid(column=0,row=1)
+        self.trace_inputs(self.inputs_values + self.inputs_units + [self.output])
 
-    def calculate_btn(self):
+    def trace_inputs(self,variables):
         '''
-        Is called after the user clicks on the button, and based on the regime, calls the appropriate calculate or solve function
+        Every change of the inputs schedules the live calculation
+        '''
+        self.cancel_live()
+        self.live_inputs = None
+        for variable in variables:
+            variable.trace_add("write",self.schedule_live)
+
+    def schedule_live(self,*args):
+        '''
+        Calculates the result LIVE_DELAY after the last change of the inputs, so it is not calculated for every keystroke
+        '''
+        self.cancel_live()
+        if self.live.get():
+            self.live_after = self.after(LIVE_DELAY,self.live_update)
+
+    def cancel_live(self):
+        if self.live_after is not None:
+            self.after_cancel(self.live_after)
+            self.live_after = None
+
+    def set_live(self):
+        self.live_inputs = None
+        self.schedule_live()
+
+    def normalized_inputs(self,fun):
+        '''
+        Returns the function and its inputs as they are calculated (without spaces and with decimal dots), so that edits, which don't change them, are not calculated again
         '''
-        fun = self.functions[self.functions_names.index(self.function_selected.get())]
         if self.settings[fun]["regime"] == "calc":
-            self.calculate(fun)
-        elif self.settings[fun]["regime"] == "solve":
-            self.solve(fun)
+            values, units = self.inputs_values, self.inputs_units + [self.output]
         else:
-            self.write("Something is wrong with the definition.")
+            values, units = self.var_values, self.var_units
+        return (fun,tuple("".join(value.get().split()).replace(",",".") for value in values),tuple(unit.get() for unit in units))
+
+    def live_update(self):
+        '''
+        Calculates the result of the changed inputs without adding it to the history. The solutions, evaluators and results cached by the engine are reused, so only the new inputs are calculated.
+        '''
+        self.live_after = None
+        fun = self.engine.catalogue.key(self.function_selected.get())
+        if fun is None:
+            return
+        try:
+            inputs = self.normalized_inputs(fun)
+        except (AttributeError, tk.TclError): # GUI of the function is being built
+            return
+        if inputs == self.live_inputs:
+            return
+        self.live_inputs = inputs
+        if self.settings[fun]["regime"] == "calc":
+            try:
+                points = max(sweep.count_values(value.get()) for value in self.inputs_values)
+            except ValueError: # Range is not complete yet, it is reported by the calculation
+                points = 0
+            if points > LIVE_MAX_POINTS:
+                self.write(f"Sweep of {points} points is calculated by the button")
+                return
+        try:
+            with self.engine.instrumentation.calculation(fun,"live"):
+                if self.settings[fun]["regime"] == "calc":
+                    self.calculate(fun,history=False)
+                else:
+                    self.solve(fun,history=False)
+        except Exception as error: # e.g. MemoryError, the live result must not break the typing
+            self.write(f"{type(error).__name__}: {error}")
+
+    def calculate_btn(self):
+        '''
+        Is called after the user clicks on the button, and based on the regime, calls the appropriate calculate or solve function
+        '''
+        try:
+            fun = self.engine.function_key(self.function_selected.get())
+        except CalculationError as error:
+            self.write(error)
+            return
+        # Calculation done by the engine is measured as a part of this one, which includes also the history
+        with self.engine.instrumentation.calculation(fun,self.settings[fun]["regime"]):
+            if self.settings[fun]["regime"] == "calc":
+                self.calculate(fun)
+            elif self.settings[fun]["regime"] == "solve":
+                self.solve(fun)
+            else:
+                self.write("Something is wrong with the definition.")
     
-    def solve(self,fun):
+    def solve(self,fun,history=True):
         '''
-        Is called in the solving regime, when the user filled the input values and wants to know the results
+        Is called in the solving regime, when the user filled the input values and wants to know the results, `history` is False for the live results
         '''
         found_x = False
-        I = [None] * len(self.var_values) # Symbols, which will eventually appear as variables in the solved function
-        str_to_eval = [None] * len(self.var_values) # This will assign values to the symbols
+        knowns = dict() # Values and units of the variables, which are not solved for
         inputs = "" # This is string to add to history
 
         # Deciding, what to solve
         for name in self.settings[fun]["variables"].keys():
             ind = self.settings[fun]["variables"][name]["position"]
-            I[ind] = sympy.symbols(name)
             value = self.var_values[ind].get().strip().replace(",",".")
-            if value == "x":
+            is_x, x_bracket = parse_unknown(value)
+            if is_x:
                 if found_x == False:
-                    x = I[ind]
+                    unknown = name
+                    bracket = x_bracket
                     resulting_units = self.var_units[ind].get()
                     resulting_name = self.settings[fun]["variables"][name]["name"]
                     found_x = True
@@ -382,91 +596,284 @@ class Calculator(ttk.Frame):
                     self.write("Too many x's.")
                     return 0
             else:
-                value = value.split("+-")
-                magnitude = value[0].strip()
-                if len(value) > 1: # If there is uncertainty
-                    error = value[1].strip()
-                    str_to_eval[ind] = "{} = (float({}) * self.ureg(self.var_units[{}].get())).plus_minus(float({}))".format(name,magnitude,ind,error)
-                else:
-                    str_to_eval[ind] = "{} = float({}) * self.ureg(self.var_units[{}].get())".format(name,magnitude,ind)
-                inputs = inputs + f"{self.settings[fun]['variables'][name]['name']} = {self.var_values[ind].get().replace(',','.')} {self.var_units[ind].get()}, "
+                knowns[name] = (value,self.var_units[ind].get())
+                inputs = inputs + f"{self.settings[fun]['variables'][name]['name']} = {value} {self.var_units[ind].get()}, "
         if not found_x:
             self.write("One x required.")
             return 0
 
-        # Get the resulting equation for x as a string, where variables are letters (a,b,...)
-        solution = sympy.solve(eval(self.settings[fun]["function"]),x)
-        solution = str(solution[0])
-
-        # Creating variables for the solution
-        for string in str_to_eval:
-            try: 
-                if string is not None:
-                    exec(string)
-            except ValueError:
-                self.write("Cannot convert to numbers!")
+        # Symbolic solution, which is not cached, is found in the worker process and then this function is called again with the current inputs
+        if (fun,unknown) not in self.solution_cache and (fun,unknown) not in self.engine.symbolic_failed:
+            if self.solving == (fun,unknown): # Already being solved
+                self.solving_history = self.solving_history or history
                 return 0
+            if self.solving is not None: # Solving for another unknown is not needed anymore
+                self.cancel_solve()
+            self.start_solve(fun,unknown,history)
+            return 0
 
-        # Solving and printing the result
+        # Solving and printing the result, if sympy failed, the roots are found numerically
         try:
-            solution = self.make_string_good_for_numpy(solution)
-            result = eval(solution).to(resulting_units)
-            self.result.set(value="{} is {:.3fP}".format(resulting_name,result))
-            self.result_number.set(value=str(result.magnitude))
-            self.add_history((self.settings[fun]["name"],inputs[0:-2],f"{resulting_name} = {str(result)}"))
-        except ZeroDivisionError:
-            self.write("Cannot divide by zero!")
+            results = self.engine.solve_all(fun,knowns,unknown,resulting_units,bracket=bracket)
+        except CalculationError as error:
+            self.write(error)
             return 0
-        except TypeError:
-            self.write("Uncertainties not implemented for nonlinear functions.")
+        if len(results) == 0:
+            self.write("No solution found.")
             return 0
+        self.result.set(value="{} is {}".format(resulting_name," or ".join(self.format_result(result) for result in results)))
+        self.result_number.set(value="; ".join(str(result.magnitude) for result in results))
+        if history:
+            self.add_history((self.settings[fun]["name"],inputs[0:-2],f"{resulting_name} = {' or '.join(str(result) for result in results)}"))
 
-    def make_string_good_for_numpy(self,string):
+    def start_solve(self,fun,unknown,history=True):
         '''
-        When sympy solves equation, there are only function names in the resulting string. In order to evaluate it, I have to add numpy before the function names.
+        Starts the symbolic solution in the worker process and shows the progress
         '''
-        functions = ["sin","cos","pi"]        
-        for fun in functions:
-            string = string.replace(fun,f"np.{fun}")
-        string = string.replace("anp.sin","np.arcsin") # asin will be already changed to anp.sin, but it should be arcsin
-        return string
-        
+        self.solving = (fun,unknown)
+        self.solving_history = history
+        self.solve_worker.submit(self.settings[fun],unknown)
+        self.solve_button.state(["disabled"])
+        self.solve_progress.grid(row=104,column=0,columnspan=2,sticky="ew")
+        self.solve_cancel.grid(row=104,column=2,sticky="e")
+        self.solve_progress.start()
+        self.write("Solving...")
+        self.after(50,self.poll_solve)
 
-    def calculate(self,fun):
+    def poll_solve(self):
         '''
-        Is called in the solving regime, when the user filled the input values and wants to know the results
+        Periodically checks the worker process. When the solution is ready, it is cached and the result is calculated.
         '''
-        I = [None] * len(self.inputs_values) # These will be the quantities with uncertainties and units
+        if self.solving is None: # Cancelled in the meantime
+            return
+        reply = self.solve_worker.poll()
+        if reply is None:
+            if self.engine.solve_timeout and self.solve_worker.elapsed() > self.engine.solve_timeout:
+                # Symbolic solution takes too long, so the numeric one is used
+                fun, unknown = self.solving
+                seconds = self.solve_worker.elapsed()
+                history = self.solving_history
+                self.cancel_solve(f"Solving took longer than {self.engine.solve_timeout:g} s.")
+                self.engine.symbolic_failed.add((fun,unknown))
+                self.solve_solved(fun,seconds,history)
+                return
+            self.result.set(value="Solving... {:.0f} s".format(self.solve_worker.elapsed()))
+            self.after(50,self.poll_solve)
+            return
+        fun, unknown = self.solving
+        seconds = self.solve_worker.elapsed()
+        history = self.solving_history
+        self.stop_solve_progress()
+        if reply[0] == "error":
+            self.engine.symbolic_failed.add((fun,unknown))
+        else:
+            self.solution_cache.put(fun,unknown,reply[1])
+        self.solve_solved(fun,seconds,history)
+
+    def solve_solved(self,fun,seconds,history=True):
+        '''
+        Calculates the result after the worker process solved the equation (or failed), the time of the symbolic solution is added to the measured calculation
+        '''
+        with self.engine.instrumentation.calculation(fun,"solve"):
+            self.engine.instrumentation.add("solve",seconds)
+            self.solve(fun,history)
+
+    def cancel_solve(self,message="Solving cancelled."):
+        '''
+        Stops the worker process and writes the message
+        '''
+        self.solve_worker.cancel()
+        self.stop_solve_progress()
+        self.write(message)
+
+    def stop_solve_progress(self):
+        self.solving = None
+        try:
+            self.solve_progress.stop()
+            self.solve_progress.grid_forget()
+            self.solve_cancel.grid_forget()
+            self.solve_button.state(["!disabled"])
+        except tk.TclError: # Widgets were already destroyed
+            pass
+
+    def set_solve_timeout(self):
+        '''
+        Asks the user for the maximal time of the symbolic solution
+        '''
+        timeout = simpledialog.askfloat("Solve timeout","Maximal time of solving in seconds (0 for no limit):",initialvalue=self.engine.solve_timeout or 0,minvalue=0,parent=self.master)
+        if timeout is not None:
+            self.engine.solve_timeout = timeout or None
+
+    def set_uncertainty(self):
+        self.engine.uncertainty = self.uncertainty_method.get()
+
+    def set_samples(self):
+        '''
+        Asks the user for the number of samples of the Monte Carlo method
+        '''
+        samples = simpledialog.askinteger("Monte Carlo samples","Number of random samples (more is more precise, but slower):",initialvalue=self.engine.samples,minvalue=100,parent=self.master)
+        if samples is not None:
+            self.engine.samples = samples
+
+    def show_debug(self):
+        '''
+        Creates a window with the statistics of the measured calculations by function and the stages of the last calculation
+        '''
+        self.close_debug()
+        self.debug_window = tk.Toplevel(self.master)
+        self.debug_window.iconbitmap(bitmap="Icon.ico")
+        self.debug_window.title("Debug")
+        self.debug_window.protocol("WM_DELETE_WINDOW", self.close_debug)
+
+        frame_buttons = ttk.Frame(self.debug_window)
+        self.debug_enabled = tk.BooleanVar(value=self.engine.instrumentation.enabled)
+        ttk.Checkbutton(frame_buttons,text="Measure calculations",variable=self.debug_enabled,command=self.set_instrumentation).grid(row=0,column=0,sticky="w")
+        ttk.Button(frame_buttons,text="Profile next calculation",command=self.profile_next).grid(row=0,column=1,sticky="w")
+        ttk.Button(frame_buttons,text="Reset",command=self.engine.instrumentation.reset).grid(row=0,column=2,sticky="w")
+        frame_buttons.grid(row=0,column=0,sticky="ew")
+
+        self.debug_tree = ttk.Treeview(self.debug_window,columns=("count","p50","p95","stages"))
+        self.debug_tree.heading("#0",text="Function")
+        self.debug_tree.heading("count",text="Count")
+        self.debug_tree.heading("p50",text="p50 [ms]")
+        self.debug_tree.heading("p95",text="p95 [ms]")
+        self.debug_tree.heading("stages",text="Mean time of the stages [ms]")
+        self.debug_tree.column("#0",stretch=False,width=200)
+        self.debug_tree.column("count",stretch=False,width=60)
+        self.debug_tree.column("p50",stretch=False,width=80)
+        self.debug_tree.column("p95",stretch=False,width=80)
+        self.debug_tree.column("stages",stretch=True,width=450)
+        self.debug_tree.grid(row=1,column=0,sticky="nsew")
+        self.debug_last = tk.StringVar()
+        ttk.Label(self.debug_window,textvariable=self.debug_last,wraplength=800,justify="left").grid(row=2,column=0,sticky="ew")
+        self.debug_window.columnconfigure(0,weight=1)
+        self.debug_window.rowconfigure(1,weight=1)
+        self.debug_window_open = True
+        self.refresh_debug()
+
+    def refresh_debug(self):
+        '''
+        Shows the current statistics, it is repeated while the debug window is open
+        '''
+        if not self.debug_window_open:
+            return
+        self.debug_tree.delete(*self.debug_tree.get_children())
+        for fun, statistics in self.engine.instrumentation.summary().items():
+            stages = ", ".join(f"{stage} {seconds * 1000:.3g}" for stage, seconds in statistics["stages"].items())
+            name = self.settings[fun]["name"] if fun in self.settings else fun
+            self.debug_tree.insert("","end",text=name,values=(statistics["count"],f"{statistics['p50'] * 1000:.3g}",f"{statistics['p95'] * 1000:.3g}",stages))
+        last = self.engine.instrumentation.last
+        if last is None:
+            text = "No calculation measured yet." if self.engine.instrumentation.enabled else "Measurement is off."
+        else:
+            stages = ", ".join(f"{stage} {seconds * 1000:.3g} ms" for stage, seconds in last["stages"].items())
+            text = f"Last: {last['function']} took {last['seconds'] * 1000:.3g} ms ({stages})"
+            if last.get("profile"):
+                text += f", profile saved to {last['profile']}"
+        cache = self.engine.result_cache.statistics()
+        text += f"\nStored results: {cache['size']} of {cache['maxsize']}, {cache['hits']} hits, {cache['misses']} misses"
+        self.debug_last.set(text)
+        self.debug_refresh = self.after(DEBUG_REFRESH,self.refresh_debug)
+
+    def close_debug(self):
+        self.debug_window_open = False
+        if self.debug_refresh is not None:
+            self.after_cancel(self.debug_refresh)
+            self.debug_refresh = None
+        try:
+            self.debug_window.destroy()
+        except (AttributeError, tk.TclError): # Window was not created yet or is already closed
+            pass
+
+    def set_instrumentation(self):
+        if self.debug_enabled.get():
+            self.engine.instrumentation.enable()
+        else:
+            self.engine.instrumentation.disable()
+
+    def profile_next(self):
+        '''
+        The next calculation is run under cProfile, which also turns on the measurement
+        '''
+        self.debug_enabled.set(True)
+        self.engine.instrumentation.enable()
+        self.engine.instrumentation.profile_next()
+
+    def format_result(self,result):
+        '''
+        Formats the result, for results with uncertainty, also the 95 % interval is shown
+        '''
+        text = "{:.3fP}".format(result)
+        if hasattr(result,"interval"):
+            text += " (95 % in {:.3fP} to {:.3fP})".format(*result.interval())
+        return text
+
+    def calculate(self,fun,history=True):
+        '''
+        Is called in the calculation regime, when the user filled the input values and wants to know the results, `history` is False for the live results
+        '''
+        if any(sweep.is_sweep(value.get()) for value in self.inputs_values):
+            return self.calculate_sweep(fun,history)
+        values = dict() # Values and units of the inputs
         inputs = "" # This is string to add to history
         for name in self.settings[fun]["inputs"].keys():
             ind = self.settings[fun]["inputs"][name]["position"]
-            value = self.inputs_values[ind].get().replace(",",".")
-            try:
-                value = value.split("+-")
-                magnitude = value[0].strip()
-                if len(value) > 1: # If there is uncertainty
-                    error = value[1].strip()     
-                    I[ind] = (float(magnitude) * self.ureg(self.inputs_units[ind].get())).plus_minus(float(error)) 
-                else:                            
-                    I[ind] = (float(magnitude) * self.ureg(self.inputs_units[ind].get())) 
-                inputs = inputs + f"{name} = {self.inputs_values[ind].get().replace(',','.')} {self.inputs_units[ind].get()}, "
-            except ValueError:
-                self.write("Cannot convert to numbers!")
-                return 0
-        
+            values[name] = (self.inputs_values[ind].get(),self.inputs_units[ind].get())
+            inputs = inputs + f"{name} = {self.inputs_values[ind].get().replace(',','.')} {self.inputs_units[ind].get()}, "
+
         # Solving and printing the results
-        function_to_evaluate = self.settings[fun]["function"]        
         try:
-            result = eval(function_to_evaluate).to(self.output.get())
-            self.result.set(value="{} is {:.3fP}".format(self.settings[fun]['outputs']['name'],result))
-            self.result_number.set(value=str(result.magnitude))
-            self.add_history((self.settings[fun]["name"],inputs[0:-2],f"{self.settings[fun]['outputs']['name']} = {str(result)}"))
-        except ZeroDivisionError:
-            self.write("Cannot divide by zero!")
+            result = self.engine.calculate(fun,values,self.output.get())
+        except CalculationError as error:
+            self.write(error)
             return 0
-        except TypeError:
-            self.write("Uncertainties not implemented for nonlinear functions.")
+        self.result.set(value="{} is {}".format(self.settings[fun]['outputs']['name'],self.format_result(result)))
+        self.result_number.set(value=str(result.magnitude))
+        if history:
+            self.add_history((self.settings[fun]["name"],inputs[0:-2],f"{self.settings[fun]['outputs']['name']} = {str(result)}"))
+
+    def calculate_sweep(self,fun,history=True):
+        '''
+        Is called in the calculation regime, when some of the inputs are ranges or lists. The function is evaluated once for all the values and the result can be exported.
+        '''
+        values = dict()
+        units = dict()
+        inputs = "" # This is string to add to history
+        for name in self.settings[fun]["inputs"].keys():
+            ind = self.settings[fun]["inputs"][name]["position"]
+            values[name] = self.inputs_values[ind].get()
+            units[name] = self.inputs_units[ind].get()
+            inputs = inputs + f"{name} = {values[name].replace(',','.')} {units[name]}, "
+            if "+-" in values[name]:
+                self.write("Uncertainties cannot be swept.")
+                return 0
+        output_name = self.settings[fun]['outputs']['name']
+        try:
+            swept_inputs, result = self.engine.calculate_batch(fun,values,units,self.output.get())
+        except CalculationError as error:
+            self.write(error)
             return 0
+        self.last_sweep = (swept_inputs,output_name,result)
+        self.menu_options.entryconfigure("Export sweep",state="normal")
+        self.result.set(value="{} of {} points is from {:.3fP} to {:.3fP}".format(output_name,result.size,result.min(),result.max()))
+        self.result_number.set(value=" ".join(str(x) for x in result.magnitude[:100]))
+        if history:
+            self.add_history((self.settings[fun]["name"],inputs[0:-2],f"{output_name} = {result.size} values from {str(result.min())} to {str(result.max())}"))
+
+    def export_sweep(self):
+        '''
+        Saves the last sweep into a CSV or NPY file
+        '''
+        if self.last_sweep is None:
+            return
+        path = filedialog.asksaveasfilename(defaultextension=".csv",filetypes=[("CSV file","*.csv"),("Numpy file","*.npy")])
+        if not path:
+            return
+        swept_inputs, output_name, result = self.last_sweep
+        try:
+            sweep.export(path,swept_inputs,output_name,result)
+        except OSError:
+            messagebox.showerror(message=f"Could not save the sweep to {path}",title="Error")
 
     def write(self,message="Result"):
         '''
@@ -476,6 +883,10 @@ class Calculator(ttk.Frame):
         self.result_number.set(value=str(message))
 
 if __name__ == "__main__": # If startes as a script/application and not loaded as a package
+    multiprocessing.freeze_support() # Solving process has to work also in the frozen application
+    if len(sys.argv) > 1: # With arguments, the command line interface is used instead of the GUI
+        import cli
+        sys.exit(cli.main(sys.argv[1:]))
     root = tk.Tk()
     app = Calculator(root)
     app.grid(column=0,row=0)
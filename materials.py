@@ -0,0 +1,242 @@
+'''
+Constants and tabulated material data, which can be used in the expressions of functions.json, e.g.
+
+    materials.n("fused silica",I[0])                  refractive index at the wavelength I[0]
+    materials.value("fused silica","n2",I[0])         any tabulated column
+    materials.constant("TBP","Gaussian")              value from constants.json
+
+Values in constants.json (e.g. "~8e-20 m^2/W") are parsed with their units once, when they are loaded.
+Tables are defined in materials.json, either by points or by Sellmeier coefficients, and they are converted into one binary file (materials-<hash>.npy with the index in materials-<hash>.index.json in the user cache folder), which is memory-mapped, so it loads fast and it is shared by the processes evaluating grids.
+Tables are interpolated linearly, wavelengths can be arrays, outside of the tabulated range the result is NaN.
+'''
+import hashlib
+import json
+import os
+
+import numpy as np
+
+WAVELENGTH_UNIT = "um" # Default unit of the wavelengths in materials.json
+POINTS = 1000 # Number of points, where the Sellmeier formula is tabulated
+EMPTY = (np.zeros((0,2)),{"materials":{},"aliases":{}})
+
+
+def cache_folder():
+    '''
+    Folder of the user, where the generated files are kept
+    '''
+    base = os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"),".cache")
+    return os.path.join(base,"laser-calculator")
+
+
+class Constant():
+    '''
+    Value from constants.json: the shown `text`, the parsed `quantity` (None, if it is not a number) and whether it is only `approximate` (starts by ~)
+    '''
+    def __init__(self,ureg,text):
+        self.text = str(text)
+        stripped = self.text.strip()
+        self.approximate = stripped.startswith("~")
+        try:
+            self.quantity = ureg.Quantity(stripped.lstrip("~").strip())
+            if not isinstance(self.quantity.magnitude,(int,float)):
+                self.quantity = None
+        except Exception: # Descriptions, which are not numbers with units
+            self.quantity = None
+
+
+def parse_constants(ureg,constants):
+    '''
+    Parses all the values of constants.json, returns dictionary group: name: Constant
+    '''
+    return {group: {name: Constant(ureg,text) for name, text in values.items()} for group, values in constants.items() if isinstance(values,dict)}
+
+
+def sellmeier(coefficients,wavelength):
+    '''
+    Refractive index given by the Sellmeier formula n^2 = 1 + sum(B λ^2 / (λ^2 - C)) with the wavelength in micrometers and C in micrometers squared
+    '''
+    square = np.asarray(wavelength) ** 2
+    return np.sqrt(1 + sum(B * square / (square - C) for B, C in zip(coefficients["B"],coefficients["C"])))
+
+
+def tabulate(ureg,material,column,definition,folder):
+    '''
+    Returns the wavelengths in meters and the values of the column in base SI units from its definition in materials.json
+    '''
+    wavelength_factor = ureg(definition.get("wavelength unit",WAVELENGTH_UNIT)).to("m").magnitude
+    if "sellmeier" in definition:
+        lo, hi = definition["range"]
+        wavelengths = np.linspace(lo,hi,int(definition.get("points",POINTS)))
+        values = sellmeier(definition["sellmeier"],wavelengths)
+    elif "table" in definition:
+        table = np.asarray(definition["table"],dtype=float).reshape(-1,2)
+        wavelengths, values = table[:,0], table[:,1]
+    elif "file" in definition: # CSV file with the wavelength and the value on every line
+        table = np.loadtxt(os.path.join(folder,definition["file"]),delimiter=",",comments="#",ndmin=2)
+        wavelengths, values = table[:,0], table[:,1]
+    else:
+        raise ValueError(f"{material} {column} needs sellmeier, table or file")
+    values = values * ureg(definition.get("unit","")).to_base_units().magnitude
+    order = np.argsort(wavelengths)
+    return wavelengths[order] * wavelength_factor, values[order]
+
+
+def build_database(ureg,source,data_path,index_path):
+    '''
+    Converts materials.json into the binary file with all the tables one after another (rows of wavelength and value) and the index of the tables by material and column
+    '''
+    with open(source,"r") as file:
+        definitions = json.load(file)
+    index = {"materials":{},"aliases":{}}
+    tables = []
+    rows = 0
+    for material, definition in definitions.items():
+        columns = dict()
+        for column, column_definition in definition.items():
+            if not isinstance(column_definition,dict):
+                continue # e.g. aliases and reference
+            wavelengths, values = tabulate(ureg,material,column,column_definition,os.path.dirname(source))
+            tables.append(np.column_stack([wavelengths,values]))
+            columns[column] = {"start":rows,"stop":rows + len(wavelengths),"unit":str(ureg(column_definition.get("unit","")).to_base_units().units)}
+            rows += len(wavelengths)
+        index["materials"][material] = {"columns":columns,"reference":definition.get("reference","")}
+        for alias in [material] + list(definition.get("aliases",[])):
+            index["aliases"][alias.lower()] = material
+    data = np.concatenate(tables) if tables else np.zeros((0,2))
+    if data_path is not None:
+        np.save(data_path,data)
+        with open(index_path,"w") as file:
+            json.dump(index,file,indent=1)
+    return data, index
+
+
+class MaterialDatabase():
+    '''
+    Tabulated data of the materials from `source` (materials.json). The binary file is built in the user cache `folder` again, when the source is newer, if the folder is not writable, the tables are kept only in the memory.
+    The data and its index are kept together in `tables`, so that they are replaced at once by `reload`, while other threads read them.
+    '''
+    def __init__(self,ureg,source=None,folder=None):
+        self.ureg = ureg
+        self.source = source
+        self.folder = folder or cache_folder()
+        self.tables = EMPTY
+        self.state = None
+        self.reload()
+
+    def paths(self):
+        '''
+        Paths of the binary file and its index, named by the source, so that different sources don't overwrite each other
+        '''
+        source = os.path.abspath(self.source)
+        name = os.path.splitext(os.path.basename(source))[0] + "-" + hashlib.sha1(source.encode()).hexdigest()[:12]
+        base = os.path.join(self.folder,name)
+        return base + ".npy", base + ".index.json"
+
+    def reload(self):
+        '''
+        Loads the tables again, if the source changed. Returns True, if they changed.
+        '''
+        try:
+            status = os.stat(self.source)
+            state = (status.st_mtime_ns,status.st_size)
+        except (OSError, TypeError):
+            state = None
+        if state == self.state:
+            return False
+        self.state = state
+        if state is None:
+            self.tables = EMPTY
+            return True
+        data_path, index_path = self.paths()
+        try:
+            if os.stat(data_path).st_mtime_ns >= state[0] and os.stat(index_path).st_mtime_ns >= state[0]:
+                self.tables = self.load(data_path,index_path)
+                return True
+        except (OSError, ValueError):
+            pass
+        try:
+            os.makedirs(self.folder,exist_ok=True)
+            build_database(self.ureg,self.source,data_path,index_path)
+            self.tables = self.load(data_path,index_path)
+        except OSError: # Folder is not writable
+            self.tables = build_database(self.ureg,self.source,None,None)
+        return True
+
+    def load(self,data_path,index_path):
+        with open(index_path,"r") as file:
+            index = json.load(file)
+        return np.load(data_path,mmap_mode="r"), index
+
+    def material(self,name,index=None):
+        index = index or self.tables[1]
+        try:
+            return index["aliases"][name.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown material {name}")
+
+    def table(self,material,column):
+        '''
+        Returns the wavelengths in meters, the values in base SI units and their unit
+        '''
+        data, index = self.tables
+        material = self.material(material,index)
+        columns = index["materials"][material]["columns"]
+        if column not in columns:
+            raise ValueError(f"No {column} of {material}, there is only {', '.join(columns.keys())}")
+        table = data[columns[column]["start"]:columns[column]["stop"]]
+        return table[:,0], table[:,1], columns[column]["unit"]
+
+    def interpolate(self,material,column,wavelength):
+        '''
+        Returns the values at the wavelengths in meters (number or array) in base SI units, NaN outside of the tabulated range
+        '''
+        wavelengths, values, unit = self.table(material,column)
+        return np.interp(wavelength,wavelengths,values,left=np.nan,right=np.nan)
+
+    def materials(self):
+        '''
+        Returns the list of the materials with their columns and their wavelength ranges in meters
+        '''
+        data, index = self.tables
+        result = []
+        for material, description in index["materials"].items():
+            columns = {column: (float(data[c["start"],0]),float(data[c["stop"] - 1,0])) for column, c in description["columns"].items()}
+            result.append({"name":material,"columns":columns,"reference":description.get("reference","")})
+        return result
+
+
+class Materials():
+    '''
+    Stands for the constants and material tables in the expressions as `materials`. With `ureg`, the wavelengths are pint quantities and so are the results, without it, they are plain numbers in base SI units (see `units.base_code`).
+    '''
+    def __init__(self,database,constants,ureg=None):
+        self.database = database
+        self.constants = constants # Parsed constants, see `parse_constants`
+        self.ureg = ureg
+        self.plain = self if ureg is None else Materials(database,constants)
+
+    def value(self,material,column,wavelength):
+        if self.ureg is None:
+            return self.database.interpolate(material,column,wavelength)
+        magnitude = wavelength.to("m").magnitude if hasattr(wavelength,"to") else wavelength
+        wavelengths, values, unit = self.database.table(material,column)
+        result = np.interp(magnitude,wavelengths,values,left=np.nan,right=np.nan)
+        return self.ureg.Quantity(result,unit)
+
+    def n(self,material,wavelength):
+        return self.value(material,"n",wavelength)
+
+    def n2(self,material,wavelength):
+        return self.value(material,"n2",wavelength)
+
+    def constant(self,group,name):
+        '''
+        Value from constants.json, e.g. constant("n2","YAG, 1064 nm")
+        '''
+        try:
+            quantity = self.constants[group][name].quantity
+        except KeyError:
+            raise ValueError(f"Unknown constant {name} in {group}")
+        if quantity is None:
+            raise ValueError(f"Constant {name} is not a number")
+        return quantity.to_base_units().magnitude if self.ureg is None else quantity
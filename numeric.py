@@ -0,0 +1,149 @@
+import numpy as np
+
+from solution_cache import build_equation
+
+
+def compile_residual(definition,unknown):
+    '''
+    Compiles the difference of the left and right side of the equation into a numpy function of all the variables (ordered by position), which should be given as plain numbers in base SI units.
+    Returns the function and the list of keys of its arguments.
+    '''
+    import sympy
+    equation, I = build_equation(definition)
+    residual = sympy.lambdify(I,equation.lhs - equation.rhs,modules="numpy")
+    return residual, [symbol.name for symbol in I]
+
+
+def find_roots(function,lo,hi,samples=2000,xtol=1e-12,maxiter=200):
+    '''
+    Finds all real roots of the vectorized function between `lo` and `hi`.
+    The interval is sampled (logarithmically, if it is positive or negative and spans more than two orders of magnitude), every change of sign is refined by the Illinois method (regula falsi, which keeps the root bracketed), and changes of sign caused by poles are thrown away.
+    Returns the sorted array of roots.
+    '''
+    lo, hi = min(lo,hi), max(lo,hi)
+    if lo > 0 and hi / lo > 100:
+        x = np.geomspace(lo,hi,samples)
+    elif hi < 0 and lo / hi > 100:
+        x = -np.geomspace(-lo,-hi,samples)
+    else:
+        x = np.linspace(lo,hi,samples)
+    with np.errstate(all="ignore"):
+        y = np.broadcast_to(np.asarray(function(x),dtype=float),x.shape)
+    roots = list(x[y == 0])
+    finite = np.isfinite(y[:-1]) & np.isfinite(y[1:])
+    changes = np.nonzero(finite & (np.sign(y[:-1]) * np.sign(y[1:]) < 0))[0]
+    for i in changes:
+        root = illinois(function,x[i],x[i + 1],y[i],y[i + 1],xtol,maxiter)
+        with np.errstate(all="ignore"):
+            value = abs(float(function(root)))
+        if value <= max(abs(y[i]),abs(y[i + 1])): # At the pole, the function would grow instead
+            roots.append(root)
+    return np.unique(roots)
+
+
+def illinois(function,a,b,fa,fb,xtol=1e-12,maxiter=200):
+    '''
+    Refines the root bracketed by a and b, where the function has values of opposite signs fa and fb
+    '''
+    side = 0
+    c = a
+    for _ in range(maxiter):
+        c = (a * fb - b * fa) / (fb - fa)
+        if abs(b - a) <= xtol * max(abs(a),abs(b),1e-300):
+            break
+        with np.errstate(all="ignore"):
+            fc = float(function(c))
+        if fc == 0 or not np.isfinite(fc):
+            break
+        if np.sign(fc) == np.sign(fb):
+            b, fb = c, fc
+            if side == 1:
+                fa /= 2
+            side = 1
+        else:
+            a, fa = c, fc
+            if side == -1:
+                fb /= 2
+            side = -1
+    return c
+
+
+class NumericSolver():
+    '''
+    Numeric solution of a solve-regime equation, used when sympy cannot solve it or takes too long.
+    The known quantities are converted to base SI units, and the unknown is searched in the units of the bracket, so that the numbers are of reasonable size.
+    '''
+    def __init__(self,ureg,definition,unknown):
+        self.ureg = ureg
+        self.definition = definition
+        self.unknown = unknown
+        self.residual, self.arguments = compile_residual(definition,unknown)
+
+    def roots(self,knowns,bracket,samples=2000):
+        '''
+        Returns the list of all the roots (pint quantities in the bracket units) found in the `bracket`, which is a tuple of two quantities. `knowns` are the quantities of the other variables by their keys.
+        '''
+        lo, hi = bracket
+        unit = lo.units
+        hi = hi.to(unit)
+        scale = (1 * unit).to_base_units().magnitude
+        values = self.base_values(knowns)
+        position = self.arguments.index(self.unknown)
+
+        def function(x):
+            values[position] = np.asarray(x) * scale
+            return self.residual(*values)
+
+        return [root * unit for root in find_roots(function,lo.magnitude,hi.magnitude,samples)]
+
+    def base_values(self,knowns):
+        return [None if key == self.unknown else knowns[key].to_base_units().magnitude for key in self.arguments]
+
+    def evaluate(self,values,x):
+        '''
+        Residual of the equation for the unknown `x` and the other `values` (plain numbers or arrays in base SI units ordered like the arguments)
+        '''
+        values = list(values)
+        values[self.arguments.index(self.unknown)] = x
+        with np.errstate(all="ignore"):
+            return self.residual(*values)
+
+    def sensitivities(self,knowns,root,step=1e-6):
+        '''
+        Returns the partial derivatives of the `root` (quantity) by the known variables in base SI units as a dictionary by their keys.
+        By the implicit function theorem, they are -(dF/dy)/(dF/dx) of the residual F, whose derivatives are found by central differences.
+        '''
+        values = self.base_values(knowns)
+        x = root.to_base_units().magnitude
+        h = step * (abs(x) or 1)
+        slope = (self.evaluate(values,x + h) - self.evaluate(values,x - h)) / (2 * h)
+        result = dict()
+        for position, key in enumerate(self.arguments):
+            if key == self.unknown:
+                continue
+            h = step * (abs(values[position]) or 1)
+            up, down = list(values), list(values)
+            up[position] += h
+            down[position] -= h
+            result[key] = -(self.evaluate(up,x) - self.evaluate(down,x)) / (2 * h) / slope
+        return result
+
+    def follow(self,knowns,root,step=1e-6,xtol=1e-12,maxiter=50):
+        '''
+        Follows the `root` (quantity) to the `knowns` given by arrays (e.g. Monte Carlo samples) by Newton's method started from it for all of them at once.
+        Returns the array of roots in base SI units, NaN where the method didn't converge.
+        '''
+        values = self.base_values(knowns)
+        x0 = root.to_base_units().magnitude
+        shape = np.broadcast(*[np.asarray(value) for value in values if value is not None]).shape
+        x = np.full(shape,float(x0))
+        h = step * (abs(x0) or 1)
+        converged = np.zeros(shape,dtype=bool)
+        for _ in range(maxiter):
+            slope = (self.evaluate(values,x + h) - self.evaluate(values,x - h)) / (2 * h)
+            change = self.evaluate(values,x) / slope
+            x = np.where(converged,x,x - change)
+            converged |= np.abs(change) <= xtol * np.maximum(np.abs(x),1e-300)
+            if converged.all():
+                break
+        return np.where(converged & np.isfinite(x),x,np.nan)
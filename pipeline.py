@@ -0,0 +1,219 @@
+'''
+Pipelines of functions from functions.json, where the results of some functions are the inputs of others, e.g.
+
+    {
+        "inputs": {"Wavelength": "800 nm", "Bandwidth": "10 nm", "Energy": "1 mJ"},
+        "nodes": {
+            "duration": {"function": "duration-bandwidth", "unknown": "Pulse duration", "output": "fs",
+                         "inputs": {"Wavelength": "$Wavelength", "Bandwidth": "$Bandwidth", "TBP": "0.441271"}},
+            "intensity": {"function": "peak-intensity",
+                          "inputs": {"Energy": "$Energy", "Beam diameter": "2 mm", "Pulse duration": "$duration"}}
+        }
+    }
+
+Values starting with $ refer to the inputs of the pipeline or to the results of other nodes, other values are fixed. Nodes in the solve regime need "unknown", "output" is the optional unit of the result.
+The nodes form a directed acyclic graph, which is calculated in the topological order. When inputs change, only the nodes, whose inputs changed, are calculated again.
+'''
+import json
+
+from engine import CalculationError
+import sweep
+
+
+def reference(value):
+    '''
+    Returns the name, to which the value refers ("$name"), or None for a fixed value
+    '''
+    if isinstance(value,str) and value.startswith("$"):
+        return value[1:].strip()
+    return None
+
+
+def load(path):
+    with open(path,"r") as file:
+        return json.load(file)
+
+
+class Pipeline():
+    '''
+    Pipeline defined by the dictionary (see above) and calculated by the engine.
+    Every node remembers its last inputs and result, so `run` calculates again only the nodes with changed inputs.
+    '''
+    def __init__(self,engine,definition):
+        self.engine = engine
+        self.inputs = dict(definition.get("inputs",{}))
+        self.nodes = {name: dict(node) for name, node in definition.get("nodes",{}).items()} # Keys are normalized in the copies, not in the definition
+        if len(self.nodes) == 0:
+            raise CalculationError("Pipeline has no nodes")
+        for name, node in self.nodes.items():
+            if name in self.inputs:
+                raise CalculationError(f"Node {name} has the same name as an input")
+            node["function"] = engine.function_key(node.get("function"))
+            if engine.settings[node["function"]]["regime"] == "solve":
+                if "unknown" not in node:
+                    raise CalculationError(f"Node {name} needs the unknown to solve for")
+                node["unknown"] = engine.variable_key(node["function"],node["unknown"])
+        self.order = self.sort()
+        self.memo = dict() # Node name: (inputs, result) of the last calculation
+        self.calculated = [] # Nodes calculated by the last run
+
+    def dependencies(self,name):
+        return [reference(value) for value in self.nodes[name].get("inputs",{}).values() if reference(value) is not None]
+
+    def sort(self):
+        '''
+        Returns the names of the nodes in the topological order, so that every node comes after the nodes it depends on
+        '''
+        for name in self.nodes.keys():
+            for dependency in self.dependencies(name):
+                if dependency not in self.nodes and dependency not in self.inputs:
+                    raise CalculationError(f"Node {name} refers to unknown ${dependency}")
+        order = []
+        remaining = {name: {x for x in self.dependencies(name) if x in self.nodes} for name in self.nodes.keys()}
+        while remaining:
+            ready = [name for name, dependencies in remaining.items() if not dependencies]
+            if not ready:
+                raise CalculationError(f"Nodes {', '.join(remaining.keys())} depend on each other in a cycle")
+            for name in ready:
+                order.append(name)
+                del remaining[name]
+            for dependencies in remaining.values():
+                dependencies.difference_update(ready)
+        return order
+
+    def output_name(self,name):
+        node = self.nodes[name]
+        definition = self.engine.settings[node["function"]]
+        if definition["regime"] == "calc":
+            return definition["outputs"]["name"]
+        return definition["variables"][node["unknown"]]["name"]
+
+    def allowed_units(self,name,key):
+        '''
+        Returns the allowed units of the input `key` of the node
+        '''
+        node = self.nodes[name]
+        definition = self.engine.settings[node["function"]]
+        if definition["regime"] == "calc":
+            return definition["inputs"].get(key,{}).get("units",[])
+        return definition["variables"][self.engine.variable_key(node["function"],key)].get("units",[])
+
+    def input_units(self,input_name):
+        '''
+        Returns the allowed units of the input of the pipeline, which are the ones of the first node input referring to it
+        '''
+        for name in self.order:
+            for key, value in self.nodes[name].get("inputs",{}).items():
+                if reference(value) == input_name:
+                    return self.allowed_units(name,key)
+        return []
+
+    def set(self,**values):
+        '''
+        Changes the inputs of the pipeline
+        '''
+        for name in values.keys():
+            if name not in self.inputs:
+                raise CalculationError(f"Unknown input {name}, possible inputs are: {', '.join(self.inputs.keys())}")
+        self.inputs.update(values)
+
+    def arguments(self,name,results):
+        '''
+        Returns the inputs of the node with the references replaced by the values
+        '''
+        arguments = dict()
+        for key, value in self.nodes[name].get("inputs",{}).items():
+            target = reference(value)
+            if target is None:
+                arguments[key] = value
+            elif target in results:
+                arguments[key] = results[target]
+            else:
+                arguments[key] = self.inputs[target]
+        return arguments
+
+    def run(self):
+        '''
+        Calculates the nodes, whose inputs changed since the last run, and returns the results of all the nodes by their names
+        '''
+        results = dict()
+        self.calculated = []
+        for name in self.order:
+            node = self.nodes[name]
+            arguments = self.arguments(name,results)
+            if name in self.memo and same(self.memo[name][0],arguments):
+                results[name] = self.memo[name][1]
+                continue
+            # Estimate is passed to the next function as a measurement with its uncertainty
+            prepared = {key: value.measurement() if hasattr(value,"measurement") else value for key, value in arguments.items()}
+            try:
+                if "unknown" in node:
+                    result = self.engine.solve(node["function"],prepared,node["unknown"],node.get("output"))
+                else:
+                    result = self.engine.calculate(node["function"],prepared,node.get("output"))
+            except CalculationError as error:
+                raise CalculationError(f"{name}: {error}")
+            self.memo[name] = (arguments,result)
+            self.calculated.append(name)
+            results[name] = result
+        return results
+
+    def run_batch(self,values=None):
+        '''
+        Calculates the whole pipeline once for arrays of inputs. `values` overrides the inputs of the pipeline, they can be strings with ranges or lists and units (e.g. "1:5:100 mJ") or quantities. All the arrays must have the same length.
+        Returns the dictionary of the arrays of the inputs and the dictionary of the arrays of the results of the nodes.
+        '''
+        inputs = dict()
+        for name, value in dict(self.inputs,**(values or {})).items():
+            # Values without the unit are in the first allowed unit, like in `run`
+            units = self.input_units(name)
+            if isinstance(value,str):
+                parts = value.strip().split(None,1)
+                try:
+                    value = sweep.parse_values(parts[0]) * self.engine.ureg(parts[1] if len(parts) > 1 else (units[0] if units else ""))
+                except ValueError as error:
+                    raise CalculationError(f"Cannot convert {name} to numbers! {error}")
+            else:
+                value = self.engine.input_quantity(value,units)
+            inputs[name] = value
+        results = dict()
+        for name in self.order:
+            node = self.nodes[name]
+            numbers = dict()
+            units = dict()
+            for key, value in self.nodes[name].get("inputs",{}).items():
+                target = reference(value)
+                if target is None:
+                    value = self.engine.input_quantity(value,self.allowed_units(name,key))
+                else:
+                    value = results[target] if target in results else inputs[target]
+                if hasattr(value,"units"):
+                    numbers[key] = value.magnitude
+                    units[key] = str(value.units)
+                else:
+                    numbers[key] = value
+            try:
+                if "unknown" in node:
+                    _, results[name] = self.engine.solve_batch(node["function"],numbers,node["unknown"],units,node.get("output"))
+                else:
+                    _, results[name] = self.engine.calculate_batch(node["function"],numbers,units,node.get("output"))
+            except CalculationError as error:
+                raise CalculationError(f"{name}: {error}")
+        return inputs, results
+
+
+def same(old,new):
+    '''
+    Compares the inputs of a node. Results of other nodes are compared by identity, because they are the same objects, when they were not calculated again.
+    '''
+    if old.keys() != new.keys():
+        return False
+    for key in old.keys():
+        if old[key] is new[key]:
+            continue
+        try:
+            if type(old[key]) is not type(new[key]) or not bool(old[key] == new[key]):
+                return False
+        except (TypeError, ValueError):
+            return False
+    return True
@@ -0,0 +1,104 @@
+import collections
+import hashlib
+import json
+import pickle
+import threading
+
+
+def definition_hash(definition):
+    '''
+    Hash of one function definition, the saved results are valid only as long as it doesn't change
+    '''
+    return hashlib.sha1(json.dumps(definition,sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResultCache():
+    '''
+    Results of the calculations by their normalized inputs, so that repeating the same calculation (e.g. with another output unit) only converts the result.
+    Keys are tuples starting with the function key, see `Engine.result_key`. Results are stored as plain numbers in base SI units together with the base unit, so they can be saved to a file without pint.
+    The results are kept in a LRU dictionary of at most `maxsize` items (0 turns the cache off) and they can be saved to `path` between the runs, the results of the functions changed in functions.json are left out when they are loaded.
+    '''
+    def __init__(self,settings,path=None,maxsize=1000):
+        self.settings = settings
+        self.path = path
+        self.maxsize = maxsize
+        self.results = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and self.maxsize > 0:
+            self.load()
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def get(self,key,base):
+        '''
+        Returns the stored results, if they are stored for the key and have the `base` unit (otherwise the output unit has a different dimension and pint reports the error), or None
+        '''
+        with self.lock:
+            stored = self.results.get(key)
+            if stored is None or stored[0] != base:
+                self.misses += 1
+                return None
+            self.results.move_to_end(key)
+            self.hits += 1
+            return stored[1]
+
+    def put(self,key,base,results):
+        '''
+        Stores the results and forgets the least recently used ones, if there are too many of them
+        '''
+        with self.lock:
+            self.results[key] = (base,results)
+            self.results.move_to_end(key)
+            while len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+
+    def invalidate(self,fun):
+        '''
+        Forgets the results of the function, which was changed in functions.json
+        '''
+        with self.lock:
+            for key in [key for key in self.results.keys() if key[0] == fun]:
+                del self.results[key]
+
+    def clear(self):
+        with self.lock:
+            self.results.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def statistics(self):
+        with self.lock:
+            return {"size":len(self.results),"maxsize":self.maxsize,"hits":self.hits,"misses":self.misses}
+
+    def load(self):
+        '''
+        Loads the results from the file, only for the functions with the same definition
+        '''
+        try:
+            with open(self.path,"rb") as file:
+                stored = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return
+        hashes = {fun: definition_hash(definition) for fun, definition in self.settings.items()}
+        with self.lock:
+            for key, value in stored.get("results",[]):
+                if key[0] in hashes and stored.get("hashes",{}).get(key[0]) == hashes[key[0]]:
+                    self.results[key] = value
+            while len(self.results) > self.maxsize:
+                self.results.popitem(last=False)
+
+    def save(self):
+        '''
+        Saves the results to the file together with the hashes of the definitions of their functions
+        '''
+        if self.path is None or not self.enabled:
+            return
+        with self.lock:
+            results = list(self.results.items())
+        hashes = {fun: definition_hash(self.settings[fun]) for fun in {key[0] for key, value in results} if fun in self.settings}
+        with open(self.path,"wb") as file:
+            pickle.dump({"hashes":hashes,"results":results},file)
@@ -0,0 +1,388 @@
+'''
+Local HTTP/JSON service of the laser calculator. Functions, constants, unit registry and symbolic solutions are loaded once and shared by all the requests, e.g.
+
+    laser-calculator serve --port 8765
+    curl -d '{"function": "peak-intensity", "inputs": {"Energy": "1 mJ", "Beam diameter": "2 mm", "Pulse duration": "100 fs"}}' localhost:8765/calculate
+
+Endpoints:
+    GET  /functions   list of the functions and their inputs
+    POST /calculate   {"function", "inputs": {name: value}, "output", "uncertainty", "samples"}
+    POST /solve       {"function", "unknown", "knowns": {name or key: value}, "output", "timeout", "method", "bracket", "uncertainty", "samples"}
+    POST /batch       {"requests": [{"type": "calculate" or "solve", ...}, ...]}, every request gets its result or error
+    GET  /metrics     request counts and latency histograms in the Prometheus text format
+    GET  /stats       count, p50/p95 latency and mean time of the stages of the calculations by function, when the instrumentation is enabled (--trace or --stats)
+    GET  /health
+Values are strings like "1 mJ" or "1 +- 0.1 mJ", numbers (in the first allowed unit) or [value, unit].
+'''
+import concurrent.futures
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+
+from engine import CalculationError, result_dict
+
+BUCKETS = (0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10,30) # Upper bounds of the latency histogram in seconds
+MAX_BODY = 10 * 1024 * 1024
+MAX_SAMPLES = 1000000 # Monte Carlo samples allowed in one request, more would take too much memory
+IDLE_TIMEOUT = 5 # Seconds, after which an idle kept-alive connection is closed, so that it doesn't block a worker
+
+
+class Metrics():
+    '''
+    Counts of the requests by endpoint and status, and histograms of their latencies
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict()
+        self.histograms = dict()
+        self.sums = dict()
+        self.started = time.time()
+
+    def observe(self,endpoint,status,seconds):
+        with self.lock:
+            self.counts[(endpoint,status)] = self.counts.get((endpoint,status),0) + 1
+            if endpoint not in self.histograms:
+                self.histograms[endpoint] = [0] * len(BUCKETS)
+                self.sums[endpoint] = 0
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    self.histograms[endpoint][i] += 1
+            self.sums[endpoint] += seconds
+
+    def render(self,engine):
+        '''
+        Returns the metrics in the Prometheus text format
+        '''
+        lines = ["# HELP laser_calculator_requests_total Number of requests by endpoint and HTTP status.",
+                 "# TYPE laser_calculator_requests_total counter"]
+        with self.lock:
+            for (endpoint, status), count in sorted(self.counts.items()):
+                lines.append(f'laser_calculator_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+            lines += ["# HELP laser_calculator_request_seconds Latency of the requests.",
+                      "# TYPE laser_calculator_request_seconds histogram"]
+            for endpoint, histogram in sorted(self.histograms.items()):
+                total = sum(count for (name, _), count in self.counts.items() if name == endpoint)
+                for bound, count in zip(BUCKETS,histogram):
+                    lines.append(f'laser_calculator_request_seconds_bucket{{endpoint="{endpoint}",le="{bound:g}"}} {count}')
+                lines.append(f'laser_calculator_request_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {total}')
+                lines.append(f'laser_calculator_request_seconds_sum{{endpoint="{endpoint}"}} {self.sums[endpoint]:.6f}')
+                lines.append(f'laser_calculator_request_seconds_count{{endpoint="{endpoint}"}} {total}')
+        lines += ["# HELP laser_calculator_cached_solutions Number of symbolic solutions in the cache.",
+                  "# TYPE laser_calculator_cached_solutions gauge",
+                  f"laser_calculator_cached_solutions {len(engine.solution_cache.solutions)}"]
+        cache = engine.result_cache.statistics()
+        lines += ["# HELP laser_calculator_result_cache_hits_total Calculations answered from the stored results.",
+                  "# TYPE laser_calculator_result_cache_hits_total counter",
+                  f"laser_calculator_result_cache_hits_total {cache['hits']}",
+                  "# HELP laser_calculator_result_cache_misses_total Calculations, which were not stored.",
+                  "# TYPE laser_calculator_result_cache_misses_total counter",
+                  f"laser_calculator_result_cache_misses_total {cache['misses']}",
+                  "# HELP laser_calculator_stored_results Number of the stored results.",
+                  "# TYPE laser_calculator_stored_results gauge",
+                  f"laser_calculator_stored_results {cache['size']}",
+                  "# HELP laser_calculator_uptime_seconds Time since the start of the service.",
+                  "# TYPE laser_calculator_uptime_seconds gauge",
+                  f"laser_calculator_uptime_seconds {time.time() - self.started:.3f}"]
+        return "\n".join(lines) + "\n"
+
+
+def is_number(value):
+    return isinstance(value,(int,float)) and not isinstance(value,bool)
+
+
+def parse_values(values):
+    '''
+    Values given as [value, unit] in JSON are converted to tuples, which the engine accepts
+    '''
+    if not isinstance(values,dict):
+        raise CalculationError("Inputs have to be an object of names and values")
+    for name, value in values.items():
+        if isinstance(value,list):
+            if len(value) != 2 or not (is_number(value[0]) or isinstance(value[0],str)) or not isinstance(value[1],str):
+                raise CalculationError(f"{name} has to be given as [value, unit]")
+        elif not is_number(value) and not isinstance(value,str):
+            raise CalculationError(f"{name} has to be a string, a number or [value, unit]")
+    return {name: tuple(value) if isinstance(value,list) else value for name, value in values.items()}
+
+
+def parse_text(request,name,required=False):
+    '''
+    Returns the string field of the request (e.g. the function or the unit of the output), None if it is not given
+    '''
+    value = request.get(name)
+    if value is None:
+        if required:
+            raise CalculationError(f"Missing {name}")
+        return None
+    if not isinstance(value,str):
+        raise CalculationError(f"{name.capitalize()} has to be a string")
+    return value
+
+
+def parse_bracket(request):
+    '''
+    Returns the bracket of the numeric solution as a tuple of two values, None if it is not given
+    '''
+    bracket = request.get("bracket")
+    if bracket is None:
+        return None
+    if not isinstance(bracket,list) or len(bracket) != 2 or not all(is_number(value) or isinstance(value,str) for value in bracket):
+        raise CalculationError("Bracket has to be a list of two values")
+    return tuple(bracket)
+
+
+def parse_timeout(request):
+    '''
+    Returns the timeout of the symbolic solution in seconds, None for the default of the engine
+    '''
+    timeout = request.get("timeout")
+    if timeout is None:
+        return None
+    if not is_number(timeout) or not 0 < timeout < float("inf"):
+        raise CalculationError("Timeout has to be a positive number of seconds")
+    return timeout
+
+
+def parse_samples(request):
+    '''
+    Returns the number of Monte Carlo samples from the request, None for the default of the engine
+    '''
+    samples = request.get("samples")
+    if samples is None:
+        return None
+    if isinstance(samples,float) and samples.is_integer():
+        samples = int(samples)
+    if not isinstance(samples,int) or isinstance(samples,bool) or not 1 < samples <= MAX_SAMPLES:
+        raise CalculationError(f"Samples have to be a whole number from 2 to {MAX_SAMPLES}")
+    return samples
+
+
+def calculate(engine,request):
+    fun = engine.function_key(parse_text(request,"function",required=True))
+    result = engine.calculate(fun,parse_values(request.get("inputs",{})),parse_text(request,"output"),parse_text(request,"uncertainty"),parse_samples(request))
+    return result_dict(engine.settings[fun]["outputs"]["name"],result)
+
+
+def solve(engine,request):
+    fun = engine.function_key(parse_text(request,"function",required=True))
+    unknown = engine.variable_key(fun,parse_text(request,"unknown",required=True))
+    method = parse_text(request,"method") or "auto"
+    if method not in ("auto","symbolic","numeric"):
+        raise CalculationError(f"Unknown method {method}, it has to be auto, symbolic or numeric")
+    results = engine.solve_all(fun,parse_values(request.get("knowns",{})),unknown,parse_text(request,"output"),timeout=parse_timeout(request),method=method,
+                               bracket=parse_bracket(request),uncertainty=parse_text(request,"uncertainty"),samples=parse_samples(request))
+    if len(results) == 0:
+        raise CalculationError("No solution found.")
+    name = engine.settings[fun]["variables"][unknown]["name"]
+    return {"name":name,"results":[result_dict(name,result) for result in results]}
+
+
+def batch(engine,request):
+    '''
+    Runs the requests one after another in one worker, so that a large batch doesn't take all the workers
+    '''
+    responses = []
+    items = request.get("requests",[])
+    if not isinstance(items,list):
+        raise CalculationError("Requests have to be a list")
+    for item in items:
+        try:
+            if not isinstance(item,dict):
+                raise CalculationError("Request has to be an object")
+            if item.get("type","calculate") == "calculate":
+                responses.append(calculate(engine,item))
+            elif item.get("type") == "solve":
+                responses.append(solve(engine,item))
+            else:
+                responses.append({"error":f"Unknown type {item.get('type')}"})
+        except CalculationError as error:
+            responses.append({"error":str(error)})
+        except Exception as error: # Failure of one request doesn't abort the others
+            responses.append({"error":f"{type(error).__name__}: {error}"})
+    return {"results":responses}
+
+
+def list_functions(engine):
+    functions = []
+    for fun in engine.functions:
+        definition = engine.settings[fun]
+        parameters = definition["inputs" if definition["regime"] == "calc" else "variables"]
+        functions.append({"key":fun,"name":definition["name"],"regime":definition["regime"],
+                          "inputs":[{"key":key,"name":parameters[key].get("name",key),"units":parameters[key]["units"]} for key in engine.parameters(fun)]})
+    return {"functions":functions,"invalid":engine.errors}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Connections are kept open between the requests of one client
+    server_version = "LaserCalculator"
+    timeout = IDLE_TIMEOUT
+    routes = {"/calculate":calculate,"/solve":solve,"/batch":batch}
+
+    def do_GET(self):
+        start = time.perf_counter()
+        path = self.path.split("?")[0]
+        if path == "/metrics":
+            self.send(200,self.server.metrics.render(self.server.engine),"text/plain; version=0.0.4")
+        elif path == "/functions":
+            self.send_json(200,list_functions(self.server.engine))
+        elif path == "/stats":
+            self.send_json(200,{"enabled":self.server.engine.instrumentation.enabled,"functions":self.server.engine.instrumentation.summary()})
+        elif path == "/health":
+            self.send_json(200,{"status":"ok"})
+        else:
+            self.send_json(404,{"error":f"Unknown endpoint {path}"})
+            self.server.metrics.observe("other",404,time.perf_counter() - start)
+            return
+        self.server.metrics.observe(path,200,time.perf_counter() - start)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        path = self.path.split("?")[0]
+        status, response = self.handle_post(path)
+        self.send_json(status,response)
+        self.server.metrics.observe(path if path in self.routes else "other",status,time.perf_counter() - start)
+
+    def handle_post(self,path):
+        if path not in self.routes:
+            return 404, {"error":f"Unknown endpoint {path}"}
+        try:
+            length = int(self.headers.get("Content-Length",0))
+        except ValueError:
+            return 400, {"error":"Invalid Content-Length"}
+        if length < 0:
+            return 400, {"error":"Invalid Content-Length"}
+        if length > MAX_BODY:
+            return 413, {"error":"Request is too large"}
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request,dict):
+                raise ValueError("Request has to be an object")
+        except ValueError as error:
+            return 400, {"error":f"Invalid JSON: {error}"}
+        try:
+            return 200, self.routes[path](self.server.engine,request)
+        except CalculationError as error:
+            return 400, {"error":str(error)}
+        except Exception as error:
+            self.log_error("%s failed: %r",path,error)
+            return 500, {"error":f"{type(error).__name__}: {error}"}
+
+    def send_json(self,status,response):
+        self.send(status,json.dumps(response),"application/json")
+
+    def send(self,status,text,content_type):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type",content_type)
+        self.send_header("Content-Length",str(len(body)))
+        if self.server.saturated(): # Other connections are waiting for a worker, so this one is not kept open
+            self.send_header("Connection","close")
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(body)
+
+    def address_string(self):
+        # Clients of the Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address,tuple) and self.client_address else "unix"
+
+    def log_message(self,format,*args):
+        if self.server.verbose:
+            super().log_message(format,*args)
+
+
+class PoolMixIn():
+    '''
+    Handles every connection in a pool of threads, so the number of the concurrent requests is limited by `workers`.
+    When all the workers are busy, the connections are closed after their response, so that idle kept-alive connections don't hold the workers.
+    '''
+    def start_pool(self,engine,workers,verbose):
+        self.engine = engine
+        self.metrics = Metrics()
+        self.verbose = verbose
+        self.workers = workers
+        self.connections = 0 # Connections being handled or waiting for a worker
+        self.connections_lock = threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers,thread_name_prefix="request")
+
+    def saturated(self):
+        return self.connections > self.workers
+
+    def process_request(self,request,client_address):
+        with self.connections_lock:
+            self.connections += 1
+        self.pool.submit(self.process_request_thread,request,client_address)
+
+    def process_request_thread(self,request,client_address):
+        try:
+            self.finish_request(request,client_address)
+        except Exception:
+            self.handle_error(request,client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.connections_lock:
+                self.connections -= 1
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
+
+
+class PooledHTTPServer(PoolMixIn,http.server.HTTPServer):
+    pass
+
+
+if hasattr(socketserver,"UnixStreamServer"):
+    class PooledUnixHTTPServer(PoolMixIn,socketserver.UnixStreamServer):
+        pass
+
+
+def create_server(engine,host="127.0.0.1",port=8765,socket_path=None,workers=4,verbose=False):
+    '''
+    Creates the server listening on the host and port, or on the Unix socket, if `socket_path` is given
+    '''
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = PooledUnixHTTPServer(socket_path,Handler)
+    else:
+        server = PooledHTTPServer((host,port),Handler)
+    server.start_pool(engine,workers,verbose)
+    return server
+
+
+def reload_periodically(engine,interval,stop):
+    '''
+    Loads the edited functions.json, constants.json and materials.json, see `Engine.reload`
+    '''
+    while not stop.wait(interval):
+        try:
+            engine.reload()
+        except CalculationError:
+            pass # File is probably just being saved, it is loaded next time
+
+
+def serve(engine,host="127.0.0.1",port=8765,socket_path=None,workers=4,reload_interval=2.0,verbose=False):
+    '''
+    Runs the service until it is interrupted, then the symbolic solutions are saved
+    '''
+    server = create_server(engine,host,port,socket_path,workers,verbose)
+    stop = threading.Event()
+    if reload_interval:
+        threading.Thread(target=reload_periodically,args=(engine,reload_interval,stop),daemon=True).start()
+    print(f"Serving on {socket_path or f'http://{host}:{server.server_address[1]}'}",flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+        engine.solve_worker.stop()
+        engine.solution_cache.save()
+        engine.result_cache.save()
+    return 0
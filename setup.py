@@ -1,7 +1,7 @@
 import sys
 from cx_Freeze import setup, Executable
 
-build_exe_options = {"include_files": ["Icon.ico","icons", "formulas", "screenshots", "constants.json", "functions.json", "README.html","version.txt"]}
+build_exe_options = {"include_files": ["Icon.ico","icons", "formulas", "screenshots", "constants.json", "functions.json", "materials.json", "README.html","version.txt"]}
 
 shortcut_table = [
     ("DesktopShortcut",        # Shortcut
@@ -30,7 +30,8 @@ setup(
     version = "1.1.0",
     description = "Calculator for laser and optics equations",
     options = {"build_exe": build_exe_options, "bdist_msi": bdist_msi_options,},
-    executables = [Executable("laser-calculator.py", base=base, icon="Icon.ico")]
+    executables = [Executable("laser-calculator.py", base=base, icon="Icon.ico"),
+                   Executable("cli.py", base=None, icon="Icon.ico", target_name="laser-calculator-cli")] # console version for scripts
 )
 
 # run by running `python setup.py build` or  `python setup.py bdist_msi`
\ No newline at end of file
@@ -0,0 +1,197 @@
+import collections
+import hashlib
+import pickle
+import threading
+
+import numpy as np
+
+
+def build_equation(definition):
+    '''
+    Evaluates the "function" of a solve-regime definition, where every variable is represented by a sympy symbol named by its key (a, b, ...). Returns the equation and the list of symbols ordered by position.
+    '''
+    import sympy # sympy takes long to import, so it is imported only when something has to be solved
+    I = [None] * len(definition["variables"])
+    for name in definition["variables"].keys():
+        I[definition["variables"][name]["position"]] = sympy.symbols(name)
+    equation = eval(definition["function"],{"np":np,"sympy":sympy,"I":I})
+    return equation, I
+
+
+def solve_equation(definition,unknown):
+    '''
+    Solves the equation of the definition for the variable with the key `unknown` and returns the list of all the solutions found by sympy
+    '''
+    import sympy
+    equation, I = build_equation(definition)
+    x = [symbol for symbol in I if symbol.name == unknown][0]
+    return sympy.solve(equation,x)
+
+
+def compile_solution(definition,unknown,solution):
+    '''
+    Compiles the symbolic solution into a numpy function. Its arguments are the remaining (known) variables ordered by position, which can be numbers or pint quantities.
+    Returns the function and the list of keys of its arguments.
+    '''
+    import sympy
+    arguments = sorted(definition["variables"].keys(),key=lambda name: definition["variables"][name]["position"])
+    arguments.remove(unknown)
+    function = sympy.lambdify([sympy.symbols(name) for name in arguments],solution,modules="numpy")
+    return function, arguments
+
+
+def file_hash(path):
+    '''
+    Hash of the file content, which is used to find out, whether the saved solutions are still valid
+    '''
+    with open(path,"rb") as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+class SolutionCache():
+    '''
+    Keeps the symbolic solutions of the equations, so that sympy.solve has to be called only once for every function and unknown.
+    The solutions are kept in a LRU dictionary and they can be saved to a file, which is valid only as long as functions.json doesn't change.
+    '''
+    def __init__(self,settings,path=None,functions_file="functions.json",maxsize=128):
+        '''
+        `settings` are the loaded definitions from functions.json, `path` is the optional file, where the solutions are stored between the runs
+        '''
+        self.settings = settings
+        self.path = path
+        self.maxsize = maxsize
+        self.solutions = collections.OrderedDict()
+        self.evaluators = dict() # Compiled solutions, they are not saved to the file
+        self.lock = threading.Lock()
+        self.warm_up_thread = None
+        try:
+            self.functions_hash = file_hash(functions_file)
+        except FileNotFoundError:
+            self.functions_hash = None
+        self.loaded = self.path is None # Solutions are loaded from the file only when needed, because unpickling them imports sympy
+
+    def get(self,fun,unknown):
+        '''
+        Returns the list of solutions of function `fun` for the variable `unknown`, solving the equation only if it is not cached yet
+        '''
+        if not self.loaded:
+            self.load()
+        key = (fun,unknown)
+        with self.lock:
+            if key in self.solutions:
+                self.solutions.move_to_end(key)
+                return self.solutions[key]
+        # Solving is done without the lock, so that other functions can be read in the meantime
+        solution = solve_equation(self.settings[fun],unknown)
+        self.put(fun,unknown,solution)
+        return solution
+
+    def evaluators_for(self,fun,unknown):
+        '''
+        Returns the list of compiled solutions (see `compile_solution`) of function `fun` for the variable `unknown`
+        '''
+        solution = self.get(fun,unknown)
+        key = (fun,unknown)
+        with self.lock:
+            compiled = self.evaluators.get(key)
+            if compiled is not None and compiled[0] is solution:
+                return compiled[1]
+        compiled = [compile_solution(self.settings[fun],unknown,sol) for sol in solution]
+        with self.lock:
+            self.evaluators[key] = (solution,compiled)
+        return compiled
+
+    def put(self,fun,unknown,solution):
+        '''
+        Saves the solution and forgets the least recently used one, if there are too many of them
+        '''
+        with self.lock:
+            self.solutions[(fun,unknown)] = solution
+            self.solutions.move_to_end((fun,unknown))
+            while len(self.solutions) > self.maxsize:
+                key, _ = self.solutions.popitem(last=False)
+                self.evaluators.pop(key,None)
+
+    def __contains__(self,key):
+        if not self.loaded:
+            self.load()
+        with self.lock:
+            return key in self.solutions
+
+    def invalidate(self,fun,functions_hash=None):
+        '''
+        Forgets the solutions of the function, which was changed in functions.json, `functions_hash` is the hash of the changed file
+        '''
+        with self.lock:
+            for key in [key for key in self.solutions.keys() if key[0] == fun]:
+                del self.solutions[key]
+            for key in [key for key in self.evaluators.keys() if key[0] == fun]:
+                del self.evaluators[key]
+            if functions_hash is not None:
+                self.functions_hash = functions_hash
+
+    def clear(self):
+        with self.lock:
+            self.solutions.clear()
+            self.evaluators.clear()
+
+    def load(self):
+        '''
+        Loads the solutions from the file, if they were solved for the same version of functions.json
+        '''
+        self.loaded = True
+        try:
+            with open(self.path,"rb") as file:
+                stored = pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return
+        if self.functions_hash is None or stored.get("hash") != self.functions_hash:
+            return
+        with self.lock:
+            for key, solution in stored["solutions"].items():
+                self.solutions.setdefault(key,solution)
+            while len(self.solutions) > self.maxsize:
+                self.solutions.popitem(last=False)
+
+    def save(self):
+        '''
+        Saves the solutions to the file together with the hash of functions.json
+        '''
+        if self.path is None:
+            return
+        if not self.loaded: # Nothing new could be solved
+            return
+        with self.lock:
+            stored = {"hash":self.functions_hash,"solutions":dict(self.solutions)}
+        with open(self.path,"wb") as file:
+            pickle.dump(stored,file)
+
+    def warm_up(self,timeout=None):
+        '''
+        Starts a background thread, which solves every equation for every variable, so that the solutions are ready, when the user needs them.
+        sympy runs in a separate process (see `workers.SolveWorker`), so that it doesn't slow down the program, and every equation is given at most `timeout` seconds.
+        '''
+        if self.warm_up_thread is not None and self.warm_up_thread.is_alive():
+            return
+        self.warm_up_thread = threading.Thread(target=self._warm_up,args=(timeout,),daemon=True)
+        self.warm_up_thread.start()
+
+    def _warm_up(self,timeout):
+        from workers import SolveWorker # workers import this module
+        worker = SolveWorker()
+        try:
+            for fun in list(self.settings.keys()):
+                definition = self.settings.get(fun)
+                if definition is None or definition.get("regime") != "solve":
+                    continue
+                for name in definition["variables"].keys():
+                    # Variables with assigned value cannot be solved for in the program
+                    if "value" in definition["variables"][name] or (fun,name) in self:
+                        continue
+                    try:
+                        self.put(fun,name,worker.solve(definition,name,timeout))
+                    except Exception:
+                        pass
+                self.save()
+        finally:
+            worker.stop()
@@ -0,0 +1,83 @@
+import numpy as np
+
+
+def is_sweep(text):
+    '''
+    Finds out, whether the input is a range (start:stop:n) or a list of values (a;b;c) instead of a single number
+    '''
+    return ":" in text or ";" in text
+
+
+def parse_values(text):
+    '''
+    Converts the input into a numpy array. Range `start:stop:n` gives n evenly spaced values including both ends, `a;b;c` gives the listed values and a single number gives 0-dimensional array.
+    Raises ValueError, if the input cannot be converted to numbers.
+    '''
+    text = text.strip().replace(",",".")
+    if ":" in text:
+        parts = [part.strip() for part in text.split(":")]
+        if len(parts) != 3:
+            raise ValueError(f"Range has to be in the form start:stop:n, not {text}")
+        return np.linspace(float(parts[0]),float(parts[1]),int(parts[2]))
+    if ";" in text:
+        return np.array([float(part) for part in text.split(";") if part.strip() != ""])
+    return np.array(float(text))
+
+
+def count_values(text):
+    '''
+    Returns the number of values of the input (see `parse_values`) without creating them, 1 for a single number.
+    Raises ValueError, if it is not a valid range.
+    '''
+    text = text.strip()
+    if ":" in text:
+        parts = text.split(":")
+        if len(parts) != 3:
+            raise ValueError(f"Range has to be in the form start:stop:n, not {text}")
+        return int(parts[2])
+    if ";" in text:
+        return len([part for part in text.split(";") if part.strip() != ""])
+    return 1
+
+
+def calculate_batch(ureg,definition,values,units,output_unit,code=None,unit=None,materials=None):
+    '''
+    Evaluates the function of a calc-regime definition once for whole arrays of inputs.
+    `values` and `units` are dictionaries with the input names as keys, values can be strings (see `parse_values`), numbers or arrays. All the arrays must have the same length, single numbers are used for every point.
+    Returns the dictionary of input arrays (with units) and the resulting array converted to `output_unit`.
+    `unit` parses the units, e.g. `Engine.unit`, which parses each unit only once, by default the registry is used. `materials` are the constants and material tables for the expression, see `materials.Materials`.
+    '''
+    unit = unit or ureg
+    names = sorted(definition["inputs"].keys(),key=lambda name: definition["inputs"][name]["position"])
+    arrays = []
+    for name in names:
+        value = values[name]
+        if isinstance(value,str):
+            value = parse_values(value)
+        arrays.append(np.asarray(value,dtype=float))
+    try:
+        arrays = np.broadcast_arrays(*arrays)
+    except ValueError:
+        raise ValueError("All swept inputs must have the same number of values")
+    I = [array * unit(units[name]) for name, array in zip(names,arrays)]
+    result = eval(definition["function"] if code is None else code,{"np":np,"ureg":ureg,"I":I,"materials":materials})
+    result = result.to(unit(output_unit))
+    if np.ndim(result.magnitude) == 0: # Function, which doesn't depend on the swept inputs
+        result = np.full(arrays[0].shape,result.magnitude) * result.units
+    return dict(zip(names,I)), result
+
+
+def export(path,inputs,output_name,result):
+    '''
+    Saves the swept inputs and results into a CSV file (columns with units in the header) or a NPY file (structured array with the names as fields), based on the extension of the `path`, which can also be an open file for CSV
+    '''
+    names = list(inputs.keys()) + [output_name]
+    columns = [np.broadcast_to(quantity.magnitude,result.shape) for quantity in inputs.values()] + [result.magnitude]
+    if isinstance(path,str) and path.lower().endswith(".npy"):
+        table = np.zeros(result.shape,dtype=[(name,float) for name in names])
+        for name, column in zip(names,columns):
+            table[name] = column
+        np.save(path,table)
+    else:
+        header = ",".join(f"{name} [{quantity.units:~}]" for name, quantity in list(inputs.items()) + [(output_name,result)])
+        np.savetxt(path,np.column_stack(columns),fmt="%.10g",delimiter=",",header=header,comments="")
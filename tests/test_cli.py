@@ -0,0 +1,21 @@
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli
+
+
+def test_calc_of_solve_regime(capsys):
+    assert cli.main(["calc","GDD","--a","1"]) == 1
+    assert "has to be solved" in capsys.readouterr().err
+
+
+def test_solve_of_calc_regime(capsys):
+    assert cli.main(["solve","peak-intensity","--unknown","Energy","--Beam diameter","2 mm"]) == 1
+    assert "has to be calculated" in capsys.readouterr().err
+
+
+def test_calc(capsys):
+    assert cli.main(["calc","peak-intensity","--Energy","1 mJ","--Beam diameter","2 mm","--Pulse duration","100 fs","--output","GW/cm^2"]) == 0
+    assert capsys.readouterr().out.startswith("Intensity = ")
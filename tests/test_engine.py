@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import Engine
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = Engine(results_size=0,solve_timeout=120)
+    yield engine
+    engine.solve_worker.stop()
+
+
+GDD_KNOWNS = {"Wavelength":"800 nm","Distance between gratings":"10 cm","Grating line density":"1500 1/mm"}
+
+
+def test_gdd_incidence_angle(engine):
+    # All the symbolic solutions are complex, the angle is found numerically
+    results = engine.solve_all("GDD",dict(GDD_KNOWNS,GDD="-712601 fs^2"),"Incidence angle")
+    assert len(results) == 1
+    assert results[0].to("deg").magnitude == pytest.approx(40,abs=1e-3)
+
+
+@pytest.mark.parametrize("uncertainty",["linear","montecarlo"])
+def test_gdd_incidence_angle_with_uncertainty(engine,uncertainty):
+    results = engine.solve_all("GDD",dict(GDD_KNOWNS,GDD="-712601 +- 100 fs^2"),"Incidence angle",uncertainty=uncertainty,samples=20000)
+    assert len(results) == 1
+    assert results[0].value.to("deg").magnitude == pytest.approx(40,abs=1e-3)
+    assert 0 < results[0].error.to("deg").magnitude < 0.01
+
+
+def test_numeric_default_range(engine):
+    # 100 fs is 1e-4 of the first unit (ns) of the pulse duration
+    results = engine.solve_all("power-energy-duration",{"Power":"10 GW","Energy":"1 mJ"},"Duration",method="numeric")
+    assert len(results) == 1
+    assert results[0].to("fs").magnitude == pytest.approx(100)
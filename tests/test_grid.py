@@ -0,0 +1,49 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli
+from engine import Engine, CalculationError
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = Engine(results_size=0,solve_timeout=120)
+    yield engine
+    engine.solve_worker.stop()
+
+
+def test_calc_grid(engine,tmp_path):
+    path = str(tmp_path / "grid.npy")
+    result, invalid = engine.calculate_grid("peak-fluence",{"Energy":"1:2:3","Beam diameter":"1;2"},{"Energy":"mJ","Beam diameter":"mm"},"J/cm^2",path,workers=1)
+    assert result.shape == (3,2)
+    assert invalid == 0
+    assert result[2,0] == pytest.approx(2 * result[0,0])
+    assert os.path.exists(tmp_path / "grid.json")
+
+
+def test_numeric_solve_grid(engine,tmp_path):
+    # All the symbolic solutions for the incidence angle are complex
+    path = str(tmp_path / "grid.npy")
+    values = {"Wavelength":"800","Distance between gratings":"10","Grating line density":"1500","GDD":"-712601;-600000"}
+    units = {"Wavelength":"nm","Distance between gratings":"cm","Grating line density":"1/mm","GDD":"fs^2"}
+    result, invalid = engine.calculate_grid("GDD",values,units,"deg",path,unknown="Incidence angle",workers=1)
+    assert invalid == 0
+    assert result[0] == pytest.approx(40,abs=1e-3)
+    knowns = {name: f"{value} {units[name]}" for name, value in values.items() if name != "GDD"}
+    expected = engine.solve("GDD",dict(knowns,GDD="-600000 fs^2"),"Incidence angle","deg")
+    assert result[1] == pytest.approx(expected.magnitude)
+
+
+def test_invalid_range(engine,tmp_path):
+    with pytest.raises(CalculationError):
+        engine.calculate_grid("peak-fluence",{"Energy":"1:2:x","Beam diameter":"2"},{},None,str(tmp_path / "grid.npy"),workers=1)
+
+
+def test_cli_invalid_range(tmp_path,capsys):
+    assert cli.main(["grid","peak-fluence","--Energy","1:2:x mJ","--Beam diameter","2 mm","--out",str(tmp_path / "grid.npy")]) == 1
+    assert "Cannot convert to numbers" in capsys.readouterr().err
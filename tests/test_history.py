@@ -0,0 +1,51 @@
+import datetime
+import json
+import os
+import sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HistoryStore
+
+
+def store(tmp_path,**options):
+    return HistoryStore(str(tmp_path / "history.sqlite3"),legacy_file=str(tmp_path / "history.json"),**options)
+
+
+def test_max_records(tmp_path):
+    history = store(tmp_path,max_records=3)
+    for i in range(5):
+        history.add("Peak intensity",f"Energy = {i} mJ",f"Intensity = {i} W/cm^2")
+    assert len(history) == 3
+    assert [record["inputs"] for record in history.records()] == ["Energy = 4 mJ","Energy = 3 mJ","Energy = 2 mJ"]
+    history.close()
+
+
+def test_keep_days(tmp_path):
+    old = (datetime.datetime.now() - datetime.timedelta(days=10)).isoformat(sep=" ",timespec="seconds")
+    with open(tmp_path / "history.json","w") as file:
+        json.dump({old:["Peak intensity","Energy = 1 mJ","Intensity = 1 W/cm^2"]},file)
+    history = store(tmp_path,keep_days=5)
+    assert len(history) == 0
+    assert os.path.exists(tmp_path / "history.json.imported")
+    history.close()
+
+
+def test_filters_and_pages(tmp_path):
+    history = store(tmp_path)
+    for i in range(4):
+        history.add("Peak intensity",f"Energy = {i} mJ","Intensity = 1 W/cm^2")
+    history.add("Snell law","n1 = 1, n2 = 1.5","theta2 = 19 deg")
+    assert [record["function"] for record in history.records(function="Snell law")] == ["Snell law"]
+    assert len(history.records(text="Energy")) == 4
+    assert len(history.records(text="theta2")) == 1
+    today = datetime.date.today().isoformat()
+    assert len(history.records(since=today,until=today)) == 5
+    assert history.records(until="2000-01-01") == []
+    first = history.records(limit=2)
+    second = history.records(limit=2,before_id=first[-1]["id"])
+    assert [record["inputs"] for record in second] == ["Energy = 2 mJ","Energy = 1 mJ"]
+    assert history.functions() == ["Peak intensity","Snell law"]
+    history.clear()
+    assert len(history) == 0
+    history.close()
@@ -0,0 +1,71 @@
+import copy
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import Engine, CalculationError
+from pipeline import Pipeline
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = Engine(results_size=0,solve_timeout=120)
+    yield engine
+    engine.solve_worker.stop()
+
+
+DEFINITION = {
+    "inputs": {"Wavelength": "800 nm", "Bandwidth": "10 nm", "Energy": "1 mJ"},
+    "nodes": {
+        "duration": {"function": "duration-bandwidth", "unknown": "Pulse duration", "output": "fs",
+                     "inputs": {"Wavelength": "$Wavelength", "Bandwidth": "$Bandwidth", "TBP": "0.441271"}},
+        "intensity": {"function": "peak-intensity",
+                      "inputs": {"Energy": "$Energy", "Beam diameter": "2 mm", "Pulse duration": "$duration"}},
+    },
+}
+
+
+def test_definition_is_not_changed(engine):
+    definition = copy.deepcopy(DEFINITION)
+    Pipeline(engine,definition)
+    assert definition == DEFINITION
+
+
+def test_incremental_recompute(engine):
+    chain = Pipeline(engine,copy.deepcopy(DEFINITION))
+    results = chain.run()
+    assert results["duration"].to("fs").magnitude == pytest.approx(94.2,abs=0.1)
+    assert chain.calculated == ["duration","intensity"]
+    chain.set(Energy="2 mJ")
+    assert chain.run()["intensity"].magnitude == pytest.approx(2 * results["intensity"].magnitude)
+    assert chain.calculated == ["intensity"]
+
+
+def test_batch_uses_allowed_units(engine):
+    chain = Pipeline(engine,copy.deepcopy(DEFINITION))
+    inputs, results = chain.run_batch({"Energy":"1;2"})
+    assert str(inputs["Energy"].units) == "joule"
+    assert results["intensity"].shape == (2,)
+
+
+def test_cycle(engine):
+    definition = {"nodes": {
+        "a": {"function": "power-energy-duration", "unknown": "Power", "inputs": {"Energy": "$b", "Duration": "1 ps"}},
+        "b": {"function": "power-energy-duration", "unknown": "Energy", "inputs": {"Power": "$a", "Duration": "1 ps"}},
+    }}
+    with pytest.raises(CalculationError,match="cycle"):
+        Pipeline(engine,definition)
+
+
+def test_unknown_reference(engine):
+    definition = {"nodes": {"a": {"function": "peak-fluence", "inputs": {"Energy": "$missing", "Beam diameter": "2 mm"}}}}
+    with pytest.raises(CalculationError,match="missing"):
+        Pipeline(engine,definition)
+
+
+def test_missing_unknown(engine):
+    with pytest.raises(CalculationError):
+        Pipeline(engine,{"nodes": {"a": {"function": "power-energy-duration", "inputs": {}}}})
@@ -0,0 +1,99 @@
+import http.client
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import Engine
+import service
+
+
+@pytest.fixture(scope="module")
+def server():
+    engine = Engine(results_size=0)
+    server = service.create_server(engine,port=0,workers=2)
+    thread = threading.Thread(target=server.serve_forever,daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    engine.solve_worker.stop()
+
+
+def post(server,path,body,headers=None):
+    connection = http.client.HTTPConnection(*server.server_address[:2],timeout=60)
+    body = body if isinstance(body,bytes) else json.dumps(body).encode()
+    connection.putrequest("POST",path)
+    for name, value in (headers or {"Content-Length":str(len(body))}).items():
+        connection.putheader(name,value)
+    connection.endheaders()
+    connection.send(body)
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+INPUTS = {"Energy":"1 mJ","Beam diameter":"2 mm","Pulse duration":"100 fs"}
+
+
+def test_calculate(server):
+    status, response = post(server,"/calculate",{"function":"peak-intensity","inputs":INPUTS,"output":"GW/cm^2"})
+    assert status == 200
+    assert response["name"] == "Intensity"
+
+
+@pytest.mark.parametrize("request_body",[
+    {"function":"peak-intensity","inputs":INPUTS,"output":5},
+    {"function":["x"],"inputs":INPUTS},
+    {"inputs":INPUTS},
+    {"function":"peak-intensity","inputs":{"Energy":{"value":1}}},
+    {"function":"peak-intensity","inputs":INPUTS,"uncertainty":"montecarlo","samples":0},
+    {"function":"peak-intensity","inputs":INPUTS,"samples":True},
+    {"function":"unknown-function","inputs":INPUTS},
+])
+def test_calculate_invalid(server,request_body):
+    status, response = post(server,"/calculate",request_body)
+    assert status == 400
+    assert "error" in response
+
+
+@pytest.mark.parametrize("request_body",[
+    {"function":"wavelength-frequency","unknown":"b","knowns":{"a":"800 nm"},"bracket":5},
+    {"function":"wavelength-frequency","unknown":"b","knowns":{"a":"800 nm"},"timeout":"long"},
+    {"function":"wavelength-frequency","unknown":"b","knowns":{"a":"800 nm"},"method":"guess"},
+    {"function":"wavelength-frequency","unknown":["b"],"knowns":{"a":"800 nm"}},
+    {"function":"wavelength-frequency","knowns":{"a":"800 nm"}},
+])
+def test_solve_invalid(server,request_body):
+    status, response = post(server,"/solve",request_body)
+    assert status == 400
+    assert "error" in response
+
+
+def test_batch_errors_per_item(server):
+    status, response = post(server,"/batch",{"requests":[
+        {"function":"peak-intensity","inputs":INPUTS},
+        {"function":"peak-intensity","inputs":INPUTS,"output":5},
+        "not an object",
+        {"type":"other"},
+    ]})
+    assert status == 200
+    results = response["results"]
+    assert "value" in results[0]
+    assert all("error" in result for result in results[1:])
+
+
+@pytest.mark.parametrize("length",["abc","-3"])
+def test_invalid_content_length(server,length):
+    assert post(server,"/calculate",b"{}",{"Content-Length":length})[0] == 400
+
+
+def test_invalid_json_and_endpoint(server):
+    assert post(server,"/calculate",b"[1, 2]")[0] == 400
+    assert post(server,"/calculate",b"{not json")[0] == 400
+    assert post(server,"/unknown",{})[0] == 404
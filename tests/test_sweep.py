@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sweep
+
+
+def test_range():
+    assert np.allclose(sweep.parse_values("1:2:5"),[1,1.25,1.5,1.75,2])
+
+
+def test_list_with_decimal_commas():
+    assert np.allclose(sweep.parse_values("1;2,5;;3"),[1,2.5,3])
+
+
+def test_single_value():
+    values = sweep.parse_values(" 4.5 ")
+    assert values.shape == ()
+    assert values == 4.5
+
+
+@pytest.mark.parametrize("text",["1:2","1:2:x","a;b","x"])
+def test_invalid(text):
+    with pytest.raises(ValueError):
+        sweep.parse_values(text)
+
+
+def test_count_values():
+    assert sweep.count_values("1:2:1000000000") == 1000000000
+    assert sweep.count_values("1;2;;3") == 3
+    assert sweep.count_values("5") == 1
+    with pytest.raises(ValueError):
+        sweep.count_values("1:2")
+
+
+def test_is_sweep():
+    assert sweep.is_sweep("1:2:3")
+    assert sweep.is_sweep("1;2")
+    assert not sweep.is_sweep("1.5")
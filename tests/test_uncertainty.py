@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import Engine, CalculationError
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = Engine(results_size=0)
+    yield engine
+    engine.solve_worker.stop()
+
+
+INTENSITY = {"Energy":"1 +- 0.01 mJ","Beam diameter":"2 mm","Pulse duration":"100 fs"}
+SNELL = {"n1":"1","n2":"1.5","theta1":"30 +- 1 deg"}
+
+
+def test_linear(engine):
+    result = engine.calculate("peak-intensity",INTENSITY,"GW/cm^2",uncertainty="linear")
+    assert result.method == "linear"
+    assert result.error.magnitude == pytest.approx(0.01 * result.value.magnitude)
+    lo, hi = result.interval()
+    assert lo < result.value < hi
+
+
+@pytest.mark.parametrize("function, inputs",[("peak-intensity",INTENSITY),("snell-law",SNELL)])
+def test_linear_and_montecarlo_agree(engine,function,inputs):
+    linear = engine.calculate(function,inputs,uncertainty="linear")
+    montecarlo = engine.calculate(function,inputs,uncertainty="montecarlo",samples=100000)
+    assert montecarlo.value.magnitude == pytest.approx(linear.value.magnitude,rel=1e-2)
+    assert montecarlo.error.magnitude == pytest.approx(linear.error.magnitude,rel=5e-2)
+
+
+def test_montecarlo_outside_of_domain(engine):
+    with pytest.raises(CalculationError):
+        engine.calculate("snell-law",{"n1":"2 +- 0.01","n2":"1","theta1":"80 deg"},uncertainty="montecarlo",samples=1000)
+
+
+def test_unknown_method(engine):
+    with pytest.raises(CalculationError):
+        engine.calculate("peak-intensity",INTENSITY,uncertainty="exact")
@@ -0,0 +1,244 @@
+import statistics
+
+import numpy as np
+
+PERCENTILES = (2.5,16,50,84,97.5) # Reported percentiles, 2.5 and 97.5 give the 95 % interval
+SAMPLES = 100000 # Default number of Monte Carlo samples
+
+
+class Estimate():
+    '''
+    Result with uncertainty: the mean `value`, the standard deviation `error` and the `percentiles` (dictionary percent: value), all pint quantities in the same unit.
+    It can be formatted like pint Measurement, so it can be shown instead of it.
+    `method` is "linear" or "montecarlo" and `samples` the number of valid Monte Carlo samples.
+    '''
+    def __init__(self,value,error,percentiles,method,samples=None):
+        self.value = value
+        self.error = error.to(value.units)
+        self.percentiles = {p: x.to(value.units) for p, x in percentiles.items()}
+        self.method = method
+        self.samples = samples
+
+    @classmethod
+    def normal(cls,value,error,method="linear"):
+        '''
+        Estimate of normally distributed result, percentiles are calculated from the mean and the standard deviation
+        '''
+        distribution = statistics.NormalDist()
+        return cls(value,error,{p: value + distribution.inv_cdf(p / 100) * error for p in PERCENTILES},method)
+
+    @classmethod
+    def from_samples(cls,result):
+        '''
+        Estimate from the array of Monte Carlo results, samples which are not finite numbers (e.g. outside of the domain of arcsin) are left out
+        '''
+        magnitude = np.real_if_close(np.asarray(result.magnitude))
+        magnitude = magnitude[np.isfinite(magnitude) & (np.imag(magnitude) == 0)].real
+        if magnitude.size < 2:
+            raise ValueError("No valid samples.")
+        units = result.units
+        percentiles = np.percentile(magnitude,PERCENTILES)
+        return cls(magnitude.mean() * units,magnitude.std(ddof=1) * units,{p: x * units for p, x in zip(PERCENTILES,percentiles)},"montecarlo",magnitude.size)
+
+    @property
+    def units(self):
+        return self.value.units
+
+    def measurement(self):
+        return self.value.plus_minus(float(self.error.magnitude))
+
+    @property
+    def magnitude(self):
+        return self.measurement().magnitude
+
+    def interval(self):
+        '''
+        Returns the 95 % interval as a tuple of two quantities
+        '''
+        return self.percentiles[PERCENTILES[0]], self.percentiles[PERCENTILES[-1]]
+
+    def to(self,unit):
+        return Estimate(self.value.to(unit),self.error.to(unit),self.percentiles,self.method,self.samples)
+
+    def __format__(self,spec):
+        return format(self.measurement(),spec)
+
+    def __str__(self):
+        return str(self.measurement())
+
+
+class Symbolic():
+    '''
+    Sympy expression, which behaves like a pint quantity in the expressions of functions.json. The variables are magnitudes in base SI units, so the conversions by `.to` don't change them.
+    '''
+    def __init__(self,expression):
+        self.expression = expression
+
+    def to(self,unit):
+        return self
+
+    def to_base_units(self):
+        return self
+
+    def __add__(self,other):
+        return Symbolic(self.expression + unwrap(other))
+
+    def __radd__(self,other):
+        return Symbolic(unwrap(other) + self.expression)
+
+    def __sub__(self,other):
+        return Symbolic(self.expression - unwrap(other))
+
+    def __rsub__(self,other):
+        return Symbolic(unwrap(other) - self.expression)
+
+    def __mul__(self,other):
+        return Symbolic(self.expression * unwrap(other))
+
+    def __rmul__(self,other):
+        return Symbolic(unwrap(other) * self.expression)
+
+    def __truediv__(self,other):
+        return Symbolic(self.expression / unwrap(other))
+
+    def __rtruediv__(self,other):
+        return Symbolic(unwrap(other) / self.expression)
+
+    def __pow__(self,other):
+        return Symbolic(self.expression ** unwrap(other))
+
+    def __rpow__(self,other):
+        return Symbolic(unwrap(other) ** self.expression)
+
+    def __neg__(self):
+        return Symbolic(-self.expression)
+
+    def __pos__(self):
+        return self
+
+    def __abs__(self):
+        import sympy
+        return Symbolic(sympy.Abs(self.expression))
+
+
+def unwrap(value):
+    return value.expression if isinstance(value,Symbolic) else value
+
+
+class SymbolicNumpy():
+    '''
+    Stands in for numpy in the expressions, the functions are replaced by the sympy ones
+    '''
+    names = {"arcsin":"asin","arccos":"acos","arctan":"atan","arctan2":"atan2","arcsinh":"asinh","arccosh":"acosh","arctanh":"atanh","abs":"Abs","absolute":"Abs","power":"Pow"}
+
+    def __getattr__(self,name):
+        import sympy
+        if name == "pi":
+            return sympy.pi
+        if name == "e":
+            return sympy.E
+        if name == "log10":
+            return lambda x: Symbolic(sympy.log(unwrap(x),10))
+        if name == "square":
+            return lambda x: Symbolic(unwrap(x) ** 2)
+        function = getattr(sympy,self.names.get(name,name))
+        return lambda *arguments: Symbolic(function(*[unwrap(x) for x in arguments]))
+
+
+class SymbolicRegistry():
+    '''
+    Stands in for the unit registry in the expressions, units are replaced by their magnitude in base SI units
+    '''
+    def __init__(self,ureg):
+        self.ureg = ureg
+
+    def __call__(self,text):
+        return Symbolic(self.ureg(text).to_base_units().magnitude)
+
+    def __getattr__(self,name):
+        return Symbolic((1 * getattr(self.ureg,name)).to_base_units().magnitude)
+
+
+def symbolic_expression(code,count,ureg):
+    '''
+    Evaluates the compiled expression of calc-regime function with `count` inputs symbolically. Returns the sympy expression and the list of symbols, which stand for the inputs in base SI units.
+    '''
+    import sympy
+    symbols = [sympy.Symbol(f"I{i}") for i in range(count)]
+    result = eval(code,{"np":SymbolicNumpy(),"ureg":SymbolicRegistry(ureg),"I":[Symbolic(symbol) for symbol in symbols]})
+    return sympy.sympify(unwrap(result)), symbols
+
+
+class LinearPropagation():
+    '''
+    First-order propagation of uncertainties through the partial derivatives of the expression, which are derived by sympy and compiled, when they are needed for the first time
+    '''
+    def __init__(self,expression,symbols):
+        import sympy
+        self.expression = expression
+        self.symbols = symbols
+        self.function = sympy.lambdify(symbols,expression,modules="numpy")
+        self.derivatives = dict()
+
+    def derivative(self,i):
+        if i not in self.derivatives:
+            import sympy
+            self.derivatives[i] = sympy.lambdify(self.symbols,sympy.diff(self.expression,self.symbols[i]),modules="numpy")
+        return self.derivatives[i]
+
+    def __call__(self,values,errors):
+        '''
+        Returns the value of the expression and its standard deviation, `values` and `errors` are the magnitudes of the arguments and their standard deviations
+        '''
+        with np.errstate(all="ignore"):
+            value = self.function(*values)
+            variance = sum((self.derivative(i)(*values) * error) ** 2 for i, error in enumerate(errors) if error)
+        return value, np.sqrt(variance)
+
+
+class NumericPropagation():
+    '''
+    First-order propagation of uncertainties through the partial derivatives found by central differences, used for the functions, which sympy cannot derive (e.g. interpolated material tables).
+    `function` takes pint quantities, `units` are the base SI units of its arguments.
+    '''
+    def __init__(self,function,units,step=1e-6):
+        self.function = function
+        self.units = units
+        self.step = step
+
+    def evaluate(self,values):
+        result = self.function(*[value * unit for value, unit in zip(values,self.units)])
+        return result.to_base_units().magnitude if hasattr(result,"to_base_units") else result
+
+    def __call__(self,values,errors):
+        '''
+        Returns the value of the function and its standard deviation, `values` and `errors` are the magnitudes of the arguments in base SI units and their standard deviations
+        '''
+        with np.errstate(all="ignore"):
+            value = self.evaluate(values)
+            variance = 0
+            for i, error in enumerate(errors):
+                if not error:
+                    continue
+                h = self.step * (abs(values[i]) or error)
+                up, down = list(values), list(values)
+                up[i] += h
+                down[i] -= h
+                variance += ((self.evaluate(up) - self.evaluate(down)) / (2 * h) * error) ** 2
+        return value, np.sqrt(variance)
+
+
+def monte_carlo(function,values,errors,samples=SAMPLES,rng=None):
+    '''
+    Draws `samples` normally distributed values of every argument with nonzero error and evaluates the function once for all of them.
+    `values` and `errors` are pint quantities, returns the array of results.
+    '''
+    rng = rng if rng is not None else np.random.default_rng()
+    arguments = []
+    for value, error in zip(values,errors):
+        if error:
+            arguments.append(rng.normal(value.magnitude,error.to(value.units).magnitude,samples) * value.units)
+        else:
+            arguments.append(value)
+    with np.errstate(all="ignore"):
+        return function(*arguments)
@@ -0,0 +1,118 @@
+'''
+Unit conversions without parsing the unit strings again and again. Every unit is parsed once into the pint unit and its factor to base SI units.
+Expressions of the calc regime are also compiled into plain-number versions (see `base_code`), which take and return magnitudes in base SI units, so only the inputs and the result need pint.
+'''
+import ast
+import threading
+
+import numpy as np
+import pint
+
+TOLERANCE = 1e-9 # Relative difference allowed between the plain-number and pint results
+TEST_VALUE = 0.7 # Inputs of the comparison in their first units, not 1, so that missed conversions show up
+
+
+class Conversion():
+    '''
+    Parsed unit: pint `unit`, `factor`, which converts its magnitudes to base SI units, `dimensionality` and the `base` unit as a string
+    '''
+    def __init__(self,unit,factor,dimensionality,base):
+        self.unit = unit
+        self.factor = factor
+        self.dimensionality = dimensionality
+        self.base = base
+
+
+class UnitTable():
+    '''
+    Conversions of units given by strings (e.g. "mJ") or pint units, each is parsed only once.
+    `get` returns None for units, which cannot be converted just by a factor (e.g. degC) or are unknown, these are left to pint.
+    '''
+    def __init__(self,ureg):
+        self.ureg = ureg
+        self.conversions = dict()
+        self.lock = threading.Lock()
+
+    def get(self,unit):
+        if unit in self.conversions:
+            return self.conversions[unit]
+        try:
+            quantity = self.ureg(unit) if isinstance(unit,str) else 1 * unit
+            conversion = None
+            if quantity.magnitude == 1: # Not units like "10 mm"
+                base = quantity.to_base_units()
+                conversion = Conversion(quantity.units,float(base.magnitude),quantity.dimensionality,str(base.units))
+        except (pint.PintError, AttributeError, SyntaxError, TypeError, ValueError):
+            conversion = None
+        with self.lock:
+            self.conversions[unit] = conversion
+        return conversion
+
+    def factor(self,quantity):
+        '''
+        Returns the magnitude of the quantity in base SI units and the conversion of its unit, or (None, None)
+        '''
+        conversion = self.get(quantity.units)
+        if conversion is None:
+            return None, None
+        return quantity.magnitude * conversion.factor, conversion
+
+
+class BaseUnits(ast.NodeTransformer):
+    '''
+    Changes the expression to work with plain numbers in base SI units: conversions like I[0].to("rad") are left out and units like ureg("mm") or ureg.mm are replaced by their factors
+    '''
+    def __init__(self,table):
+        self.table = table
+
+    def factor(self,unit,node):
+        conversion = self.table.get(unit)
+        if conversion is None:
+            raise ValueError(f"unit {unit} cannot be converted by a factor")
+        return ast.copy_location(ast.Constant(conversion.factor),node)
+
+    def visit_Call(self,node):
+        self.generic_visit(node)
+        if isinstance(node.func,ast.Attribute) and node.func.attr in ("to","to_base_units"):
+            return node.func.value
+        if isinstance(node.func,ast.Name) and node.func.id == "ureg":
+            if len(node.args) != 1 or not isinstance(node.args[0],ast.Constant) or not isinstance(node.args[0].value,str):
+                raise ValueError("ureg has to be called with a unit")
+            return self.factor(node.args[0].value,node)
+        return node
+
+    def visit_Attribute(self,node):
+        self.generic_visit(node)
+        if isinstance(node.value,ast.Name) and node.value.id == "ureg":
+            return self.factor(node.attr,node)
+        return node
+
+    def visit_Name(self,node):
+        if node.id == "ureg":
+            raise ValueError("ureg cannot be used directly")
+        return node
+
+
+def base_code(ureg,key,expression,table,quantities,materials=None):
+    '''
+    Compiles the plain-number version of the expression of calc-regime function. It is compared with pint for `quantities` (inputs ordered by position), and None is returned, if it cannot be compiled or if it gives a different result, so pint has to be used for this function.
+    The plain-number version gets `materials.plain`, which works with base SI units too (see `materials.Materials`).
+    '''
+    try:
+        tree = BaseUnits(table).visit(ast.parse(expression,mode="eval"))
+        code = compile(ast.fix_missing_locations(tree),f"<{key} in base units>","eval")
+        magnitudes = []
+        for quantity in quantities:
+            magnitude, conversion = table.factor(quantity)
+            if conversion is None:
+                return None
+            magnitudes.append(magnitude)
+        with np.errstate(all="ignore"):
+            expected = eval(compile(expression,f"<{key}>","eval"),{"np":np,"ureg":ureg,"I":list(quantities),"materials":materials})
+            result = eval(code,{"np":np,"I":magnitudes,"materials":getattr(materials,"plain",None)})
+        expected = expected.to_base_units().magnitude if hasattr(expected,"to_base_units") else expected
+        if not np.isfinite(expected) or not np.isclose(result,expected,rtol=TOLERANCE,atol=0):
+            return None
+        return code
+    except Exception: # Anything, what cannot be evaluated with plain numbers the same way
+        return None
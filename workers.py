@@ -0,0 +1,123 @@
+import multiprocessing
+import time
+
+from solution_cache import solve_equation
+
+
+def worker_loop(connection):
+    '''
+    Runs in the worker process: receives (definition, unknown) requests, solves them and sends back ("ok", solutions) or ("error", message)
+    '''
+    import sympy # Imported in advance, so that the first solution is not slowed down
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is None:
+            return
+        definition, unknown = request
+        try:
+            connection.send(("ok",solve_equation(definition,unknown)))
+        except Exception as error:
+            connection.send(("error",f"{type(error).__name__}: {error}"))
+
+
+class SolveWorker():
+    '''
+    Separate process for the symbolic solutions by sympy, which can take long. Unlike a thread, the process can be stopped, when the user cancels the solution or when it takes too long.
+    Only one solution runs at a time. The process is started when needed and started again after cancelling.
+    '''
+    def __init__(self):
+        self.process = None
+        self.connection = None
+        self.request = None
+        self.started = None
+
+    def start(self):
+        '''
+        Starts the process, if it is not running. It can be called in advance, because starting the process and importing sympy takes a while.
+        '''
+        if self.process is not None and self.process.is_alive():
+            return
+        context = multiprocessing.get_context("spawn")
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=worker_loop,args=(child,),daemon=True)
+        self.process.start()
+        child.close()
+
+    @property
+    def busy(self):
+        return self.request is not None
+
+    def submit(self,definition,unknown):
+        '''
+        Starts solving the equation of the definition for the variable with the key `unknown`. The result is obtained by `poll`.
+        '''
+        if self.busy:
+            self.cancel()
+        self.start()
+        self.connection.send((definition,unknown))
+        self.request = unknown
+        self.started = time.monotonic()
+
+    def elapsed(self):
+        '''
+        Time in seconds since the current request was submitted
+        '''
+        return 0 if self.started is None else time.monotonic() - self.started
+
+    def poll(self,timeout=0):
+        '''
+        Waits at most `timeout` seconds and returns None, if the solution is still running, or ("ok", solutions) or ("error", message)
+        '''
+        if not self.busy:
+            return None
+        try:
+            ready = self.connection.poll(timeout)
+        except (OSError, EOFError):
+            ready = True
+        if not ready:
+            if self.process.is_alive():
+                return None
+            ready = self.connection.poll() # The process may have ended just after sending the result
+            if not ready:
+                self.request = None
+                self.process = None
+                return ("error","Solving process ended unexpectedly.")
+        try:
+            reply = self.connection.recv()
+        except (OSError, EOFError):
+            reply = ("error","Solving process ended unexpectedly.")
+            self.process = None
+        self.request = None
+        return reply
+
+    def cancel(self):
+        '''
+        Stops the current solution by terminating the process
+        '''
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+        self.request = None
+
+    def solve(self,definition,unknown,timeout=None):
+        '''
+        Solves the equation and waits for the result. Raises TimeoutError, if it takes longer than `timeout` seconds, and RuntimeError, if sympy fails.
+        '''
+        self.submit(definition,unknown)
+        reply = self.poll(timeout)
+        if reply is None:
+            self.cancel()
+            raise TimeoutError(f"Solving took longer than {timeout} s.")
+        if reply[0] == "error":
+            raise RuntimeError(reply[1])
+        return reply[1]
+
+    def stop(self):
+        '''
+        Ends the process
+        '''
+        self.cancel()